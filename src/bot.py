@@ -1,18 +1,35 @@
+import io
 import os
 import logging
-from telegram import Update
+import threading
+from telegram import Bot, Update
 from telegram.ext import (
-    Updater, CommandHandler, CallbackQueryHandler,
-    MessageHandler, Filters, ConversationHandler
+    Updater, CommandHandler, CallbackQueryHandler, DispatcherHandlerStop,
+    MessageHandler, Filters, ConversationHandler, TypeHandler, InlineQueryHandler
 )
 from telegram.error import TelegramError
 
 from models.user_data import UserDataManager
 from utils.subscription_manager import SubscriptionManager
 from handlers.base import BaseHandler
-from config import BOT_TOKEN, CHOOSING_NAME_SURNAME, ENTERING_LESSONS_COUNT, CHOOSING_CATEGORY_NAME
+from utils.sharding import migrate_directory
+from utils.cache import document_cache
+from utils.durability import group_committer
+from utils.http import build_request
+from utils.metrics import metrics
+from utils.polling import OffsetStore, TunedUpdater
+from utils import snapshots, tracing
+from utils.tenants import Tenant, current_tenant
+from utils.throttling import Throttle
+from config import (
+    BOT_TOKEN, CHOOSING_NAME_SURNAME, ENTERING_LESSONS_COUNT, CHOOSING_CATEGORY_NAME,
+    USERS_DATA_DIR, MIGRATE_SHARDS_ON_START, WORKER_PROCESSES, DISPATCHER_WORKERS, ADMIN_IDS,
+    POLLING_SETTINGS, POLLING_OFFSET_FILE, SNAPSHOT_INTERVAL, THROTTLE_SETTINGS, ARCHIVE_INTERVAL,
+    DATA_DIR, SNAPSHOT_DIR, TENANTS
+)
 from src.handlers.category_manager import CategoryManager
 from src.handlers.subscription import SubscriptionHandler
+from src.handlers.rosters import RosterHandler
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,29 +38,180 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def migrate_data_layout(subscriptions_dir: str, users_dir: str = USERS_DATA_DIR):
+    """Перенос файлов данных в шардированную раскладку без остановки бота"""
+    for data_dir in (subscriptions_dir, users_dir):
+        try:
+            migrate_directory(data_dir)
+        except Exception as e:
+            logger.error(f"Ошибка миграции каталога {data_dir}: {e}")
+
+def create_updater(dispatcher=None, offset_file: str = POLLING_OFFSET_FILE,
+                   record_processed: bool = True) -> TunedUpdater:
+    """Updater с пулом соединений, таймаутами и настройками polling из конфига
+
+    В режиме нескольких студий Bot и Dispatcher студии на общих ресурсах
+    создает TenantHost и передает сюда. Без `record_processed` смещение
+    сохраняет не Updater (многопроцессный режим: см. WorkerPool.track).
+    """
+    if dispatcher is None:
+        bot = Bot(BOT_TOKEN, request=build_request(DISPATCHER_WORKERS))
+        source = {'bot': bot, 'workers': DISPATCHER_WORKERS}
+    else:
+        source = {'dispatcher': dispatcher}
+    updater = TunedUpdater(
+        **source,
+        offset_store=OffsetStore(offset_file),
+        limit=POLLING_SETTINGS['limit'],
+        max_poll_interval=POLLING_SETTINGS['max_poll_interval'],
+        drain_on_start=POLLING_SETTINGS['drain_on_start'],
+    )
+    # Последняя группа: фиксируем update_id после всех обработчиков
+    if record_processed:
+        updater.dispatcher.add_handler(TypeHandler(Update, updater.record_processed), group=99)
+    return updater
+
+def start_polling(updater: Updater):
+    """Запуск long polling с настройками из конфига"""
+    updater.start_polling(
+        poll_interval=POLLING_SETTINGS['poll_interval'],
+        timeout=POLLING_SETTINGS['timeout'],
+        allowed_updates=POLLING_SETTINGS['allowed_updates'],
+    )
+
+def show_metrics(update: Update, context):
+    """Команда /metrics для администраторов"""
+    if update.effective_chat.id not in ADMIN_IDS:
+        return
+    cache = '\n'.join(
+        f"{os.path.basename(name) or name}: {documents} док., {size // 1024} КБ"
+        for name, (documents, size) in sorted(document_cache.usage().items())
+    )
+    update.message.reply_text(f"📊 Метрики\n\n{metrics.format()}\n\n🗂 Кэш документов\n{cache or '-'}")
+
+def show_slow_traces(update: Update, context):
+    """Команда /slow [N] для администраторов: последние медленные обновления"""
+    if update.effective_chat.id not in ADMIN_IDS:
+        return
+    limit = int(context.args[0]) if context.args and context.args[0].isdigit() else 3
+    entries = tracing.slow_log.latest(max(1, min(limit, 10)))
+    if not entries:
+        update.message.reply_text(
+            f"🐢 Медленных обновлений (дольше {tracing.slow_log.threshold:g} с) пока не было"
+        )
+        return
+    text = '\n\n'.join(tracing.format_trace(entry) for entry in entries)
+    # Лимит длины сообщения Telegram
+    update.message.reply_text(text[-4000:])
+
+def snapshot_dirs(tenant: Tenant = None):
+    """Каталог данных и каталог снимков студии (по умолчанию - текущей)"""
+    tenant = tenant or current_tenant()
+    if tenant is None:
+        return DATA_DIR, SNAPSHOT_DIR
+    return tenant.data_dir, os.path.join(SNAPSHOT_DIR, tenant.name)
+
+def snapshot_committer(context):
+    """Учет изменений и барьер для снимка: в многопроцессном режиме - всех процессов"""
+    return context.bot_data.get('snapshot_committer', group_committer)
+
+def show_snapshots(update: Update, context):
+    """Команда /snapshot [list] для администраторов"""
+    if update.effective_chat.id not in ADMIN_IDS:
+        return
+    if context.args and context.args[0].lower() == 'list':
+        names = snapshots.list_snapshots(snapshot_dirs()[1])
+        update.message.reply_text(
+            "🗄 Снимки данных\n\n" + ('\n'.join(names) if names else "Снимков пока нет")
+        )
+        return
+    
+    try:
+        name = snapshots.create_snapshot(*snapshot_dirs(), committer=snapshot_committer(context))
+    except OSError as e:
+        logger.error(f"Ошибка при создании снимка данных: {e}")
+        update.message.reply_text("❌ Не удалось создать снимок данных")
+        return
+    update.message.reply_text(f"✅ Снимок данных создан: {name}")
+
+def take_scheduled_snapshot(context):
+    """Задача JobQueue: периодический снимок данных"""
+    try:
+        snapshots.create_snapshot(*snapshot_dirs(context.job.context), committer=snapshot_committer(context))
+    except Exception as e:
+        logger.error(f"Ошибка при создании снимка данных по расписанию: {e}")
+
+def schedule_snapshots(updater: Updater, tenant: Tenant = None):
+    """Периодические снимки данных, если они включены в конфиге"""
+    if SNAPSHOT_INTERVAL > 0:
+        updater.job_queue.run_repeating(
+            take_scheduled_snapshot, interval=SNAPSHOT_INTERVAL, first=SNAPSHOT_INTERVAL,
+            context=tenant, name='snapshots'
+        )
+
+def run_scheduled_archival(context):
+    """Задача JobQueue: перенос закончившихся и брошенных абонементов в архив"""
+    try:
+        context.job.context.archive_idle()
+    except Exception as e:
+        logger.error(f"Ошибка при архивации абонементов по расписанию: {e}")
+
+def schedule_archival(updater: Updater, subscription_manager: SubscriptionManager):
+    """Периодическая архивация абонементов, если она включена в конфиге"""
+    if ARCHIVE_INTERVAL > 0:
+        # Первый проход вскоре после запуска: бот может перезапускаться чаще ARCHIVE_INTERVAL
+        updater.job_queue.run_repeating(
+            run_scheduled_archival, interval=ARCHIVE_INTERVAL, first=60,
+            context=subscription_manager, name='archive'
+        )
+
 class DanceBot:
     """Основной класс бота для управления абонементами"""
     
-    def __init__(self):
-        """Инициализация бота"""
-        self.updater = Updater(BOT_TOKEN)
-        self.dp = self.updater.dispatcher
+    def __init__(self, dispatcher=None, tenant: Tenant = None):
+        """Инициализация бота
+
+        В многопроцессном режиме процесс-обработчик передает свой
+        Dispatcher, и Updater в нем не создается. В режиме нескольких
+        студий передаются Dispatcher и студия: абонементы хранятся в ее
+        каталоге данных.
+        """
+        if dispatcher is None:
+            self.updater = create_updater()
+            self.dp = self.updater.dispatcher
+        else:
+            self.updater = None
+            self.dp = dispatcher
         
         # Инициализация менеджеров
-        self.subscription_manager = SubscriptionManager()
+        if tenant is None:
+            self.subscription_manager = SubscriptionManager()
+        else:
+            self.subscription_manager = SubscriptionManager(tenant.data_dir)
         
         # Инициализация обработчиков
         self.subscription_handler = SubscriptionHandler(self.subscription_manager)
         self.category_manager = CategoryManager()
+        self.roster_handler = RosterHandler()
         
         # Регистрация обработчиков
         self._setup_handlers()
     
     def _setup_handlers(self):
         """Настройка обработчиков команд"""
+        # Ограничение частоты до всех остальных обработчиков
+        self.throttle = Throttle(**THROTTLE_SETTINGS)
+        self.dp.add_handler(TypeHandler(Update, self.throttle.middleware), group=-1)
+        
         # Обработчик команды /start
         self.dp.add_handler(CommandHandler('start', self.subscription_handler.start))
         
+        # Метрики и аналитика для администраторов
+        self.dp.add_handler(CommandHandler('metrics', show_metrics))
+        self.dp.add_handler(CommandHandler('slow', show_slow_traces))
+        self.dp.add_handler(CommandHandler('analytics', self.show_analytics, run_async=True))
+        self.dp.add_handler(CommandHandler('snapshot', show_snapshots, run_async=True))
+        
         # Обработчик создания абонемента
         subscription_conv_handler = ConversationHandler(
             entry_points=[
@@ -122,15 +290,49 @@ class DanceBot:
         for handler in self.category_manager.handlers:
             self.dp.add_handler(handler)
         
+        # Общие списки студии
+        for command in self.roster_handler.commands:
+            self.dp.add_handler(command)
+        
         # Регистрация специфичных обработчиков подписок
         for callback in self.subscription_handler.callbacks:
             self.dp.add_handler(callback)
         
+        # Inline-поиск абонементов (@bot имя)
+        self.dp.add_handler(InlineQueryHandler(self.subscription_handler.handle_inline_query))
+        
         # Общий обработчик кнопок регистрируем в последнюю очередь
         self.dp.add_handler(CallbackQueryHandler(self.subscription_handler.button))
         
         # Обработчик ошибок
         self.dp.add_error_handler(self.error_handler)
+        
+        # Трассировка: обертки ставятся на уже зарегистрированные обработчики
+        tracing.instrument_dispatcher(self.dp)
+    
+    def show_analytics(self, update: Update, context):
+        """Команда /analytics [csv] для администраторов
+
+        Полный проход по каталогу данных выполняется в отдельном потоке,
+        чтобы не задерживать обработку нажатий.
+        """
+        if update.effective_chat.id not in ADMIN_IDS:
+            return
+        try:
+            # numpy нужен только для аналитики, бот работает и без него
+            from utils import analytics
+        except ImportError:
+            update.message.reply_text("❌ Для аналитики требуется пакет numpy")
+            return
+        
+        report = analytics.build_report(storage=self.subscription_manager.storage)
+        if context.args and context.args[0].lower() == 'csv':
+            update.message.reply_document(
+                document=io.BytesIO(analytics.format_csv(report)),
+                filename='analytics.csv'
+            )
+        else:
+            update.message.reply_text(analytics.format_text(report))
     
     def error_handler(self, update: Update, context):
         """Обработка ошибок"""
@@ -146,11 +348,91 @@ class DanceBot:
     
     def run(self):
         """Запуск бота"""
-        self.updater.start_polling()
+        if MIGRATE_SHARDS_ON_START:
+            threading.Thread(
+                target=migrate_data_layout, args=(self.subscription_manager.data_dir,),
+                name='shard-migration', daemon=True
+            ).start()
+        schedule_snapshots(self.updater)
+        schedule_archival(self.updater, self.subscription_manager)
+        start_polling(self.updater)
         print("Бот запущен")
         self.updater.idle()
 
+def forward_snapshots(update: Update, context):
+    """Команда /snapshot в многопроцессном режиме выполняется в основном процессе
+
+    Только он может приостановить записи всех процессов-обработчиков;
+    снимок делается в отдельном потоке, чтобы не задерживать пересылку
+    обновлений.
+    """
+    context.dispatcher.run_async(show_snapshots, update, context, update=update)
+    # Обновление обработано здесь, а не в процессе-обработчике
+    context.bot_data['update_tracker'].processed(update.update_id)
+    raise DispatcherHandlerStop()
+
+def run_workers(processes: int):
+    """Запуск в многопроцессном режиме: прием обновлений и N обработчиков
+
+    Архивацию выполняет каждый процесс-обработчик для своего шарда, а
+    снимки - основной процесс, приостанавливая записи всех обработчиков.
+    Смещение polling сохраняется по сообщениям обработчиков об обработанных
+    обновлениях, а не при передаче обновления в очередь процесса.
+    """
+    from workers import WorkerPool
+    
+    pool = WorkerPool(processes)
+    pool.start()
+    
+    updater = create_updater(record_processed=False)
+    updater.dispatcher.bot_data['update_tracker'] = pool.track(updater.offset_store)
+    updater.dispatcher.bot_data['snapshot_committer'] = pool.committer
+    updater.dispatcher.add_handler(CommandHandler('snapshot', forward_snapshots), group=-1)
+    updater.dispatcher.add_handler(TypeHandler(Update, pool.forward))
+    if MIGRATE_SHARDS_ON_START:
+        threading.Thread(
+            target=migrate_data_layout, args=(DATA_DIR,), name='shard-migration', daemon=True
+        ).start()
+    schedule_snapshots(updater)
+    start_polling(updater)
+    print(f"Бот запущен, процессов-обработчиков: {processes}")
+    updater.idle()
+    pool.stop()
+
+def run_tenants(settings):
+    """Запуск нескольких студий в одном процессе на общих ресурсах"""
+    from tenancy import TenantHost, create_tenant
+    
+    host = TenantHost(len(settings))
+    for entry in settings:
+        tenant = create_tenant(entry)
+        updater = create_updater(
+            host.dispatcher(tenant), offset_file=os.path.join(tenant.data_dir, 'polling_offset')
+        )
+        bot = DanceBot(dispatcher=updater.dispatcher, tenant=tenant)
+        if MIGRATE_SHARDS_ON_START:
+            threading.Thread(
+                target=migrate_data_layout,
+                args=(bot.subscription_manager.data_dir, os.path.join(tenant.data_dir, 'users')),
+                name=f'shard-migration-{tenant.name}', daemon=True
+            ).start()
+        schedule_snapshots(updater, tenant)
+        schedule_archival(updater, bot.subscription_manager)
+        start_polling(updater)
+        host.add(updater)
+        logger.info(f"Студия {tenant.name} запущена: {tenant.data_dir}")
+    print(f"Бот запущен, студий: {len(settings)}")
+    host.idle()
+
 def main():
+    if TENANTS:
+        if WORKER_PROCESSES > 1:
+            logger.warning("WORKER_PROCESSES не используется в режиме нескольких студий")
+        run_tenants(TENANTS)
+        return
+    if WORKER_PROCESSES > 1:
+        run_workers(WORKER_PROCESSES)
+        return
     bot = DanceBot()
     bot.run()
 
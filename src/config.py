@@ -17,6 +17,17 @@ CONNECTION_SETTINGS = {
     'connect_timeout': 15.0
 }
 
+# Число потоков диспетчера; пул HTTP-соединений подбирается под него
+DISPATCHER_WORKERS = 4
+
+# Таймауты отдельных методов Bot API (секунды), остальные - по read_timeout
+API_METHOD_TIMEOUTS = {
+    'answerCallbackQuery': 5.0,
+    'editMessageText': 10.0,
+    'sendMessage': 10.0,
+    'sendDocument': 60.0,
+}
+
 # Директории для данных
 WORKSPACE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(WORKSPACE_DIR, 'data')
@@ -26,6 +37,121 @@ USERS_DATA_DIR = os.path.join(DATA_DIR, 'users')
 os.makedirs(DATA_DIR, mode=0o700, exist_ok=True)
 os.makedirs(USERS_DATA_DIR, mode=0o700, exist_ok=True)
 
+# Несколько студий в одном процессе: у каждой свой бот и каталог данных
+# (абонементы, data/users, реестр общих списков, смещение polling), а пул
+# потоков обработчиков (TENANT_WORKERS), пул HTTP-соединений, ограничение
+# частоты вызовов Bot API и кэш документов общие. Пустой список - одна
+# студия с BOT_TOKEN и DATA_DIR. Пример:
+# TENANTS = [
+#     {'name': 'center', 'token': '...', 'data_dir': os.path.join(WORKSPACE_DIR, 'data-center')},
+#     {'name': 'north', 'token': '...', 'data_dir': os.path.join(WORKSPACE_DIR, 'data-north')},
+# ]
+TENANTS: List[Dict[str, str]] = []
+TENANT_WORKERS = 8
+
+# Ограничение частоты исходящих вызовов Bot API всех ботов процесса
+# (в режиме нескольких студий): rate - вызовов в секунду, burst - запас
+OUTBOUND_RATE_LIMIT = {
+    'rate': 30.0,
+    'burst': 30,
+}
+
+# Настройки long polling
+POLLING_SETTINGS = {
+    'allowed_updates': ['message', 'callback_query', 'inline_query'],
+    'limit': 100,               # максимум обновлений в одном ответе getUpdates
+    'timeout': 30,              # длительность long poll, секунды
+    'poll_interval': 0.0,       # пауза после неполной пачки
+    'max_poll_interval': 5.0,   # предел паузы при ошибках сети
+    'drain_on_start': True,     # схлопывать устаревшие нажатия после перезапуска
+}
+# Последний обработанный update_id
+POLLING_OFFSET_FILE = os.path.join(DATA_DIR, 'polling_offset')
+
+# Ограничение частоты обновлений одного чата: rate - токенов в секунду,
+# burst - запас токенов; повторные нажатия той же кнопки того же сообщения
+# в течение debounce_window секунд схлопываются
+THROTTLE_SETTINGS = {
+    'rate': 3.0,
+    'burst': 10,
+    'debounce_window': 0.7,
+}
+
+# Ограничения размеров клавиатур (Telegram режет слишком большие сообщения)
+SUBSCRIPTIONS_PAGE_SIZE = 8
+LESSONS_PAGE_SIZE = 20
+LESSONS_ROW_SIZE = 4
+MAX_LESSONS_PER_SUBSCRIPTION = 100
+# Результатов inline-поиска абонементов (Telegram принимает не больше 50)
+INLINE_RESULTS_LIMIT = 20
+
+# Формат файлов данных: json, json-compact, binary, json-gzip, json-lzma,
+# binary-gzip, binary-lzma. При чтении формат определяется по заголовку файла
+STORAGE_FORMAT = 'json-compact'
+
+# Число уровней шардирования каталогов данных (data/ab/cd/{chat_id}.json).
+# Файлы в старой плоской раскладке переносятся при первом чтении, а при
+# MIGRATE_SHARDS_ON_START - фоновым потоком при запуске бота
+DATA_SHARD_LEVELS = 2
+MIGRATE_SHARDS_ON_START = True
+
+# Многопроцессный режим: число процессов-обработчиков (0 или 1 - один процесс).
+# Обновления раскладываются по процессам по хэшу chat_id
+WORKER_PROCESSES = 0
+WORKER_QUEUE_SIZE = 1000
+
+# Надежность записи: none (только атомарная замена), fsync (сброс файла),
+# fsync_dir (сброс файла и каталога). Записи всех чатов, пришедшие в течение
+# GROUP_COMMIT_WINDOW секунд, фиксируются одной пачкой
+STORAGE_DURABILITY = 'fsync_dir'
+GROUP_COMMIT_WINDOW = 0.005
+
+# Предел объема документов чатов в кэше процесса в байтах (общий для всех
+# студий, 0 - без предела); объем документа оценивается размером его файлов,
+# в памяти он занимает примерно в 2-3 раза больше
+# (python -m utils.footprint --tenants 3). Давно не открывавшиеся
+# документы вытесняются
+DOCUMENT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Проверка бюджета ввода-вывода на одно обновление (для отладки)
+STORAGE_IO_DEBUG = False
+
+# Снимки каталога данных: жесткие ссылки под барьером записи, поэтому
+# снимок согласован и почти не задерживает обработчики.
+# SNAPSHOT_INTERVAL - период автоматических снимков в секундах (0 - выключены),
+# SNAPSHOT_RETENTION - сколько последних снимков хранить,
+# SNAPSHOT_ARCHIVE - упаковывать ли снимок в tar.gz для переноса
+SNAPSHOT_DIR = os.path.join(WORKSPACE_DIR, 'snapshots')
+SNAPSHOT_INTERVAL = 6 * 60 * 60
+SNAPSHOT_RETENTION = 7
+SNAPSHOT_ARCHIVE = True
+
+# Аналитика посещений (/analytics): абонемент считается брошенным, если он
+# не закончен и по нему не было отметок ANALYTICS_IDLE_DAYS дней
+ANALYTICS_IDLE_DAYS = 30
+
+# Архив абонементов: закончившиеся абонементы без отметок
+# ARCHIVE_FINISHED_DAYS дней и брошенные (без отметок ARCHIVE_IDLE_DAYS дней,
+# 0 - не архивировать) раз в ARCHIVE_INTERVAL секунд переносятся из документа
+# чата в сжатый файл архива в формате ARCHIVE_FORMAT (0 - автоархивация выключена)
+ARCHIVE_FINISHED_DAYS = 14
+ARCHIVE_IDLE_DAYS = 90
+ARCHIVE_INTERVAL = 24 * 60 * 60
+ARCHIVE_FORMAT = 'json-gzip'
+
+# Трассировка обновлений: обновления дольше SLOW_UPDATE_THRESHOLD секунд
+# пишутся с деревом спанов в ротируемый журнал (/slow - последние из них)
+SLOW_UPDATE_THRESHOLD = 1.0
+SLOW_LOG_FILE = os.path.join(WORKSPACE_DIR, 'logs', 'slow_updates.log')
+SLOW_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+
+# Реестр общих списков студии: участники и приглашения (/share, /join, /leave)
+ROSTERS_FILE = os.path.join(DATA_DIR, 'rosters.json')
+# Как часто (секунды) проверять, не изменил ли реестр другой процесс;
+# изменения своего процесса видны сразу
+ROSTERS_REFRESH_INTERVAL = 1.0
+
 # Эмодзи для случайного выбора
 RANDOM_EMOJIS = ['💃', '🎭', '🌟', '✨', '🎪', '🎨', '🎬', '🎯', '🎵', '🎶', '🌈', '🦋', '🌺', '🌸', '🍀']
 
@@ -3,12 +3,24 @@ from typing import Dict, Any
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
 from telegram.ext import CallbackContext, ConversationHandler
 from models.user_data import UserDataManager
+from . import views
 from utils.subscription_manager import SubscriptionManager
 from utils.formatting import format_subscription_info
 from config import ADMIN_IDS
 
 logger = logging.getLogger(__name__)
 
+def chat_id_of(update: Update) -> int:
+    """chat_id обновления
+
+    У нажатий кнопок в сообщениях, отправленных через inline-режим, чата
+    нет: данные принадлежат личному чату пользователя, id которого
+    совпадает с user_id.
+    """
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.effective_user.id
+
 def is_admin(chat_id: int) -> bool:
     """Проверка прав администратора"""
     return chat_id in ADMIN_IDS
@@ -100,6 +112,11 @@ class BaseHandler:
         elif update.message:
             update.message.reply_text(message)
     
+    @staticmethod
+    def build_page_navigation(prefix: str, page: int, pages: int) -> list:
+        """Создание ряда кнопок навигации по страницам"""
+        return views.page_navigation(prefix, page, pages)
+    
     def get_category_keyboard(self, chat_id: int, category: str, show_list: bool = True) -> tuple[str, InlineKeyboardMarkup]:
         """Создание клавиатуры для категории"""
         # Формируем текст
@@ -114,13 +131,11 @@ class BaseHandler:
         # Сначала добавляем список абонементов как кнопки
         if subscriptions:
             text += "📋 Ваши абонементы:\n"
-            for i, sub in enumerate(subscriptions, 1):
-                used = len(sub.get('used_lessons', {}))
-                total = sub['lessons']
+            for sub in subscriptions:
                 keyboard.append([
                     InlineKeyboardButton(
                         format_subscription_info(sub, show_lessons=True),
-                        callback_data=f"lesson_{category}_{i-1}_0"
+                        callback_data=f"lesson_{sub.id}_0"
                     )
                 ])
             text += "\n"
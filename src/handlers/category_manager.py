@@ -1,12 +1,17 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext, CommandHandler, CallbackQueryHandler, MessageHandler, Filters
-import json
-import os
 from typing import List, Dict
-from config import USERS_DATA_DIR, CHOOSING_CATEGORY_NAME
+from config import CHOOSING_CATEGORY_NAME
+from models.domain import Category
+from models.user_data import UserDataManager
+from utils.tracing import span
+from utils.unit_of_work import transactional
+from . import views
+from .base import chat_id_of
 
 class CategoryManager:
     def __init__(self):
+        self.user_data_manager = UserDataManager()
         self.commands = [
             CommandHandler('start', self.show_main_menu)
         ]
@@ -25,61 +30,29 @@ class CategoryManager:
             )
         ]
 
+    @transactional
     def show_main_menu(self, update: Update, context: CallbackContext) -> None:
         """Показ главного меню"""
-        chat_id = update.effective_chat.id
+        chat_id = chat_id_of(update)
         categories = self.get_user_categories(chat_id)
         
-        keyboard = []
-        # Кнопки для категорий
-        current_row = []
-        for category in categories:
-            current_row.append(
-                InlineKeyboardButton(f"📁 {category}", callback_data=f"category_{category}")
-            )
-            if len(current_row) == 2:
-                keyboard.append(current_row)
-                current_row = []
-        
-        if current_row:
-            keyboard.append(current_row)
-        
-        # Кнопка настроек
-        keyboard.append([
-            InlineKeyboardButton("⚙️ Настройки", callback_data="settings")
-        ])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Одинаковые наборы категорий разделяют одну готовую клавиатуру
+        with span('render.main_menu'):
+            reply_markup = views.main_menu(tuple((f"📁 {category}", category) for category in categories))
         if update.message:
-            update.message.reply_text(
-                "🏠 Главное меню\n\n"
-                "Выберите категорию или перейдите в настройки:",
-                reply_markup=reply_markup
-            )
+            update.message.reply_text(views.MAIN_MENU_TEXT, reply_markup=reply_markup)
         else:
-            update.callback_query.edit_message_text(
-                "🏠 Главное меню\n\n"
-                "Выберите категорию или перейдите в настройки:",
-                reply_markup=reply_markup
-            )
+            update.callback_query.edit_message_text(views.MAIN_MENU_TEXT, reply_markup=reply_markup)
 
+    @transactional
     def handle_settings_callback(self, update: Update, context: CallbackContext) -> None:
         """Обработка кнопки настроек"""
         query = update.callback_query
         query.answer()
         
-        keyboard = [
-            [InlineKeyboardButton("➕ Создать категорию", callback_data="add_category")],
-            [InlineKeyboardButton("❌ Удалить категорию", callback_data="delete_category_menu")],
-            [InlineKeyboardButton("🔙 В главное меню", callback_data="back_to_main")]
-        ]
-        
-        query.edit_message_text(
-            "⚙️ Настройки\n\n"
-            "Выберите действие:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        query.edit_message_text(views.SETTINGS_TEXT, reply_markup=views.SETTINGS_MARKUP)
 
+    @transactional
     def handle_add_category_callback(self, update: Update, context: CallbackContext) -> None:
         """Обработка добавления категории"""
         query = update.callback_query
@@ -88,27 +61,24 @@ class CategoryManager:
         context.user_data['waiting_for_category_name'] = True
         query.edit_message_text(
             "Введите название новой категории:",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔙 Отмена", callback_data="settings")
-            ]])
+            reply_markup=views.CANCEL_TO_SETTINGS_MARKUP
         )
         return CHOOSING_CATEGORY_NAME
 
+    @transactional
     def handle_category_name_input(self, update: Update, context: CallbackContext) -> None:
         """Обработка ввода названия категории"""
         if not context.user_data.get('waiting_for_category_name'):
             return
         
-        chat_id = update.effective_chat.id
+        chat_id = chat_id_of(update)
         category_name = update.message.text.strip()
         
         # Проверяем, что категория не пустая
         if not category_name:
             update.message.reply_text(
                 "❌ Название категории не может быть пустым. Попробуйте еще раз:",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 Отмена", callback_data="settings")
-                ]])
+                reply_markup=views.CANCEL_TO_SETTINGS_MARKUP
             )
             return CHOOSING_CATEGORY_NAME
         
@@ -117,9 +87,7 @@ class CategoryManager:
         if category_name in categories:
             update.message.reply_text(
                 "❌ Такая категория уже существует. Введите другое название:",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 Отмена", callback_data="settings")
-                ]])
+                reply_markup=views.CANCEL_TO_SETTINGS_MARKUP
             )
             return CHOOSING_CATEGORY_NAME
         
@@ -128,30 +96,25 @@ class CategoryManager:
         context.user_data['waiting_for_category_name'] = False
         
         # Отправляем подтверждение
-        keyboard = [
-            [InlineKeyboardButton("📁 Перейти в категорию", callback_data=f"category_{category_name}")],
-            [InlineKeyboardButton("🔙 В главное меню", callback_data="back_to_main")]
-        ]
         update.message.reply_text(
             f"✅ Категория «{category_name}» успешно создана!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=views.category_created(category_name)
         )
         return -1
 
+    @transactional
     def handle_delete_category_menu_callback(self, update: Update, context: CallbackContext) -> None:
         """Показ меню удаления категорий"""
         query = update.callback_query
         query.answer()
         
-        chat_id = query.message.chat_id
+        chat_id = chat_id_of(update)
         categories = self.get_user_categories(chat_id)
         
         if not categories:
             query.edit_message_text(
                 "❌ У вас пока нет категорий для удаления.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 Назад", callback_data="settings")
-                ]])
+                reply_markup=views.BACK_TO_SETTINGS_MARKUP
             )
             return
         
@@ -169,10 +132,11 @@ class CategoryManager:
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
+    @transactional
     def handle_delete_category_callback(self, update: Update, context: CallbackContext) -> None:
         """Обработка удаления категории"""
         query = update.callback_query
-        chat_id = query.message.chat_id
+        chat_id = chat_id_of(update)
         category = query.data.replace("delete_category_", "")
         
         self.delete_category(chat_id, category)
@@ -181,16 +145,18 @@ class CategoryManager:
         # Возвращаемся в меню удаления категорий
         self.handle_delete_category_menu_callback(update, context)
 
+    @transactional
     def back_to_main_menu_callback(self, update: Update, context: CallbackContext) -> None:
         """Возврат в главное меню"""
         query = update.callback_query
         query.answer()
         self.show_main_menu(update, context)
 
+    @transactional
     def handle_category_callback(self, update: Update, context: CallbackContext) -> None:
         """Обработка выбора категории"""
         query = update.callback_query
-        chat_id = query.message.chat_id
+        chat_id = chat_id_of(update)
         category = query.data.replace("category_", "")
         
         # Проверяем, что категория существует у пользователя
@@ -199,60 +165,30 @@ class CategoryManager:
             query.answer("❌ Категория не найдена")
             return
         
-        keyboard = [
-            [InlineKeyboardButton("➕ Создать абонемент", callback_data=f"create_{category}")],
-            [InlineKeyboardButton("📋 Список абонементов", callback_data=f"subscription_list_{category}")],
-            [InlineKeyboardButton("❌ Удалить абонемент", callback_data=f"subscription_delete_menu_{category}")],
-            [InlineKeyboardButton("🔙 В главное меню", callback_data="back_to_main")]
-        ]
-        
-        query.edit_message_text(
-            f"📁 Категория: {category}\n\n"
-            "Выберите действие:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        text, reply_markup = views.category_menu(category)
+        query.edit_message_text(text, reply_markup=reply_markup)
 
     def get_user_categories(self, chat_id: int) -> List[str]:
         """Получение списка категорий пользователя"""
-        file_path = os.path.join(USERS_DATA_DIR, f"{chat_id}.json")
-        if not os.path.exists(file_path):
-            return []
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            return list(data.get('categories', {}).keys())
+        data = self.user_data_manager.load_user_data(chat_id)
+        return list(data.categories)
 
     def add_category(self, chat_id: int, category_name: str) -> None:
         """Добавление новой категории"""
-        file_path = os.path.join(USERS_DATA_DIR, f"{chat_id}.json")
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-        else:
-            data = {'categories': {}}
-        
-        if 'categories' not in data:
-            data['categories'] = {}
-        
-        if category_name not in data['categories']:
-            data['categories'][category_name] = {
-                'name': category_name,
-                'subscriptions': []
-            }
+        def change(data) -> bool:
+            if category_name in data.categories:
+                return False
+            data.categories[category_name] = Category(category_name)
+            return True
 
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=4)
+        self.user_data_manager.update_user_data(chat_id, change)
 
     def delete_category(self, chat_id: int, category_name: str) -> None:
         """Удаление категории"""
-        file_path = os.path.join(USERS_DATA_DIR, f"{chat_id}.json")
-        if not os.path.exists(file_path):
-            return
-        
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        
-        if 'categories' in data and category_name in data['categories']:
-            del data['categories'][category_name]
-            
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=4) 
\ No newline at end of file
+        def change(data) -> bool:
+            if category_name not in data.categories:
+                return False
+            del data.categories[category_name]
+            return True
+
+        self.user_data_manager.update_user_data(chat_id, change)
@@ -0,0 +1,67 @@
+import logging
+
+from telegram import Update
+from telegram.ext import CallbackContext, CommandHandler
+
+from utils.rosters import RosterError, rosters
+from .base import chat_id_of
+
+logger = logging.getLogger(__name__)
+
+
+class RosterHandler:
+    """Команды общих списков студии: /share, /join, /leave"""
+
+    def __init__(self):
+        self.commands = [
+            CommandHandler('share', self.share),
+            CommandHandler('join', self.join),
+            CommandHandler('leave', self.leave),
+        ]
+
+    def share(self, update: Update, context: CallbackContext) -> None:
+        """Код приглашения в список чата; /share new - новый код вместо старого"""
+        chat_id = chat_id_of(update)
+        reset = bool(context.args) and context.args[0].lower() == 'new'
+        try:
+            code = rosters.invite(chat_id, reset=reset)
+        except OSError as e:
+            logger.error(f"Ошибка при создании приглашения: {e}, chat_id={chat_id}")
+            update.message.reply_text("❌ Не удалось создать приглашение")
+            return
+
+        members = rosters.members(rosters.document_id(chat_id))
+        update.message.reply_text(
+            "👥 Общий список\n\n"
+            f"Чтобы другой тренер работал с этим списком, пусть отправит боту:\n/join {code}\n\n"
+            f"Подключено тренеров: {len(members)}\n"
+            "Новый код (старый перестанет действовать): /share new"
+        )
+
+    def join(self, update: Update, context: CallbackContext) -> None:
+        """Подключение к общему списку по коду"""
+        chat_id = chat_id_of(update)
+        if not context.args:
+            update.message.reply_text("Отправьте код приглашения: /join КОД")
+            return
+        try:
+            rosters.join(chat_id, context.args[0].strip())
+        except RosterError as e:
+            update.message.reply_text(f"❌ {e}")
+            return
+        except OSError as e:
+            logger.error(f"Ошибка при подключении к общему списку: {e}, chat_id={chat_id}")
+            update.message.reply_text("❌ Не удалось подключиться к списку")
+            return
+        update.message.reply_text(
+            "✅ Вы подключены к общему списку. Ваши собственные абонементы сохранены "
+            "и снова появятся после /leave.\n\n/start - открыть список"
+        )
+
+    def leave(self, update: Update, context: CallbackContext) -> None:
+        """Отключение от общего списка"""
+        chat_id = chat_id_of(update)
+        if not rosters.leave(chat_id):
+            update.message.reply_text("Вы не подключены к чужому списку")
+            return
+        update.message.reply_text("✅ Вы отключились от общего списка\n\n/start - ваши абонементы")
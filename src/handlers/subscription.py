@@ -1,14 +1,25 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
+from typing import Optional
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode,
+    InlineQueryResultArticle, InputTextMessageContent
+)
 from telegram.ext import CallbackContext, ConversationHandler, CallbackQueryHandler
-from .base import BaseHandler
+from .base import BaseHandler, chat_id_of
+from . import views
 from utils.formatting import format_subscription_info
-from config import CHOOSING_NAME_SURNAME, ENTERING_LESSONS_COUNT, USERS_DATA_DIR
+from utils.pagination import paginate, parse_page
+from utils.rosters import rosters
+from utils.tracing import span, traced
+from utils.unit_of_work import transactional
+from config import (
+    CHOOSING_NAME_SURNAME, ENTERING_LESSONS_COUNT, USERS_DATA_DIR,
+    SUBSCRIPTIONS_PAGE_SIZE, LESSONS_PAGE_SIZE, MAX_LESSONS_PER_SUBSCRIPTION, INLINE_RESULTS_LIMIT
+)
 from utils.subscription_manager import SubscriptionManager
 import os
 import json
-from typing import Dict
-from datetime import datetime
+from models.domain import Subscription
 
 logger = logging.getLogger(__name__)
 
@@ -20,20 +31,27 @@ class SubscriptionHandler(BaseHandler):
         self.commands = []
         self.callbacks = [
             CallbackQueryHandler(self.handle_subscription_callback, pattern='^subscription_'),
-            CallbackQueryHandler(self.handle_lesson_callback, pattern='^lesson_')
+            CallbackQueryHandler(self.handle_lesson_callback, pattern='^(inline_)?lesson_'),
+            CallbackQueryHandler(self.handle_class_callback, pattern='^class_'),
+            CallbackQueryHandler(self.handle_archive_callback, pattern='^archive_')
         ]
     
+    @transactional
     def button(self, update: Update, context: CallbackContext):
         """Обработка нажатий на кнопки"""
         query = update.callback_query
         query.answer()
         
         try:
-            chat_id = update.effective_chat.id
+            chat_id = chat_id_of(update)
             data = query.data
             
             logger.info(f"Обработка callback: chat_id={chat_id}, data={data}")
             
+            # Кнопка с номером страницы ничего не делает
+            if data == 'noop':
+                return None
+            
             # Обработка команды start и возврата в главное меню
             if data == 'start' or data == 'back_to_main':
                 self.start(update, context)
@@ -43,7 +61,7 @@ class SubscriptionHandler(BaseHandler):
             if data.startswith('category_'):
                 category = data.replace('category_', '')
                 user_data = self.user_data_manager.load_user_data(chat_id)
-                if category not in user_data['categories']:
+                if category not in user_data.categories:
                     logger.error(f"Категория не найдена: {category}")
                     self.send_error_message(update, "Категория не найдена")
                     return ConversationHandler.END
@@ -57,14 +75,9 @@ class SubscriptionHandler(BaseHandler):
             
             # Обработка настроек
             if data == 'settings':
-                keyboard = [
-                    [InlineKeyboardButton("➕ Создать категорию", callback_data="add_category")],
-                    [InlineKeyboardButton("❌ Удалить категорию", callback_data="delete_category_menu")],
-                    [InlineKeyboardButton("🔙 В главное меню", callback_data="back_to_main")]
-                ]
                 query.edit_message_text(
-                    "⚙️ Настройки\n\nВыберите действие:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    views.SETTINGS_TEXT,
+                    reply_markup=views.SETTINGS_MARKUP
                 )
                 return ConversationHandler.END
             
@@ -76,38 +89,23 @@ class SubscriptionHandler(BaseHandler):
             self.send_error_message(update)
             return ConversationHandler.END
     
+    @transactional
     def start(self, update: Update, context: CallbackContext):
         """Обработка команды /start"""
         if not update.message and not update.callback_query:
             return
         
-        chat_id = update.effective_chat.id
+        chat_id = chat_id_of(update)
         user_data = self.user_data_manager.load_user_data(chat_id)
-        keyboard = []
-        current_row = []
         
-        # Создаем кнопки для каждой категории пользователя
-        for category_id, category_data in user_data['categories'].items():
-            button = InlineKeyboardButton(
-                category_data.get('name', category_id),
-                callback_data=f'category_{category_id}'
+        # Кнопки категорий пользователя; одинаковые меню разделяют одну клавиатуру
+        with span('render.main_menu'):
+            buttons = tuple(
+                (category_data.name, category_id)
+                for category_id, category_data in user_data.categories.items()
             )
-            current_row.append(button)
-            
-            if len(current_row) == 2:
-                keyboard.append(current_row)
-                current_row = []
-        
-        if current_row:
-            keyboard.append(current_row)
-        
-        # Добавляем кнопку настроек
-        keyboard.append([
-            InlineKeyboardButton("⚙️ Настройки", callback_data="settings")
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        message = "🏠 Главное меню\n\nВыберите категорию или перейдите в настройки:"
+            reply_markup = views.main_menu(buttons)
+        message = views.MAIN_MENU_TEXT
         
         if update.callback_query:
             update.callback_query.edit_message_text(
@@ -123,24 +121,15 @@ class SubscriptionHandler(BaseHandler):
     def get_category_keyboard(self, chat_id: int, category: str) -> tuple:
         """Получение клавиатуры для категории"""
         user_data = self.user_data_manager.load_user_data(chat_id)
-        category_data = user_data['categories'].get(category, {})
-        
-        text = f"📁 Категория: {category_data.get('name', category)}\n\n"
-        text += "Выберите действие:"
-        
-        keyboard = [
-            [InlineKeyboardButton("➕ Создать абонемент", callback_data=f"create_{category}")],
-            [InlineKeyboardButton("📋 Список абонементов", callback_data=f"subscription_list_{category}")],
-            [InlineKeyboardButton("❌ Удалить абонемент", callback_data=f"subscription_delete_menu_{category}")],
-            [InlineKeyboardButton("🔙 В главное меню", callback_data="back_to_main")]
-        ]
+        category_data = user_data.categories.get(category)
         
-        return text, InlineKeyboardMarkup(keyboard)
+        return views.category_menu(category, category_data.name if category_data else category)
 
+    @transactional
     def process_name_surname(self, update: Update, context: CallbackContext):
         """Обработка создания абонемента"""
         try:
-            chat_id = update.effective_chat.id
+            chat_id = chat_id_of(update)
             current_state = context.user_data.get('state', None)
             logger.info(f"process_name_surname вызван: chat_id={chat_id}, current_state={current_state}, user_data={context.user_data}")
             
@@ -155,10 +144,10 @@ class SubscriptionHandler(BaseHandler):
                 context.user_data['state'] = CHOOSING_NAME_SURNAME
                 
                 # Запрашиваем название абонемента
-                keyboard = [[InlineKeyboardButton("🔙 Отмена", callback_data=f"category_{category}")]]
+                reply_markup = views.back_to_category(category, "🔙 Отмена")
                 query.edit_message_text(
                     "Введите название абонемента:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=reply_markup
                 )
                 logger.info(f"Запрошено название абонемента для категории {category}, state={CHOOSING_NAME_SURNAME}")
                 return CHOOSING_NAME_SURNAME
@@ -175,10 +164,10 @@ class SubscriptionHandler(BaseHandler):
                     category = context.user_data.get('category')
                     
                     # Запрашиваем количество дней
-                    keyboard = [[InlineKeyboardButton("🔙 Отмена", callback_data=f"category_{category}")]]
+                    reply_markup = views.back_to_category(category, "🔙 Отмена")
                     update.message.reply_text(
-                        "Введите количество дней в абонементе (целое положительное число):",
-                        reply_markup=InlineKeyboardMarkup(keyboard)
+                        f"Введите количество дней в абонементе (от 1 до {MAX_LESSONS_PER_SUBSCRIPTION}):",
+                        reply_markup=reply_markup
                     )
                     logger.info(f"Запрошено количество дней для абонемента {text}, state={ENTERING_LESSONS_COUNT}")
                     return ENTERING_LESSONS_COUNT
@@ -187,8 +176,8 @@ class SubscriptionHandler(BaseHandler):
                 elif current_state == ENTERING_LESSONS_COUNT:
                     try:
                         days = int(text)
-                        if days <= 0:
-                            raise ValueError("Количество дней должно быть положительным числом")
+                        if days <= 0 or days > MAX_LESSONS_PER_SUBSCRIPTION:
+                            raise ValueError("Количество дней вне допустимого диапазона")
                         
                         category = context.user_data.get('category')
                         subscription_name = context.user_data.get('subscription_name')
@@ -211,16 +200,11 @@ class SubscriptionHandler(BaseHandler):
                             return ConversationHandler.END
                         
                         # Отправляем подтверждение
-                        keyboard = [
-                            [InlineKeyboardButton("📋 Показать все абонементы", callback_data=f"subscription_list_{category}")],
-                            [InlineKeyboardButton("🔙 К категории", callback_data=f"category_{category}")]
-                        ]
-                        
                         update.message.reply_text(
                             f"✅ Абонемент успешно создан!\n"
                             f"Название: {subscription_name}\n"
                             f"Количество дней: {days}",
-                            reply_markup=InlineKeyboardMarkup(keyboard)
+                            reply_markup=views.subscription_created(category)
                         )
                         
                         logger.info(f"Абонемент успешно создан: {subscription_name}")
@@ -231,10 +215,10 @@ class SubscriptionHandler(BaseHandler):
                         
                     except ValueError:
                         category = context.user_data.get('category')
-                        keyboard = [[InlineKeyboardButton("🔙 Отмена", callback_data=f"category_{category}")]]
+                        reply_markup = views.back_to_category(category, "🔙 Отмена")
                         update.message.reply_text(
-                            "❌ Пожалуйста, введите корректное количество дней (целое положительное число)",
-                            reply_markup=InlineKeyboardMarkup(keyboard)
+                            f"❌ Пожалуйста, введите корректное количество дней (от 1 до {MAX_LESSONS_PER_SUBSCRIPTION})",
+                            reply_markup=reply_markup
                         )
                         return ENTERING_LESSONS_COUNT
                 
@@ -242,9 +226,7 @@ class SubscriptionHandler(BaseHandler):
                     logger.error(f"Неожиданное состояние: {current_state}")
                     update.message.reply_text(
                         "❌ Произошла ошибка. Пожалуйста, начните создание абонемента заново.",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("🔙 В главное меню", callback_data="back_to_main")
-                        ]])
+                        reply_markup=views.BACK_TO_MAIN_MARKUP
                     )
                     return ConversationHandler.END
             
@@ -259,9 +241,10 @@ class SubscriptionHandler(BaseHandler):
                 )
             return ConversationHandler.END
     
+    @transactional
     def handle_subscription_callback(self, update: Update, context: CallbackContext) -> None:
         query = update.callback_query
-        chat_id = query.message.chat_id
+        chat_id = chat_id_of(update)
         data = query.data
         
         if data.startswith('subscription_list_'):
@@ -271,11 +254,17 @@ class SubscriptionHandler(BaseHandler):
         elif data.startswith('subscription_delete_'):
             self.handle_delete_subscription(update, context)
 
-    def show_delete_subscription_menu(self, update: Update, context: CallbackContext) -> None:
+    @transactional
+    def show_delete_subscription_menu(self, update: Update, context: CallbackContext,
+                                      category: str = None, page: int = None) -> None:
         """Показ меню удаления абонементов"""
         query = update.callback_query
-        chat_id = query.message.chat_id
-        category = query.data.split('_')[3]
+        chat_id = chat_id_of(update)
+        if category is None:
+            # subscription_delete_menu_{category}[_{page}]
+            parts = query.data.split('_')
+            category = parts[3]
+            page = parse_page(parts[4]) if len(parts) > 4 else 0
         
         # Получаем список абонементов
         subscriptions = self.subscription_manager.get_subscriptions(chat_id, category)
@@ -284,30 +273,28 @@ class SubscriptionHandler(BaseHandler):
         if not subscriptions:
             query.edit_message_text(
                 "❌ В этой категории нет абонементов для удаления.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 Назад", callback_data=f"category_{category}")
-                ]])
+                reply_markup=views.back_to_category(category)
             )
             query.answer()
             return
         
-        # Создаем кнопки для каждого абонемента
-        for i, sub in enumerate(subscriptions):
-            name = sub.get('name', '')
-            used_lessons = sub.get('used_lessons', {})
-            if not isinstance(used_lessons, dict):
-                used_lessons = {}
-            total = sub.get('total_lessons', 0)
-            used_count = len(used_lessons)
-            
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"❌ {name} ({used_count}/{total} дней)",
-                    callback_data=f"subscription_delete_{category}_{i}"
-                )
-            ])
+        start, end, page, pages = paginate(len(subscriptions), page or 0, SUBSCRIPTIONS_PAGE_SIZE)
         
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"category_{category}")])
+        with span('render.delete_menu'):
+            # Создаем кнопки только для абонементов текущей страницы
+            for i in range(start, end):
+                sub = subscriptions[i]
+                keyboard.append([
+                    InlineKeyboardButton(
+                        f"❌ {sub.name} ({sub.used_count}/{sub.total_lessons} дней)",
+                        callback_data=f"subscription_delete_{category}_{sub.id}"
+                    )
+                ])
+            
+            navigation = self.build_page_navigation(f"subscription_delete_menu_{category}", page, pages)
+            if navigation:
+                keyboard.append(navigation)
+            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"category_{category}")])
         
         query.edit_message_text(
             "❌ Удаление абонементов\n\n"
@@ -316,37 +303,42 @@ class SubscriptionHandler(BaseHandler):
         )
         query.answer()
 
+    @transactional
     def handle_delete_subscription(self, update: Update, context: CallbackContext) -> None:
         query = update.callback_query
-        chat_id = query.message.chat_id
-        _, _, category, sub_index = query.data.split('_', 3)
+        chat_id = chat_id_of(update)
+        _, _, category, sub_id = query.data.split('_', 3)
         
         try:
-            sub_index = int(sub_index)
-            # Получаем список абонементов
+            # Запоминаем позицию, чтобы вернуться на ту же страницу меню
             subscriptions = self.subscription_manager.get_subscriptions(chat_id, category)
-            if not subscriptions or sub_index >= len(subscriptions):
+            position = next(
+                (i for i, sub in enumerate(subscriptions) if sub.id == sub_id), None
+            )
+            
+            # Удаляем абонемент по его id, а не по позиции в списке
+            if position is None or not self.subscription_manager.delete_subscription(chat_id, sub_id):
                 self.send_error_message(update, "Абонемент не найден. Пожалуйста, попробуйте еще раз.")
                 return
             
-            # Удаляем абонемент
-            subscriptions.pop(sub_index)
-            
-            # Сохраняем обновленные данные
-            self.subscription_manager.save_subscriptions(chat_id, category, subscriptions)
-            
-            # Возвращаемся к списку абонементов
-            self.show_delete_subscription_menu(update, context)
+            # Возвращаемся к той странице меню, на которой был удаленный абонемент
+            self.show_delete_subscription_menu(
+                update, context, category, position // SUBSCRIPTIONS_PAGE_SIZE
+            )
             
         except (ValueError, IndexError) as e:
             logger.error(f"Ошибка при удалении абонемента: {e}")
             self.send_error_message(update, "Не удалось удалить абонемент. Пожалуйста, попробуйте еще раз.")
 
+    @transactional
     def show_subscription_list(self, update: Update, context: CallbackContext) -> None:
         """Показ списка абонементов"""
         query = update.callback_query
-        chat_id = query.message.chat_id
-        category = query.data.split('_')[2]
+        chat_id = chat_id_of(update)
+        # subscription_list_{category}[_{page}]
+        parts = query.data.split('_')
+        category = parts[2]
+        page = parse_page(parts[3]) if len(parts) > 3 else 0
         
         # Получаем список абонементов
         subscriptions = self.subscription_manager.get_subscriptions(chat_id, category)
@@ -355,33 +347,32 @@ class SubscriptionHandler(BaseHandler):
         if not subscriptions:
             query.edit_message_text(
                 "📋 В этой категории пока нет абонементов.",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 Назад", callback_data=f"category_{category}")
-                ]])
+                reply_markup=views.back_to_category(category)
             )
             query.answer()
             return
         
+        start, end, page, pages = paginate(len(subscriptions), page, SUBSCRIPTIONS_PAGE_SIZE)
+        
         text = "📋 Список абонементов:\n\n"
         
-        # Создаем кнопки для каждого абонемента
-        for i, sub in enumerate(subscriptions):
-            name = sub.get('name', '')
-            used_lessons = sub.get('used_lessons', {})
-            if not isinstance(used_lessons, dict):
-                used_lessons = {}
-            total = sub.get('total_lessons', 0)
-            used_count = len(used_lessons)
+        with span('render.subscription_list'):
+            # Создаем кнопки только для абонементов текущей страницы
+            for i in range(start, end):
+                sub = subscriptions[i]
+                text += f"• {sub.name}: {sub.used_count}/{sub.total_lessons} дней\n"
+                keyboard.append([
+                    InlineKeyboardButton(
+                        f"{sub.name} ({sub.used_count}/{sub.total_lessons} дней)",
+                        callback_data=f"lesson_{sub.id}_0"
+                    )
+                ])
             
-            text += f"• {name}: {used_count}/{total} дней\n"
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{name} ({used_count}/{total} дней)",
-                    callback_data=f"lesson_{category}_{i}_0"
-                )
-            ])
-        
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"category_{category}")])
+            navigation = self.build_page_navigation(f"subscription_list_{category}", page, pages)
+            if navigation:
+                text += f"\nСтраница {page + 1} из {pages}"
+                keyboard.append(navigation)
+            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"category_{category}")])
         
         query.edit_message_text(
             text,
@@ -389,110 +380,294 @@ class SubscriptionHandler(BaseHandler):
         )
         query.answer()
 
+    @transactional
     def handle_lesson_callback(self, update: Update, context: CallbackContext) -> None:
         query = update.callback_query
-        chat_id = query.message.chat_id
-        _, category, sub_index, lesson_num = query.data.split('_')
-        sub_index = int(sub_index)
-        lesson_num = int(lesson_num)
+        chat_id = chat_id_of(update)
+        # lesson_{sub_id}_{lesson_num}[_{page}] или, в сетке из inline-режима,
+        # inline_lesson_{owner}_{sub_id}_{lesson_num}[_{page}]
+        parts = query.data.split('_')
+        owner = None
+        try:
+            if parts[0] == 'inline':
+                owner = int(parts[2])
+                parts = parts[1:2] + parts[3:]
+            sub_id, lesson_num = parts[1], int(parts[2])
+        except (IndexError, ValueError):
+            query.answer("Абонемент не найден")
+            return
+        page = parse_page(parts[3]) if len(parts) > 3 else 0
         
-        # Получаем абонемент
-        subscriptions = self.subscription_manager.get_subscriptions(chat_id, category)
-        if not subscriptions or sub_index >= len(subscriptions):
+        if owner is not None:
+            # У inline-сообщения нет чата: сетку, отправленную в группу, может
+            # нажать любой ее участник, а отмечать дни может только тот, чей это список
+            if rosters.document_id(update.effective_user.id) != owner:
+                query.answer("Отмечать дни может только тот, кто отправил абонемент", show_alert=True)
+                return
+            chat_id = owner
+        
+        # Получаем абонемент по стабильному id
+        located = self.subscription_manager.locate_subscription(chat_id, sub_id)
+        if located is None:
             query.answer("Абонемент не найден")
             return
         
-        subscription = subscriptions[sub_index]
+        category, subscription = located
         
         # Если это первое нажатие (lesson_num == 0), показываем детали абонемента
-        if lesson_num == 0:
-            keyboard = []
-            total = subscription.get('total_lessons', 0)
-            used_lessons = subscription.get('used_lessons', {})
-            if not isinstance(used_lessons, dict):
-                used_lessons = {}
-                subscription['used_lessons'] = used_lessons
-            
-            # Создаем кнопки для каждого дня
-            current_row = []
-            for i in range(1, total + 1):
-                lesson_str = str(i)
-                button_text = used_lessons.get(lesson_str, str(i))
-                current_row.append(InlineKeyboardButton(
-                    button_text,
-                    callback_data=f"lesson_{category}_{sub_index}_{i}"
-                ))
-                
-                if len(current_row) == 4:
-                    keyboard.append(current_row)
-                    current_row = []
-            
-            if current_row:
-                keyboard.append(current_row)
-            
-            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"subscription_list_{category}")])
-            
-            text = f"🎫 Абонемент: {subscription.get('name', '')}\n\n"
-            text += f"Использовано дней: {len(used_lessons)}/{total}\n\n"
-            text += "Нажмите на день, чтобы отметить его:"
+        if lesson_num != 0:
+            # Отмечаем день или снимаем отметку
+            if not self.subscription_manager.mark_lesson(chat_id, sub_id, lesson_num):
+                query.answer("Не удалось отметить день")
+                return
             
+            # Остаемся на странице с отмеченным днем
+            page = (lesson_num - 1) // LESSONS_PAGE_SIZE
+        
+        text, reply_markup = self.render_lesson_grid(category, subscription, page, owner)
+        query.edit_message_text(
+            text=text,
+            reply_markup=reply_markup
+        )
+        query.answer()
+
+    @transactional
+    def handle_class_callback(self, update: Update, context: CallbackContext) -> None:
+        """Отметка занятия группы: выбор абонементов и одна общая отметка
+
+        Выбор хранится в context.user_data, а не в callback_data: кнопки
+        остаются короткими при любом числе выбранных абонементов.
+        """
+        query = update.callback_query
+        chat_id = chat_id_of(update)
+        data = query.data
+        
+        if data.startswith('class_open_'):
+            # class_open_{category}
+            context.user_data['mark_class'] = {
+                'category': data[len('class_open_'):],
+                'selected': set(),
+            }
+            self.show_mark_class(update, context, 0)
+            return
+        
+        state = context.user_data.get('mark_class')
+        if state is None:
+            # Кнопка от старого экрана: бот перезапускался или экран уже закрыт
+            query.answer("Экран устарел, откройте категорию заново")
+            return
+        
+        parts = data.split('_')
+        if parts[1] == 'page':
+            # class_page_{page}
+            self.show_mark_class(update, context, parse_page(parts[2]) if len(parts) > 2 else 0)
+        elif parts[1] == 'toggle' and len(parts) > 2:
+            # class_toggle_{sub_id}_{page}
+            state['selected'] ^= {parts[2]}
+            self.show_mark_class(update, context, parse_page(parts[3]) if len(parts) > 3 else 0)
+        elif parts[1] == 'all':
+            # class_all_{page}: выбрать всех, у кого есть свободные дни, или снять выбор
+            available = {
+                sub.id for sub in self.subscription_manager.get_subscriptions(chat_id, state['category'])
+                if not sub.is_finished
+            }
+            state['selected'] = set() if available <= state['selected'] else available
+            self.show_mark_class(update, context, parse_page(parts[2]) if len(parts) > 2 else 0)
+        elif parts[1] == 'confirm':
+            self.confirm_mark_class(update, context)
+        else:
+            query.answer()
+    
+    def show_mark_class(self, update: Update, context: CallbackContext, page: int) -> None:
+        """Экран выбора абонементов для отметки занятия группы"""
+        query = update.callback_query
+        chat_id = chat_id_of(update)
+        state = context.user_data['mark_class']
+        category = state['category']
+        
+        subscriptions = self.subscription_manager.get_subscriptions(chat_id, category)
+        if not subscriptions:
+            context.user_data.pop('mark_class', None)
             query.edit_message_text(
-                text=text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                "📋 В этой категории пока нет абонементов.",
+                reply_markup=views.back_to_category(category)
             )
-        else:
-            # Инициализируем used_lessons если его нет
-            if 'used_lessons' not in subscription:
-                subscription['used_lessons'] = {}
-            
-            lesson_str = str(lesson_num)
-            current_date = datetime.now().strftime("%d.%m")
-            
-            # Если день уже отмечен - снимаем отметку
-            if lesson_str in subscription['used_lessons']:
-                del subscription['used_lessons'][lesson_str]
+            query.answer()
+            return
+        
+        # Удаленные другим тренером абонементы из выбора убираются
+        state['selected'] &= {sub.id for sub in subscriptions}
+        start, end, page, pages = paginate(len(subscriptions), page, SUBSCRIPTIONS_PAGE_SIZE)
+        
+        with span('render.mark_class'):
+            entries = tuple(
+                (sub.id, f"{sub.name} ({sub.used_count}/{sub.total_lessons})",
+                 sub.id in state['selected'], not sub.is_finished)
+                for sub in subscriptions[start:end]
+            )
+            reply_markup = views.mark_class(category, entries, len(state['selected']), page, pages)
+        
+        text = ("✅ Отметка занятия группы\n\n"
+                "Выберите пришедших. Каждому будет отмечен следующий свободный день.")
+        if pages > 1:
+            text += f"\n\nСтраница {page + 1} из {pages}"
+        query.edit_message_text(text, reply_markup=reply_markup)
+        query.answer()
+    
+    def confirm_mark_class(self, update: Update, context: CallbackContext) -> None:
+        """Одна отметка для всех выбранных абонементов и одно сообщение с итогом"""
+        query = update.callback_query
+        chat_id = chat_id_of(update)
+        state = context.user_data['mark_class']
+        category = state['category']
+        if not state['selected']:
+            query.answer("Никто не выбран")
+            return
+        
+        subscriptions = self.subscription_manager.get_subscriptions(chat_id, category)
+        # Порядок итога - как в списке категории
+        sub_ids = [sub.id for sub in subscriptions if sub.id in state['selected']]
+        slots = self.subscription_manager.mark_class(chat_id, sub_ids)
+        if slots is None:
+            query.answer("Не удалось отметить занятие")
+            return
+        context.user_data.pop('mark_class', None)
+        
+        names = {sub.id: sub.name for sub in subscriptions}
+        lines = []
+        for sub_id in sub_ids:
+            lesson_num = slots.get(sub_id)
+            if lesson_num is None:
+                lines.append(f"⚠️ {names[sub_id]} — свободных дней нет")
             else:
-                # Иначе отмечаем день текущей датой
-                subscription['used_lessons'][lesson_str] = current_date
-            
-            # Сохраняем изменения
-            subscriptions[sub_index] = subscription
-            self.subscription_manager.save_subscriptions(chat_id, category, subscriptions)
-            
-            # Обновляем отображение
-            keyboard = []
-            total = subscription.get('total_lessons', 0)
-            used_lessons = subscription.get('used_lessons', {})
-            
-            # Создаем кнопки для каждого дня
-            current_row = []
-            for i in range(1, total + 1):
-                lesson_str = str(i)
-                button_text = used_lessons.get(lesson_str, str(i))
-                current_row.append(InlineKeyboardButton(
-                    button_text,
-                    callback_data=f"lesson_{category}_{sub_index}_{i}"
-                ))
-                
-                if len(current_row) == 4:
-                    keyboard.append(current_row)
-                    current_row = []
-            
-            if current_row:
-                keyboard.append(current_row)
-            
-            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"subscription_list_{category}")])
-            
-            text = f"🎫 Абонемент: {subscription.get('name', '')}\n\n"
-            text += f"Использовано дней: {len(used_lessons)}/{total}\n\n"
-            text += "Нажмите на день, чтобы отметить его:"
-            
+                lines.append(f"✅ {names[sub_id]} — день {lesson_num}")
+        marked = sum(1 for lesson_num in slots.values() if lesson_num is not None)
+        
+        query.edit_message_text(
+            f"✅ Занятие отмечено: {marked} из {len(sub_ids)}\n\n" + "\n".join(lines),
+            reply_markup=views.back_to_category(category)
+        )
+        query.answer()
+
+    @transactional
+    def handle_archive_callback(self, update: Update, context: CallbackContext) -> None:
+        query = update.callback_query
+        data = query.data
+        
+        if data.startswith('archive_list_'):
+            # archive_list_{category}[_{page}]
+            parts = data.split('_')
+            self.show_archive(update, context, parts[2], parse_page(parts[3]) if len(parts) > 3 else 0)
+        elif data.startswith('archive_restore_'):
+            self.handle_restore_subscription(update, context)
+        else:
+            query.answer()
+    
+    def show_archive(self, update: Update, context: CallbackContext, category: str, page: int,
+                     notice: str = None) -> None:
+        """Показ архива категории (архив читается только здесь)"""
+        query = update.callback_query
+        chat_id = chat_id_of(update)
+        archived = self.subscription_manager.get_archived(chat_id, category)
+        
+        if not archived:
             query.edit_message_text(
-                text=text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                "🗄 В архиве этой категории пока пусто.\n\n"
+                "Сюда автоматически переносятся закончившиеся и давно не используемые абонементы.",
+                reply_markup=views.back_to_category(category)
             )
+            query.answer(notice)
+            return
         
-        query.answer()
+        start, end, page, pages = paginate(len(archived), page, SUBSCRIPTIONS_PAGE_SIZE)
+        keyboard = []
+        text = "🗄 Архив абонементов\n\n"
+        
+        with span('render.archive'):
+            for _, sub, archived_at in archived[start:end]:
+                text += f"• {sub.name}: {sub.used_count}/{sub.total_lessons} дней, в архиве с {archived_at[:10]}\n"
+                keyboard.append([
+                    InlineKeyboardButton(
+                        f"♻️ {sub.name} ({sub.used_count}/{sub.total_lessons} дней)",
+                        callback_data=f"archive_restore_{category}_{sub.id}"
+                    )
+                ])
+            
+            navigation = self.build_page_navigation(f"archive_list_{category}", page, pages)
+            if navigation:
+                text += f"\nСтраница {page + 1} из {pages}"
+                keyboard.append(navigation)
+            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"category_{category}")])
+        
+        text += "\nНажмите на абонемент, чтобы вернуть его в список."
+        query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        query.answer(notice)
+    
+    def handle_restore_subscription(self, update: Update, context: CallbackContext) -> None:
+        query = update.callback_query
+        chat_id = chat_id_of(update)
+        # archive_restore_{category}_{sub_id}
+        _, _, category, sub_id = query.data.split('_', 3)
+        
+        if category not in self.user_data_manager.load_user_data(chat_id).categories:
+            query.answer("Категория удалена, абонемент восстановить нельзя")
+            return
+        
+        # Запоминаем позицию, чтобы вернуться на ту же страницу архива
+        archived = self.subscription_manager.get_archived(chat_id, category)
+        position = next((i for i, entry in enumerate(archived) if entry[1].id == sub_id), 0)
+        if self.subscription_manager.restore_subscription(chat_id, sub_id) is None:
+            query.answer("Не удалось восстановить абонемент")
+            return
+        
+        self.show_archive(
+            update, context, category, position // SUBSCRIPTIONS_PAGE_SIZE, "♻️ Абонемент возвращен в список"
+        )
+
+    @transactional
+    def handle_inline_query(self, update: Update, context: CallbackContext) -> None:
+        """Inline-поиск абонементов по названию (@bot имя)
+
+        Выбранный результат сразу отправляет сетку занятий абонемента; в ее
+        кнопках записан документ отправителя (см. handle_lesson_callback).
+        """
+        inline_query = update.inline_query
+        owner = rosters.document_id(chat_id_of(update))
+        found = self.subscription_manager.search_subscriptions(owner, inline_query.query, INLINE_RESULTS_LIMIT)
+        
+        results = []
+        for category, subscription in found:
+            text, reply_markup = self.render_lesson_grid(category, subscription, 0, owner)
+            results.append(InlineQueryResultArticle(
+                id=subscription.id,
+                title=subscription.name,
+                description=f"{category}: {subscription.used_count}/{subscription.total_lessons} дней",
+                input_message_content=InputTextMessageContent(text),
+                reply_markup=reply_markup
+            ))
+        
+        # Результаты у каждого пользователя свои и меняются с каждой отметкой
+        inline_query.answer(results, cache_time=0, is_personal=True)
+
+    @traced('render.lesson_grid')
+    def render_lesson_grid(self, category: str, subscription: Subscription, page: int,
+                           owner: Optional[int] = None) -> tuple:
+        """Отрисовка страницы сетки занятий абонемента; `owner` - для сетки из inline-режима"""
+        total = subscription.total_lessons
+        used_lessons = subscription.used_lessons
+        
+        start, end, page, pages = paginate(total, page, LESSONS_PAGE_SIZE)
+        # В ключ кэша попадают только отметки видимых дней
+        labels = tuple(used_lessons.get(str(i), str(i)) for i in range(start + 1, end + 1))
+        reply_markup = views.lesson_page(category, subscription.id, start, labels, page, pages, owner)
+        
+        text = f"🎫 Абонемент: {subscription.name}\n\n"
+        text += f"Использовано дней: {subscription.used_count}/{total}\n\n"
+        if pages > 1:
+            text += f"Дни {start + 1}–{end} из {total}\n\n"
+        text += "Нажмите на день, чтобы отметить его:"
+        
+        return text, reply_markup
 
     def send_error_message(self, update: Update, text: str = None):
         """Отправка сообщения об ошибке"""
@@ -503,14 +678,10 @@ class SubscriptionHandler(BaseHandler):
             update.callback_query.answer()
             update.callback_query.edit_message_text(
                 text=text,
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main')
-                ]])
+                reply_markup=views.BACK_TO_MAIN_MARKUP
             )
         else:
             update.message.reply_text(
                 text=text,
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 В главное меню", callback_data='back_to_main')
-                ]])
+                reply_markup=views.BACK_TO_MAIN_MARKUP
             ) 
\ No newline at end of file
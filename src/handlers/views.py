@@ -0,0 +1,166 @@
+"""
+Экраны бота: статические клавиатуры собираются один раз при импорте и
+разделяются всеми чатами, параметризованные кэшируются по (экран, аргументы).
+
+Клавиатуры собираются из кортежей, чтобы общий объект нельзя было
+случайно изменить в обработчике.
+"""
+
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import LESSONS_ROW_SIZE
+
+
+def _markup(*rows) -> InlineKeyboardMarkup:
+    """Неизменяемая клавиатура из рядов кнопок"""
+    return InlineKeyboardMarkup(tuple(tuple(row) for row in rows))
+
+
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text, callback_data=callback_data)
+
+
+# Статические экраны
+SETTINGS_TEXT = "⚙️ Настройки\n\nВыберите действие:"
+SETTINGS_MARKUP = _markup(
+    [_button("➕ Создать категорию", "add_category")],
+    [_button("❌ Удалить категорию", "delete_category_menu")],
+    [_button("🔙 В главное меню", "back_to_main")],
+)
+
+MAIN_MENU_TEXT = "🏠 Главное меню\n\nВыберите категорию или перейдите в настройки:"
+SETTINGS_BUTTON = _button("⚙️ Настройки", "settings")
+
+BACK_TO_MAIN_MARKUP = _markup([_button("🔙 В главное меню", "back_to_main")])
+BACK_TO_SETTINGS_MARKUP = _markup([_button("🔙 Назад", "settings")])
+CANCEL_TO_SETTINGS_MARKUP = _markup([_button("🔙 Отмена", "settings")])
+
+
+@lru_cache(maxsize=1024)
+def main_menu(buttons: Tuple[Tuple[str, str], ...]) -> InlineKeyboardMarkup:
+    """Главное меню: кнопки категорий по две в ряд и кнопка настроек
+
+    buttons - кортеж пар (подпись, id категории).
+    """
+    rows = []
+    for start in range(0, len(buttons), 2):
+        rows.append([_button(label, f"category_{category}") for label, category in buttons[start:start + 2]])
+    rows.append([SETTINGS_BUTTON])
+    return _markup(*rows)
+
+
+@lru_cache(maxsize=1024)
+def category_menu(category: str, title: str = None) -> Tuple[str, InlineKeyboardMarkup]:
+    """Меню действий категории"""
+    text = f"📁 Категория: {title or category}\n\nВыберите действие:"
+    markup = _markup(
+        [_button("➕ Создать абонемент", f"create_{category}")],
+        [_button("📋 Список абонементов", f"subscription_list_{category}")],
+        [_button("✅ Отметить занятие группы", f"class_open_{category}")],
+        [_button("❌ Удалить абонемент", f"subscription_delete_menu_{category}")],
+        [_button("🗄 Архив", f"archive_list_{category}")],
+        [_button("🔙 В главное меню", "back_to_main")],
+    )
+    return text, markup
+
+
+@lru_cache(maxsize=1024)
+def back_to_category(category: str, label: str = "🔙 Назад") -> InlineKeyboardMarkup:
+    """Одна кнопка возврата в категорию ("Назад", "Отмена")"""
+    return _markup([_button(label, f"category_{category}")])
+
+
+@lru_cache(maxsize=1024)
+def subscription_created(category: str) -> InlineKeyboardMarkup:
+    """Кнопки после создания абонемента"""
+    return _markup(
+        [_button("📋 Показать все абонементы", f"subscription_list_{category}")],
+        [_button("🔙 К категории", f"category_{category}")],
+    )
+
+
+@lru_cache(maxsize=1024)
+def category_created(category: str) -> InlineKeyboardMarkup:
+    """Кнопки после создания категории"""
+    return _markup(
+        [_button("📁 Перейти в категорию", f"category_{category}")],
+        [_button("🔙 В главное меню", "back_to_main")],
+    )
+
+
+def page_navigation(prefix: str, page: int, pages: int) -> list:
+    """Ряд кнопок навигации по страницам"""
+    if pages <= 1:
+        return []
+
+    row = []
+    if page > 0:
+        row.append(_button("◀️", f"{prefix}_{page - 1}"))
+    row.append(_button(f"{page + 1}/{pages}", "noop"))
+    if page < pages - 1:
+        row.append(_button("▶️", f"{prefix}_{page + 1}"))
+    return row
+
+
+def mark_class(category: str, entries: Tuple[Tuple[str, str, bool, bool], ...], selected: int,
+               page: int, pages: int) -> InlineKeyboardMarkup:
+    """Экран отметки занятия группы
+
+    `entries` - абонементы страницы: (id, подпись, выбран, есть свободные
+    дни). Выбор меняется с каждым нажатием, поэтому экран не кэшируется.
+    """
+    rows = []
+    for sub_id, label, is_selected, available in entries:
+        if not available:
+            rows.append([_button(f"🏁 {label}", "noop")])
+        else:
+            rows.append([_button(f"{'☑️' if is_selected else '⬜'} {label}", f"class_toggle_{sub_id}_{page}")])
+
+    navigation = page_navigation("class_page", page, pages)
+    if navigation:
+        rows.append(navigation)
+    rows.append([_button("☑️ Выбрать всех / снять выбор", f"class_all_{page}")])
+    if selected:
+        rows.append([_button(f"✅ Отметить ({selected})", "class_confirm")])
+    rows.append([_button("🔙 Назад", f"category_{category}")])
+    return _markup(*rows)
+
+
+def lesson_prefix(sub_id: str, owner: Optional[int] = None) -> str:
+    """Префикс данных кнопок сетки занятий
+
+    У сообщения, отправленного через inline-режим, чата нет, поэтому в
+    кнопки его сетки записывается документ владельца абонемента.
+    """
+    if owner is None:
+        return f"lesson_{sub_id}"
+    return f"inline_lesson_{owner}_{sub_id}"
+
+
+@lru_cache(maxsize=512)
+def lesson_page(category: str, sub_id: str, start: int, labels: Tuple[str, ...],
+                page: int, pages: int, owner: Optional[int] = None) -> InlineKeyboardMarkup:
+    """Клавиатура одной страницы сетки занятий (кэшируется по видимым отметкам)"""
+    prefix = lesson_prefix(sub_id, owner)
+    rows = []
+    current_row = []
+    for offset, label in enumerate(labels):
+        current_row.append(_button(label, f"{prefix}_{start + offset + 1}"))
+        if len(current_row) == LESSONS_ROW_SIZE:
+            rows.append(current_row)
+            current_row = []
+
+    if current_row:
+        rows.append(current_row)
+
+    navigation = page_navigation(f"{prefix}_0", page, pages)
+    if navigation:
+        rows.append(navigation)
+
+    # Inline-сетка - отдельная карточка: списка абонементов за ней нет
+    if owner is None:
+        rows.append([_button("🔙 Назад", f"subscription_list_{category}")])
+    return _markup(*rows)
@@ -2,7 +2,8 @@
 Модели данных и менеджеры
 """
 
+from .domain import Category, Subscription, UserData
 from .user_data import UserDataManager
 from .subscription import SubscriptionManager
 
-__all__ = ['UserDataManager', 'SubscriptionManager'] 
\ No newline at end of file
+__all__ = ['Category', 'Subscription', 'UserData', 'UserDataManager', 'SubscriptionManager'] 
\ No newline at end of file
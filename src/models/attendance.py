@@ -0,0 +1,252 @@
+import base64
+import logging
+import threading
+from array import array
+from collections.abc import MutableMapping
+from datetime import date, datetime
+from typing import Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Префикс формата, чтобы в будущем можно было сменить кодировку
+ENCODING_PREFIX = 'a1'
+# Разбор строки выполняется один раз на объект; блокировка не дает потоку,
+# начавшему разбор раньше, затереть отметку, сделанную уже после разбора
+_DECODE_LOCK = threading.Lock()
+
+
+def _popcount(value: int) -> int:
+    """Количество установленных битов"""
+    return bin(value).count('1')
+
+
+class Attendance(MutableMapping):
+    """Отметки посещений абонемента
+
+    Хранит битовую маску занятых слотов и упакованный массив порядковых
+    номеров дат (date.toordinal) по слотам. Снаружи ведет себя как старый
+    словарь {"номер занятия": "дд.мм"}, поэтому обработчики не меняются.
+
+    На диске хранится строкой вида "a1|<кол-во>|<маска hex>|<даты base64>".
+    Строка разбирается лениво: количество отметок доступно сразу из
+    заголовка, а маска и даты декодируются при первом обращении к ключам.
+    """
+
+    __slots__ = ('_encoded', '_bits', '_dates', '_count', '_year')
+
+    def __init__(self, year: Optional[int] = None):
+        self._encoded: Optional[str] = None
+        self._bits = 0
+        self._dates = array('I')
+        self._count = 0
+        # Год для разбора строк "дд.мм" без года
+        self._year = year
+
+    @classmethod
+    def decode(cls, encoded: str) -> 'Attendance':
+        """Создание из строки on-disk формата (без разбора содержимого)"""
+        prefix, count, _ = encoded.split('|', 2)
+        if prefix != ENCODING_PREFIX:
+            raise ValueError(f"Неизвестный формат посещений: {prefix}")
+        attendance = cls()
+        attendance._encoded = encoded
+        attendance._count = int(count)
+        return attendance
+
+    @classmethod
+    def from_legacy(cls, used_lessons: dict, created_at: Optional[str] = None) -> 'Attendance':
+        """Миграция старого словаря {"1": "дд.мм"} без года
+
+        Год берется из даты создания абонемента; даты "раньше" создания
+        относятся к следующему году.
+        """
+        try:
+            created = datetime.fromisoformat(created_at).date() if created_at else date.today()
+        except ValueError:
+            created = date.today()
+
+        attendance = cls()
+        for lesson, value in used_lessons.items():
+            try:
+                slot = int(lesson)
+                day, month = (int(part) for part in str(value).split('.')[:2])
+                marked = date(created.year, month, day)
+                if marked < created:
+                    marked = date(created.year + 1, month, day)
+            except (TypeError, ValueError):
+                logger.warning(f"Некорректная отметка посещения {lesson}={value}, используется дата создания")
+                try:
+                    slot = int(lesson)
+                except (TypeError, ValueError):
+                    continue
+                marked = created
+            if slot > 0:
+                attendance.mark(slot, marked)
+        return attendance
+
+    @classmethod
+    def coerce(cls, value, created_at: Optional[str] = None) -> 'Attendance':
+        """Приведение значения из документа к Attendance"""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, str):
+            return cls.decode(value)
+        if isinstance(value, dict):
+            return cls.from_legacy(value, created_at)
+        return cls()
+
+    def _ensure(self) -> None:
+        """Ленивое декодирование маски и дат"""
+        if self._encoded is None:
+            return
+        with _DECODE_LOCK:
+            encoded = self._encoded
+            if encoded is None:
+                # Строку уже разобрал другой поток
+                return
+            _, _, bits_hex, dates_b64 = encoded.split('|', 3)
+            mask = int(bits_hex, 16) if bits_hex else 0
+            packed = array('I')
+            packed.frombytes(base64.b64decode(dates_b64))
+            # В упакованном виде даты хранятся только для занятых слотов
+            dates = array('I', [0]) * mask.bit_length()
+            bits, slot = mask, 0
+            for ordinal in packed:
+                while not bits & 1:
+                    bits >>= 1
+                    slot += 1
+                dates[slot] = ordinal
+                bits >>= 1
+                slot += 1
+            self._bits, self._dates = mask, dates
+            self._encoded = None
+
+    def encode(self) -> str:
+        """Кодирование в компактную строку"""
+        if self._encoded is not None:
+            return self._encoded
+        packed = array('I', (ordinal for ordinal in self._dates if ordinal))
+        return '|'.join((
+            ENCODING_PREFIX,
+            str(self._count),
+            format(self._bits, 'x') if self._bits else '',
+            base64.b64encode(packed.tobytes()).decode('ascii'),
+        ))
+
+    def ordinals(self) -> array:
+        """Даты отметок (date.toordinal) в порядке номеров занятий
+
+        Для еще не разобранной строки маска не декодируется: упакованный
+        массив дат берется из нее напрямую.
+        """
+        if self._encoded is not None:
+            packed = array('I')
+            packed.frombytes(base64.b64decode(self._encoded.rsplit('|', 1)[1]))
+            return packed
+        return array('I', (ordinal for ordinal in self._dates if ordinal))
+
+    def to_dict(self) -> dict:
+        """Представление в старом формате словаря"""
+        return dict(self.items())
+
+    @property
+    def used_count(self) -> int:
+        """Количество отмеченных занятий за O(1)"""
+        return self._count
+
+    def is_used(self, lesson_num: int) -> bool:
+        """Отмечено ли занятие"""
+        self._ensure()
+        return lesson_num > 0 and bool(self._bits >> (lesson_num - 1) & 1)
+
+    def used_in_range(self, first: int, last: int) -> int:
+        """Количество отметок среди занятий first..last (popcount по маске)"""
+        self._ensure()
+        if last < first:
+            return 0
+        mask = ((1 << (last - first + 1)) - 1) << (first - 1)
+        return _popcount(self._bits & mask)
+
+    def next_free(self, total: int) -> Optional[int]:
+        """Номер первого неотмеченного занятия или None"""
+        self._ensure()
+        free = ~self._bits & ((1 << total) - 1)
+        if not free:
+            return None
+        return (free & -free).bit_length()
+
+    def date_of(self, lesson_num: int) -> Optional[date]:
+        """Дата отметки занятия"""
+        if not self.is_used(lesson_num):
+            return None
+        return date.fromordinal(self._dates[lesson_num - 1])
+
+    def mark(self, lesson_num: int, day: Optional[date] = None) -> None:
+        """Отметка занятия"""
+        self._ensure()
+        slot = lesson_num - 1
+        if slot < 0:
+            raise KeyError(lesson_num)
+        if len(self._dates) <= slot:
+            self._dates.extend([0] * (slot + 1 - len(self._dates)))
+        if not self._bits >> slot & 1:
+            self._bits |= 1 << slot
+            self._count += 1
+        self._dates[slot] = (day or date.today()).toordinal()
+
+    def unmark(self, lesson_num: int) -> None:
+        """Снятие отметки занятия"""
+        self._ensure()
+        slot = lesson_num - 1
+        if slot < 0 or not self._bits >> slot & 1:
+            raise KeyError(lesson_num)
+        self._bits &= ~(1 << slot)
+        self._dates[slot] = 0
+        self._count -= 1
+
+    def _parse_value(self, value: Union[str, date]) -> date:
+        """Разбор даты отметки ("дд.мм" или date)"""
+        if isinstance(value, date):
+            return value
+        day, month = (int(part) for part in value.split('.')[:2])
+        return date(self._year or date.today().year, month, day)
+
+    @staticmethod
+    def _parse_key(key) -> int:
+        try:
+            return int(key)
+        except (TypeError, ValueError):
+            raise KeyError(key)
+
+    def __getitem__(self, key) -> str:
+        marked = self.date_of(self._parse_key(key))
+        if marked is None:
+            raise KeyError(key)
+        return marked.strftime('%d.%m')
+
+    def __setitem__(self, key, value: Union[str, date]) -> None:
+        self.mark(self._parse_key(key), self._parse_value(value))
+
+    def __delitem__(self, key) -> None:
+        self.unmark(self._parse_key(key))
+
+    def __contains__(self, key) -> bool:
+        try:
+            return self.is_used(int(key))
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        self._ensure()
+        bits, slot = self._bits, 1
+        while bits:
+            if bits & 1:
+                yield str(slot)
+            bits >>= 1
+            slot += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __repr__(self) -> str:
+        return f"Attendance({self.to_dict()!r})"
@@ -0,0 +1,190 @@
+"""
+Доменная модель: абонементы, категории и данные пользователя
+
+Объекты хранятся в кэше менеджеров вместо словарей: __slots__ убирают
+словарь атрибутов у каждого абонемента, а форма данных проверяется один раз
+при чтении документа, а не в каждом обработчике. Неизвестные ключи старых
+документов сохраняются в `extra` и записываются обратно без изменений.
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+
+from .attendance import Attendance
+
+
+class Subscription:
+    """Абонемент
+
+    Название, счетчики и даты хранятся в индексе чата, а отметки
+    посещений (`used_lessons`) - отдельно. Абонемент, прочитанный из
+    индекса, получает источник отметок и загружает их при первом
+    обращении к `used_lessons`; до этого `used_count` берется из индекса.
+    """
+
+    __slots__ = ('id', 'name', 'total_lessons', 'created_at', 'extra',
+                 '_used_lessons', '_used_count', '_source')
+
+    _KEYS = frozenset(('id', 'name', 'total_lessons', 'lessons', 'used_lessons', 'used_count', 'created_at'))
+
+    def __init__(self, name: str, total_lessons: int, used_lessons: Optional[Attendance] = None,
+                 created_at: Optional[str] = None, id: Optional[str] = None,
+                 extra: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.name = name
+        self.total_lessons = total_lessons
+        self._used_lessons = used_lessons if used_lessons is not None else Attendance()
+        self._used_count = 0
+        self._source = None
+        self.created_at = created_at
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], source=None) -> 'Subscription':
+        """Создание из словаря документа
+
+        Старый ключ `lessons` читается как `total_lessons`. Если отметок
+        в словаре нет (запись индекса), они загружаются из `source` -
+        объекта с методом attendance(sub_id, created_at).
+        """
+        created_at = data.get('created_at')
+        total = data.get('total_lessons', data.get('lessons', 0))
+        sub_id = data.get('id')
+        extra = {key: value for key, value in data.items() if key not in cls._KEYS}
+        subscription = cls(
+            name=str(data.get('name', '')),
+            total_lessons=int(total or 0),
+            created_at=created_at,
+            id=sub_id if isinstance(sub_id, str) and sub_id else None,
+            extra=extra or None,
+        )
+        if 'used_lessons' in data or source is None:
+            subscription._used_lessons = Attendance.coerce(data.get('used_lessons'), created_at)
+        else:
+            subscription._used_lessons = None
+            subscription._used_count = int(data.get('used_count', 0) or 0)
+            subscription._source = source
+        return subscription
+
+    @classmethod
+    def coerce(cls, value) -> 'Subscription':
+        """Приведение абонемента или словаря к Subscription"""
+        return value if isinstance(value, cls) else cls.from_dict(value)
+
+    @property
+    def used_lessons(self) -> Attendance:
+        """Отметки посещений (загружаются из источника при первом обращении)"""
+        attendance = self._used_lessons
+        if attendance is None:
+            source = self._source
+            if source is None:
+                # Отметки только что загрузил другой поток
+                return self._used_lessons
+            # Источник отдает всем потокам один и тот же объект
+            attendance = self._used_lessons = source.attendance(self.id, self.created_at)
+            self._source = None
+        return attendance
+
+    @used_lessons.setter
+    def used_lessons(self, value: Attendance) -> None:
+        self._used_lessons = value
+        self._source = None
+
+    @property
+    def is_loaded(self) -> bool:
+        """Загружены ли отметки посещений"""
+        return self._used_lessons is not None
+
+    def to_index(self) -> Dict[str, Any]:
+        """Запись индекса чата: все, кроме отметок"""
+        data = dict(self.extra) if self.extra else {}
+        if self.id is not None:
+            data['id'] = self.id
+        data['name'] = self.name
+        data['total_lessons'] = self.total_lessons
+        data['used_count'] = self.used_count
+        if self.created_at is not None:
+            data['created_at'] = self.created_at
+        return data
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Полный словарь абонемента; отметки кодирует сериализатор документа"""
+        data = self.to_index()
+        del data['used_count']
+        data['used_lessons'] = self.used_lessons
+        return data
+
+    @property
+    def used_count(self) -> int:
+        if self._used_lessons is None:
+            return self._used_count
+        return self._used_lessons.used_count
+
+    @property
+    def is_finished(self) -> bool:
+        return self.total_lessons > 0 and self.used_count >= self.total_lessons
+
+    def __repr__(self) -> str:
+        return f"Subscription(id={self.id!r}, name={self.name!r}, {self.used_count}/{self.total_lessons})"
+
+
+class Category:
+    """Категория пользователя"""
+
+    __slots__ = ('name', 'extra')
+
+    def __init__(self, name: str, extra: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, key: str, data: Any) -> 'Category':
+        if not isinstance(data, dict):
+            return cls(key)
+        extra = {name: value for name, value in data.items() if name != 'name'}
+        return cls(str(data.get('name') or key), extra or None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = dict(self.extra) if self.extra else {}
+        data['name'] = self.name
+        return data
+
+    def __repr__(self) -> str:
+        return f"Category({self.name!r})"
+
+
+class UserData:
+    """Данные пользователя: категории в порядке создания
+
+    `version` - версия документа, от которой он прочитан, `changes` -
+    изменения, еще не записанные на диск (повторяются при конфликте версий).
+    """
+
+    __slots__ = ('categories', 'extra', 'version', 'changes')
+
+    def __init__(self, categories: Optional[Dict[str, Category]] = None,
+                 extra: Optional[Dict[str, Any]] = None, version: int = 0):
+        self.categories: Dict[str, Category] = categories if categories is not None else {}
+        self.extra = extra
+        self.version = version
+        self.changes: List[Callable[['UserData'], Any]] = []
+
+    @classmethod
+    def from_dict(cls, data: Any, version: int = 0) -> 'UserData':
+        if not isinstance(data, dict):
+            return cls(version=version)
+        categories = data.get('categories')
+        extra = {key: value for key, value in data.items() if key != 'categories'}
+        return cls(
+            {key: Category.from_dict(key, value) for key, value in categories.items()}
+            if isinstance(categories, dict) else {},
+            extra or None,
+            version,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = dict(self.extra) if self.extra else {}
+        data['categories'] = {key: category.to_dict() for key, category in self.categories.items()}
+        return data
+
+    def __repr__(self) -> str:
+        return f"UserData(categories={list(self.categories)!r})"
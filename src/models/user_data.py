@@ -1,60 +1,142 @@
-import os
-import json
 import logging
-from typing import Dict, Any, Optional
-from config import USERS_DATA_DIR
+from typing import Any, Callable
+from config import USERS_DATA_DIR, STORAGE_FORMAT
+from utils import serialization
+from utils.metrics import metrics
+from utils.rosters import rosters
+from utils.storage import DOCUMENT, FileStorage, Storage
+from utils.tenants import TenantLocal
+from utils.tracing import span
+from utils.unit_of_work import current_unit_of_work
+from utils.versioning import (
+    CAS_RETRIES, VERSION_KEY, VersionConflict, backoff, check_version, stored_version, version_of
+)
+from .domain import UserData
 
 logger = logging.getLogger(__name__)
 
 class UserDataManager:
     """Менеджер пользовательских данных"""
     
+    serializer = serialization.get_serializer(STORAGE_FORMAT)
+    # Хранилище документов пользователей; заменяется целиком, например на
+    # MemoryStorage для замеров обработчиков без диска. В режиме нескольких
+    # студий обращения идут в хранилище студии обновления
+    storage: Storage = TenantLocal('user_storage', FileStorage(USERS_DATA_DIR))
+    
+    @staticmethod
+    def load_user_data(chat_id: int) -> UserData:
+        """Загрузка данных пользователя (участник общего списка получает данные списка)"""
+        chat_id = rosters.document_id(chat_id)
+        # В рамках одного обновления документ читается с диска один раз
+        uow = current_unit_of_work()
+        if uow is not None:
+            data = uow.get(('users', chat_id))
+            if data is not None:
+                return data
+        
+        with span('storage.load', doc=('users', chat_id)):
+            data = UserDataManager._read_user_data(chat_id)
+        if uow is not None:
+            uow.loaded(('users', chat_id), data)
+        return data
+    
     @staticmethod
-    def load_user_data(chat_id: int) -> Dict[str, Any]:
-        """Загрузка данных пользователя"""
+    def _read_user_data(chat_id: int) -> UserData:
+        """Чтение данных пользователя из хранилища"""
         try:
-            # Создаем директорию, если её нет
-            os.makedirs(USERS_DATA_DIR, exist_ok=True)
-            
-            # Путь к файлу с данными пользователя
-            user_file = os.path.join(USERS_DATA_DIR, f"{chat_id}.json")
-            
-            # Если файл существует, загружаем данные
-            if os.path.exists(user_file):
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            
-            # Если файла нет, создаем новую структуру данных
-            default_data = {
-                'categories': {}  # Пустой словарь для категорий пользователя
-            }
+            # Старый плоский файл хранилище переносит в шард при первом чтении
+            raw = UserDataManager.storage.load(int(chat_id))
+            if raw is not None:
+                document = serialization.loads(raw)
+                version = version_of(document)
+                if isinstance(document, dict):
+                    document.pop(VERSION_KEY, None)
+                return UserData.from_dict(document, version)
             
-            # Сохраняем новую структуру
-            with open(user_file, 'w', encoding='utf-8') as f:
-                json.dump(default_data, f, ensure_ascii=False, indent=2)
-            
-            return default_data
+            # Если документа нет, возвращаем новую структуру данных
+            # (документ будет создан при первом сохранении)
+            return UserData()
             
         except Exception as e:
             logger.error(f"Ошибка при загрузке данных пользователя {chat_id}: {e}")
-            return {'categories': {}}
+            return UserData()
     
     @staticmethod
-    def save_user_data(chat_id: int, data: Dict[str, Any]) -> bool:
-        """Сохранение данных пользователя"""
-        try:
-            # Создаем директорию, если её нет
-            os.makedirs(USERS_DATA_DIR, exist_ok=True)
-            
-            # Путь к файлу с данными пользователя
-            user_file = os.path.join(USERS_DATA_DIR, f"{chat_id}.json")
-            
-            # Сохраняем данные
-            with open(user_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
+    def save_user_data(chat_id: int, data: UserData) -> bool:
+        """Сохранение данных пользователя
+
+        Изменения, сделанные не через update_user_data, при конфликте
+        версий теряются: документ перечитывается с диска, и повторяются
+        только изменения из `data.changes`.
+        """
+        chat_id = rosters.document_id(chat_id)
+        # Внутри единицы работы запись откладывается до конца обновления
+        uow = current_unit_of_work()
+        if uow is not None:
+            uow.defer_save(('users', chat_id), data, lambda: UserDataManager._write_user_data(chat_id, data))
             return True
+        return UserDataManager._write_user_data(chat_id, data)
+    
+    @staticmethod
+    def update_user_data(chat_id: int, change: Callable[[UserData], Any]) -> bool:
+        """Изменение данных пользователя функцией `change`
+
+        Функция применяется к загруженным данным сразу, а при конфликте
+        версий во время записи - повторно к свежему документу. Если она
+        вернула False, изменений нет и запись не нужна.
+        """
+        data = UserDataManager.load_user_data(chat_id)
+        if change(data) is False:
+            return False
+        data.changes.append(change)
+        return UserDataManager.save_user_data(chat_id, data)
+    
+    @staticmethod
+    def _refresh(chat_id: int, data: UserData) -> None:
+        """Перечитывание документа после конфликта и повтор изменений"""
+        fresh = UserDataManager._read_user_data(chat_id)
+        data.categories, data.extra, data.version = fresh.categories, fresh.extra, fresh.version
+        for change in data.changes:
+            change(data)
+    
+    @staticmethod
+    def _write_user_data(chat_id: int, data: UserData) -> bool:
+        """Запись данных пользователя в хранилище
+
+        Если документ в хранилище изменился с момента чтения, изменения из
+        `data.changes` применяются к свежей версии под блокировкой документа.
+        """
+        storage = UserDataManager.storage
+        for attempt in range(CAS_RETRIES + 1):
+            try:
+                with storage.locked(int(chat_id)):
+                    if stored_version(storage, int(chat_id)) != data.version:
+                        # Документ изменил другой тренер или процесс: повторяем
+                        # изменения на свежей версии, не отпуская блокировку
+                        metrics.increment('cas.conflicts')
+                        with span('storage.rebase', changes=len(data.changes)):
+                            UserDataManager._refresh(chat_id, data)
+                        check_version(storage, int(chat_id), data.version)
+                    content = data.to_dict()
+                    content[VERSION_KEY] = data.version + 1
+                    # Хранилище заменяет документ атомарно
+                    storage.save(int(chat_id), [(DOCUMENT, UserDataManager.serializer.dumps(content))])
+                
+                data.version += 1
+                data.changes.clear()
+                metrics.increment('cas.commits')
+                return True
             
-        except Exception as e:
-            logger.error(f"Ошибка при сохранении данных пользователя {chat_id}: {e}")
-            return False 
\ No newline at end of file
+            except VersionConflict as e:
+                # Без межпроцессной блокировки документ мог измениться снова
+                logger.info(f"{e}; повтор записи, попытка {attempt + 1}")
+                backoff(attempt)
+            
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении данных пользователя {chat_id}: {e}")
+                return False
+        
+        metrics.increment('cas.exhausted')
+        logger.error(f"Не удалось записать данные пользователя {chat_id}: документ постоянно меняется")
+        return False
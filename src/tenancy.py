@@ -0,0 +1,119 @@
+"""
+Несколько студий в одном процессе
+
+Каждая студия из config.TENANTS получает свой Bot, Dispatcher и Updater
+(цикл диспетчера, long polling и планировщик задач - три потока), а
+общим становится то, что в отдельных процессах повторялось бы целиком:
+
+- интерпретатор, модули и кэши клавиатур handlers.views;
+- пул потоков обработчиков run_async (TENANT_WORKERS на все студии);
+- пул HTTP-соединений и ограничение частоты вызовов Bot API;
+- кэш документов (utils.cache): у каждой студии свой раздел, предел общий.
+
+Данные студий не пересекаются: у студии свой каталог (абонементы,
+users/, rosters.json, polling_offset), а обработчики видят ее хранилища
+через utils.tenants - диспетчер включает студию на время обработки.
+"""
+
+import logging
+import os
+import queue
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from telegram import Bot
+from telegram.ext import Dispatcher, DispatcherHandlerStop, JobQueue
+from telegram.ext.utils.promise import Promise
+
+from config import OUTBOUND_RATE_LIMIT, TENANT_WORKERS
+from utils.http import OutboundLimiter, build_request
+from utils.rosters import RosterRegistry
+from utils.storage import FileStorage
+from utils.tenants import Tenant, activate
+
+logger = logging.getLogger(__name__)
+
+
+def create_tenant(settings: Dict[str, str]) -> Tenant:
+    """Студия из записи config.TENANTS"""
+    name, token = settings['name'], settings['token']
+    if not name or '/' in name or name.startswith('.'):
+        raise ValueError(f"Некорректное имя студии: {name!r}")
+    data_dir = os.path.abspath(settings['data_dir'])
+    os.makedirs(data_dir, mode=0o700, exist_ok=True)
+    return Tenant(
+        name, token, data_dir,
+        rosters=RosterRegistry(os.path.join(data_dir, 'rosters.json')),
+        user_storage=FileStorage(os.path.join(data_dir, 'users')),
+    )
+
+
+class TenantDispatcher(Dispatcher):
+    """Диспетчер студии
+
+    Обработчики выполняются с включенной студией, а run_async - в общем
+    пуле потоков хоста вместо собственных потоков диспетчера.
+    """
+
+    def __init__(self, bot: Bot, tenant: Tenant, executor: ThreadPoolExecutor):
+        job_queue = JobQueue()
+        with warnings.catch_warnings():
+            # PTB предупреждает о диспетчере без потоков run_async - их заменяет общий пул
+            warnings.simplefilter('ignore')
+            super().__init__(bot, queue.Queue(), workers=0, job_queue=job_queue, use_context=True)
+        job_queue.set_dispatcher(self)
+        self.tenant = tenant
+        self.executor = executor
+
+    def process_update(self, update) -> None:
+        with activate(self.tenant):
+            super().process_update(update)
+
+    def _run_async(self, func, *args, update=None, error_handling=True, **kwargs) -> Promise:
+        promise = Promise(func, args, kwargs, update=update, error_handling=error_handling)
+        self.executor.submit(self._run_promise, promise)
+        return promise
+
+    def _run_promise(self, promise: Promise) -> None:
+        """Выполнение обработчика run_async; ошибка передается обработчику ошибок студии"""
+        with activate(self.tenant):
+            promise.run()
+            error = promise.exception
+            if error is None or isinstance(error, DispatcherHandlerStop):
+                return
+            if not promise.error_handling:
+                logger.error(f"Ошибка в обработчике без обработки ошибок ({self.tenant.name}): {error}")
+                return
+            try:
+                self.dispatch_error(promise.update, error, promise=promise)
+            except Exception:
+                logger.exception(f"Ошибка в обработчике ошибок студии {self.tenant.name}")
+
+
+class TenantHost:
+    """Общие ресурсы студий процесса"""
+
+    def __init__(self, tenants: int, workers: int = TENANT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tenant-worker')
+        # Один пул соединений на всех ботов: все они ходят на api.telegram.org
+        self.request = build_request(workers, pollers=tenants, limiter=OutboundLimiter(**OUTBOUND_RATE_LIMIT))
+        self.updaters: List = []
+
+    def dispatcher(self, tenant: Tenant) -> TenantDispatcher:
+        """Диспетчер студии на общих ресурсах"""
+        return TenantDispatcher(Bot(tenant.token, request=self.request), tenant, self.executor)
+
+    def add(self, updater) -> None:
+        """Updater студии, который нужно остановить вместе с хостом"""
+        self.updaters.append(updater)
+
+    def idle(self) -> None:
+        """Ожидание сигнала остановки и остановка всех студий"""
+        if not self.updaters:
+            return
+        # Сигналы принимает первый Updater, остальные останавливаются следом
+        self.updaters[0].idle()
+        for updater in self.updaters[1:]:
+            updater.stop()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,305 @@
+"""
+Аналитика посещений по всем абонементам
+
+Все отметки загружаются за один потоковый проход по каталогу данных в
+столбцы NumPy (даты, коды категорий и абонементов), а агрегаты считаются
+векторно, без циклов Python по отметкам.
+
+Запуск из каталога src:
+    python -m utils.analytics [--csv] [--synthetic N]
+"""
+
+import argparse
+import csv
+import io
+import logging
+import time
+from array import array
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from config import ANALYTICS_IDLE_DAYS, DATA_DIR
+from models.domain import Subscription
+from utils import serialization
+from utils.archive import identity, read_archive
+from utils.metrics import metrics
+from utils.storage import FileStorage, Storage
+from utils.subscription_manager import PayloadSource
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+# В текстовом отчете показываем только последние месяцы, в CSV - все
+TEXT_REPORT_MONTHS = 12
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class AttendanceFrame:
+    """Посещения всех абонементов в виде столбцов
+
+    Абонементы: sub_category (код категории), sub_total, sub_used,
+    sub_created (ordinal даты создания, 0 - неизвестна), sub_offsets
+    (начало отметок абонемента в mark_date).
+    Отметки: mark_date (ordinal), mark_sub и mark_category (коды).
+    Отметки одного абонемента лежат подряд.
+    """
+
+    __slots__ = ('categories', 'chats', 'sub_category', 'sub_total', 'sub_used', 'sub_created',
+                 'sub_offsets', 'mark_date', 'mark_sub', 'mark_category')
+
+    def __init__(self, categories, chats, sub_category, sub_total, sub_created, mark_counts, mark_date):
+        self.categories = list(categories)
+        self.chats = chats
+        self.sub_category = np.asarray(sub_category, dtype=np.int32)
+        self.sub_total = np.asarray(sub_total, dtype=np.int32)
+        self.sub_created = np.asarray(sub_created, dtype=np.int64)
+        self.sub_used = np.asarray(mark_counts, dtype=np.int64)
+        self.mark_date = np.asarray(mark_date, dtype=np.int64)
+        # Коды отметок восстанавливаются из числа отметок абонементов
+        self.sub_offsets = np.concatenate(([0], np.cumsum(self.sub_used)[:-1])) if len(self.sub_used) else self.sub_used
+        self.mark_sub = np.repeat(np.arange(len(self.sub_used), dtype=np.int32), self.sub_used)
+        self.mark_category = self.sub_category[self.mark_sub]
+
+    def __len__(self) -> int:
+        return len(self.mark_date)
+
+
+def _created_ordinal(created_at: Any) -> int:
+    """Дата создания абонемента в виде ordinal (0, если неизвестна)"""
+    if not isinstance(created_at, str):
+        return 0
+    try:
+        return datetime.fromisoformat(created_at).toordinal()
+    except ValueError:
+        return 0
+
+
+def load_frame(data_dir: str = DATA_DIR, storage: Optional[Storage] = None) -> AttendanceFrame:
+    """Потоковая загрузка посещений всех чатов хранилища (по умолчанию - каталога data_dir)
+
+    Документы читаются напрямую из хранилища мимо кэша менеджера и не
+    удерживаются в памяти: из каждого берутся только столбцы.
+    """
+    storage = storage if storage is not None else FileStorage(data_dir)
+    categories: Dict[str, int] = {}
+    sub_category = array('i')
+    sub_total = array('i')
+    sub_created = array('q')
+    mark_counts = array('q')
+    mark_date = array('I')
+    chats = 0
+
+    for chat_id in storage.chat_ids():
+        raw = storage.load(chat_id)
+        if raw is None:
+            continue
+        try:
+            document = serialization.loads(raw)
+        except ValueError as e:
+            logger.error(f"Не удалось прочитать данные чата {chat_id} для аналитики: {e}")
+            continue
+
+        chats += 1
+        # Отметки лежат отдельно от индекса чата и читаются одним документом
+        source = PayloadSource(storage, chat_id)
+        for category, subscriptions in document.items():
+            if isinstance(subscriptions, list):
+                categories.setdefault(category, len(categories))
+        entries = [
+            (category, Subscription.from_dict(sub, source))
+            for category, subscriptions in document.items() if isinstance(subscriptions, list)
+            for sub in subscriptions if isinstance(sub, dict)
+        ]
+        # История из архива, кроме абонементов, оставшихся и в документе после сбоя
+        present = {identity(subscription) for _, subscription in entries}
+        try:
+            entries.extend(
+                (category, subscription) for category, subscription, _ in read_archive(storage, chat_id)
+                if identity(subscription) not in present
+            )
+        except ValueError as e:
+            logger.error(f"Не удалось прочитать архив чата {chat_id} для аналитики: {e}")
+        for category, subscription in entries:
+            ordinals = subscription.used_lessons.ordinals()
+            sub_category.append(categories.setdefault(category, len(categories)))
+            sub_total.append(subscription.total_lessons)
+            sub_created.append(_created_ordinal(subscription.created_at))
+            mark_counts.append(len(ordinals))
+            mark_date.extend(ordinals)
+
+    return AttendanceFrame(categories, chats, sub_category, sub_total, sub_created, mark_counts, mark_date)
+
+
+def _safe_mean(total: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """Поэлементное среднее с нулем там, где нет данных"""
+    return np.divide(total, count, out=np.zeros(len(count), dtype=np.float64), where=count > 0)
+
+
+def compute_report(frame: AttendanceFrame, today: Optional[date] = None,
+                   idle_days: int = ANALYTICS_IDLE_DAYS) -> Dict[str, Any]:
+    """Векторный расчет агрегатов по загруженным посещениям"""
+    today_ordinal = (today or date.today()).toordinal()
+    category_count = len(frame.categories)
+    sub_count = len(frame.sub_total)
+
+    # Отметки по дням недели: ordinal 1 (01.01.0001) - понедельник
+    by_weekday = np.bincount((frame.mark_date - 1) % 7, minlength=7)
+
+    # Отметки по месяцам через datetime64
+    months = (frame.mark_date - _EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]')
+    month_labels, month_counts = np.unique(months, return_counts=True)
+
+    by_category = np.bincount(frame.mark_category, minlength=category_count)
+    subs_by_category = np.bincount(frame.sub_category, minlength=category_count)
+
+    # Последняя отметка каждого абонемента: максимум по отрезкам отметок
+    has_marks = frame.sub_used > 0
+    last_mark = np.zeros(sub_count, dtype=np.int64)
+    if len(frame.mark_date):
+        last_mark[has_marks] = np.maximum.reduceat(frame.mark_date, frame.sub_offsets[has_marks])
+
+    # Дней до завершения: от создания до последней отметки
+    finished = (frame.sub_total > 0) & (frame.sub_used >= frame.sub_total)
+    timed = finished & (frame.sub_created > 0)
+    days_to_finish = (last_mark - frame.sub_created)[timed]
+    finish_by_category = _safe_mean(
+        np.bincount(frame.sub_category[timed], weights=days_to_finish, minlength=category_count),
+        np.bincount(frame.sub_category[timed], minlength=category_count),
+    )
+
+    # Брошенные: не закончены и давно без отметок (или без отметок с создания)
+    last_activity = np.where(has_marks, last_mark, frame.sub_created)
+    dropped = ~finished & (last_activity > 0) & (today_ordinal - last_activity > idle_days)
+    dropped_by_category = np.bincount(frame.sub_category[dropped], minlength=category_count)
+
+    return {
+        'chats': frame.chats,
+        'subscriptions': sub_count,
+        'marks': len(frame),
+        'finished': int(finished.sum()),
+        'dropped': int(dropped.sum()),
+        'drop_off_rate': float(dropped.sum() / sub_count) if sub_count else 0.0,
+        'avg_days_to_finish': float(days_to_finish.mean()) if len(days_to_finish) else 0.0,
+        'idle_days': idle_days,
+        'by_weekday': {WEEKDAYS[day]: int(count) for day, count in enumerate(by_weekday)},
+        'by_month': {str(label): int(count) for label, count in zip(month_labels, month_counts)},
+        'by_category': {
+            name: {
+                'marks': int(by_category[code]),
+                'subscriptions': int(subs_by_category[code]),
+                'avg_days_to_finish': float(finish_by_category[code]),
+                'drop_off_rate': float(dropped_by_category[code] / subs_by_category[code])
+                if subs_by_category[code] else 0.0,
+            }
+            for code, name in enumerate(frame.categories)
+        },
+    }
+
+
+def build_report(data_dir: str = DATA_DIR, today: Optional[date] = None,
+                 storage: Optional[Storage] = None) -> Dict[str, Any]:
+    """Загрузка и расчет отчета с замером времени каждого этапа"""
+    started = time.perf_counter()
+    frame = load_frame(data_dir, storage)
+    loaded = time.perf_counter()
+    report = compute_report(frame, today)
+    finished = time.perf_counter()
+
+    metrics.observe('analytics.load', loaded - started)
+    metrics.observe('analytics.compute', finished - loaded)
+    report['timings'] = {'load_ms': (loaded - started) * 1000, 'compute_ms': (finished - loaded) * 1000}
+    logger.info(
+        f"Аналитика: отметок={report['marks']}, загрузка={report['timings']['load_ms']:.1f} мс, "
+        f"расчет={report['timings']['compute_ms']:.1f} мс"
+    )
+    return report
+
+
+def format_text(report: Dict[str, Any]) -> str:
+    """Текстовый отчет для администратора"""
+    lines = [
+        "📈 Аналитика посещений",
+        "",
+        f"Чатов: {report['chats']}, абонементов: {report['subscriptions']}, отметок: {report['marks']}",
+        f"Завершено: {report['finished']}, среднее время до завершения: {report['avg_days_to_finish']:.1f} дн.",
+        f"Брошено (нет отметок {report['idle_days']} дн.): {report['dropped']} "
+        f"({report['drop_off_rate']:.1%})",
+        "",
+        "По дням недели:",
+        ', '.join(f"{day} {count}" for day, count in report['by_weekday'].items()),
+        "",
+        "По месяцам:",
+    ]
+    months = list(report['by_month'].items())[-TEXT_REPORT_MONTHS:]
+    lines.extend(f"{month}: {count}" for month, count in months)
+    lines.extend(["", "По категориям:"])
+    for name, stats in report['by_category'].items():
+        lines.append(
+            f"{name}: отметок {stats['marks']}, абонементов {stats['subscriptions']}, "
+            f"до завершения {stats['avg_days_to_finish']:.1f} дн., брошено {stats['drop_off_rate']:.1%}"
+        )
+    timings = report.get('timings')
+    if timings:
+        lines.extend(["", f"⏱ Загрузка {timings['load_ms']:.0f} мс, расчет {timings['compute_ms']:.1f} мс"])
+    return '\n'.join(lines)
+
+
+def format_csv(report: Dict[str, Any]) -> bytes:
+    """Отчет в CSV: раздел, ключ, показатель, значение"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['section', 'key', 'metric', 'value'])
+    for metric in ('chats', 'subscriptions', 'marks', 'finished', 'dropped', 'drop_off_rate', 'avg_days_to_finish'):
+        writer.writerow(['total', '', metric, report[metric]])
+    for day, count in report['by_weekday'].items():
+        writer.writerow(['weekday', day, 'marks', count])
+    for month, count in report['by_month'].items():
+        writer.writerow(['month', month, 'marks', count])
+    for name, stats in report['by_category'].items():
+        for metric, value in stats.items():
+            writer.writerow(['category', name, metric, value])
+    for metric, value in report.get('timings', {}).items():
+        writer.writerow(['timing', '', metric, f'{value:.3f}'])
+    return buffer.getvalue().encode('utf-8')
+
+
+def synthetic_frame(marks: int, lessons: int = 8, categories: int = 5, seed: int = 0) -> AttendanceFrame:
+    """Случайные данные заданного объема для замера скорости расчета"""
+    rng = np.random.default_rng(seed)
+    sub_count = max(1, marks // (lessons // 2 or 1))
+    start = date.today().toordinal() - 730
+    counts = rng.integers(0, lessons + 1, sub_count)
+    created = start + rng.integers(0, 700, sub_count)
+    # Отметки абонемента идут после его создания
+    mark_date = np.repeat(created, counts) + rng.integers(0, 60, int(counts.sum()))
+    return AttendanceFrame(
+        [f'category_{code}' for code in range(categories)], sub_count,
+        rng.integers(0, categories, sub_count), np.full(sub_count, lessons), created, counts, mark_date,
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Аналитика посещений')
+    parser.add_argument('--csv', action='store_true', help='вывести отчет в CSV')
+    parser.add_argument('--synthetic', type=int, metavar='N',
+                        help='замер на N случайных отметках вместо каталога данных')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        started = time.perf_counter()
+        frame = synthetic_frame(args.synthetic)
+        generated = time.perf_counter()
+        result = compute_report(frame)
+        result['timings'] = {'load_ms': (generated - started) * 1000,
+                             'compute_ms': (time.perf_counter() - generated) * 1000}
+    else:
+        result = build_report()
+
+    if args.csv:
+        print(format_csv(result).decode('utf-8'), end='')
+    else:
+        print(format_text(result))
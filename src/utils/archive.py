@@ -0,0 +1,117 @@
+"""
+Архив абонементов
+
+Закончившиеся и брошенные абонементы переносятся из документа чата в
+сжатый архив чата - документ вида '.archive' ({chat}.archive рядом с
+файлом чата). Документ чата читается и
+перезаписывается при каждой отметке, а архив - только при открытии
+экрана архива и при восстановлении, поэтому история студии не замедляет
+работу с текущими абонементами.
+
+Перенос - две записи: сначала абонемент добавляется в архив, затем
+удаляется из документа чата (восстановление - в обратном порядке). После
+сбоя между ними абонемент оказывается в обоих документах; такие записи архива
+не показываются, а следующий перенос того же абонемента их заменяет.
+"""
+
+from contextlib import nullcontext
+from datetime import date, datetime
+from typing import Callable, List, Optional, Tuple
+
+from config import ARCHIVE_FINISHED_DAYS, ARCHIVE_FORMAT, ARCHIVE_IDLE_DAYS
+from models.domain import Subscription
+from utils import serialization
+from utils.storage import Storage
+from utils.tracing import span
+
+ARCHIVE_SUFFIX = '.archive'
+
+# Запись архива: (категория, абонемент с отметками, когда перенесен)
+ArchivedSubscription = Tuple[str, Subscription, str]
+
+
+def identity(subscription: Subscription) -> Tuple[Optional[str], Optional[str]]:
+    """Ключ абонемента для поиска дублей: id уникален только среди
+    абонементов документа, поэтому сравнивается вместе с датой создания"""
+    return subscription.id, subscription.created_at
+
+
+def last_activity(subscription: Subscription) -> int:
+    """Дата последней отметки, а без отметок - дата создания (ordinal, 0 - неизвестна)"""
+    # Без отметок файл отметок чата не читается: хватает счетчика индекса
+    if subscription.used_count:
+        ordinals = subscription.used_lessons.ordinals()
+        if len(ordinals):
+            return max(ordinals)
+    try:
+        return datetime.fromisoformat(subscription.created_at).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+def is_archivable(subscription: Subscription, today: Optional[date] = None,
+                  finished_days: int = ARCHIVE_FINISHED_DAYS, idle_days: int = ARCHIVE_IDLE_DAYS) -> bool:
+    """Пора ли переносить абонемент в архив"""
+    last = last_activity(subscription)
+    if not last:
+        return False
+    age = (today or date.today()).toordinal() - last
+    if subscription.is_finished:
+        return age >= finished_days
+    return idle_days > 0 and age >= idle_days
+
+
+def _decode(raw: Optional[bytes]) -> List[dict]:
+    if raw is None:
+        return []
+    entries = serialization.loads(raw).get('subscriptions', [])
+    return [entry for entry in entries if isinstance(entry, dict)]
+
+
+def _encode(entry: ArchivedSubscription) -> dict:
+    category, subscription, archived_at = entry
+    data = subscription.to_dict()
+    data['used_lessons'] = subscription.used_lessons.encode()
+    data['category'] = category
+    data['archived_at'] = archived_at
+    return data
+
+
+def _parse(raw: Optional[bytes]) -> List[ArchivedSubscription]:
+    archived = []
+    for entry in _decode(raw):
+        entry = dict(entry)
+        category = str(entry.pop('category', ''))
+        archived_at = str(entry.pop('archived_at', ''))
+        archived.append((category, Subscription.from_dict(entry), archived_at))
+    return archived
+
+
+def read_archive(storage: Storage, chat_id: int) -> List[ArchivedSubscription]:
+    """Все абонементы архива чата в порядке переноса"""
+    with span('storage.load_archive'):
+        return _parse(storage.load(chat_id, ARCHIVE_SUFFIX))
+
+
+def update_archive(storage: Storage, chat_id: int, change: Callable[[List[ArchivedSubscription]], None],
+                   storage_format: str = ARCHIVE_FORMAT, guard=None) -> None:
+    """Изменение архива чата под блокировкой документа; пустой архив удаляется
+
+    `guard` - блокировка, под которой выполняются `change` и кодирование
+    записей (берется уже под блокировкой документа архива). Ошибки чтения
+    и записи не перехватываются: пока архив не записан, документ чата
+    менять нельзя.
+    """
+    serializer = serialization.get_serializer(storage_format)
+
+    def apply(raw: Optional[bytes]) -> Optional[bytes]:
+        archived = _parse(raw)
+        with guard if guard is not None else nullcontext():
+            change(archived)
+            entries = [_encode(entry) for entry in archived]
+        if not entries:
+            return None
+        return serializer.dumps({'subscriptions': entries})
+
+    with span('storage.save_archive'):
+        storage.update(chat_id, apply, ARCHIVE_SUFFIX)
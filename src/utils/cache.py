@@ -0,0 +1,175 @@
+"""
+Общий кэш документов чатов
+
+Менеджеры абонементов процесса (по одному на студию) держат прочитанные
+документы в одном кэше с общим пределом по объему. Объем документа
+оценивается размером его файлов в хранилище (прочитанных или записанных)
+плюс ENTRY_OVERHEAD на запись кэша: он растет с числом абонементов и
+отметок, а в памяти документ занимает примерно в 2-3 раза больше файлов
+(замер по студиям: python -m utils.footprint --tenants 3).
+
+У каждого менеджера свой раздел: ключи разных студий не пересекаются, а
+документ вытесняется из самого большого по объему раздела - давно не
+открывавшийся. Поэтому активная студия не вытесняет документы тихой, пока
+та занимает не больше своей доли предела. Не вытесняются документы с
+незаписанными изменениями и закрепленные (pin) - их держит единица работы
+обновления: иначе следующее чтение создало бы вторую копию документа.
+
+Все разделы работают под одной блокировкой `DocumentCache.lock`:
+менеджеры используют ее как блокировку своего кэша и индексов, поэтому
+вытеснение из чужого раздела и очистка его индексов не требуют других
+блокировок. Сами разделы блокировку не берут.
+"""
+
+import weakref
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config import DOCUMENT_CACHE_BYTES
+from utils.metrics import metrics
+
+# Оценка объема записи кэша без содержимого документа (объект документа,
+# индексы менеджера); не дает пустым документам копиться без предела
+ENTRY_OVERHEAD = 512
+
+
+class CachePartition:
+    """Раздел кэша одного менеджера (LRU); обращения - под `cache.lock`"""
+
+    __slots__ = ('cache', 'name', 'on_evict', 'size', '_entries', '_sizes', '_pins', '__weakref__')
+
+    def __init__(self, cache: 'DocumentCache', name: str, on_evict: Optional[Callable[[Hashable], None]] = None):
+        self.cache = cache
+        self.name = name
+        # Вызывается под общей блокировкой и не должен брать ее снова
+        self.on_evict = on_evict
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        # Оценка объема документов раздела в байтах
+        self.size = 0
+        self._sizes: Dict[Hashable, int] = {}
+        # Ключ -> число закреплений; закрепить можно и еще не прочитанный документ
+        self._pins: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._entries.get(key)
+        if value is None:
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        """Документ без новой оценки объема (замена того же документа)"""
+        self.put(key, value, self._sizes.get(key, ENTRY_OVERHEAD) - ENTRY_OVERHEAD)
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        """Документ с объемом `size` байт (размер его файлов в хранилище)"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._resize(key, size)
+
+    def resize(self, key: Hashable, size: int) -> None:
+        """Новая оценка объема документа, например после записи"""
+        if key in self._entries:
+            self._resize(key, size)
+
+    def grow(self, key: Hashable, size: int) -> None:
+        """Увеличение оценки объема документа на `size` байт (догруженные части)"""
+        if key in self._entries:
+            self._resize(key, self._sizes[key] - ENTRY_OVERHEAD + size)
+
+    def _resize(self, key: Hashable, size: int) -> None:
+        size += ENTRY_OVERHEAD
+        self.size += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self.cache.shrink()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        self.size -= self._sizes.pop(key, 0)
+        return self._entries.pop(key, default)
+
+    def pin(self, key: Hashable) -> None:
+        """Запрет вытеснения документа до парного unpin"""
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key: Hashable) -> None:
+        count = self._pins.get(key, 0) - 1
+        if count > 0:
+            self._pins[key] = count
+        else:
+            self._pins.pop(key, None)
+        # Пока документ был закреплен, раздел мог превысить предел
+        self.cache.shrink()
+
+    def evict_one(self) -> bool:
+        """Вытеснение самого давнего документа без незаписанных изменений и закреплений"""
+        for key, value in self._entries.items():
+            if key in self._pins or getattr(value, 'changes', None):
+                continue
+            del self._entries[key]
+            self.size -= self._sizes.pop(key, 0)
+            if self.on_evict is not None:
+                self.on_evict(key)
+            metrics.increment('cache.evictions')
+            return True
+        return False
+
+
+class DocumentCache:
+    """Кэш документов с общим пределом `capacity` байт (0 - без предела)"""
+
+    def __init__(self, capacity: int = DOCUMENT_CACHE_BYTES):
+        self.capacity = capacity
+        self.lock = Lock()
+        # Разделы живут, пока жив их менеджер
+        self._partitions: 'weakref.WeakSet[CachePartition]' = weakref.WeakSet()
+
+    def partition(self, name: str, on_evict: Optional[Callable[[Hashable], None]] = None) -> CachePartition:
+        """Новый раздел кэша"""
+        partition = CachePartition(self, name, on_evict)
+        with self.lock:
+            self._partitions.add(partition)
+        return partition
+
+    def __len__(self) -> int:
+        return sum(len(partition) for partition in list(self._partitions))
+
+    @property
+    def size(self) -> int:
+        """Оценка объема всех документов в байтах"""
+        return sum(partition.size for partition in list(self._partitions))
+
+    def usage(self) -> Dict[str, Tuple[int, int]]:
+        """Занятость по разделам: имя -> (документов, оценка объема в байтах)"""
+        with self.lock:
+            return {partition.name: (len(partition), partition.size) for partition in self._partitions}
+
+    def shrink(self) -> None:
+        """Вытеснение документов сверх предела (вызывается под `lock`)"""
+        if self.capacity <= 0:
+            return
+        partitions = list(self._partitions)
+        while sum(partition.size for partition in partitions) > self.capacity:
+            # Доли разделов равны, поэтому больше всех превышает свою самый большой
+            for partition in sorted(partitions, key=lambda partition: partition.size, reverse=True):
+                if partition.evict_one():
+                    break
+            else:
+                # Остались только документы с незаписанными изменениями
+                return
+
+
+# Общий кэш процесса
+document_cache = DocumentCache()
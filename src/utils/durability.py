@@ -0,0 +1,297 @@
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import STORAGE_DURABILITY, GROUP_COMMIT_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Уровни надежности записи
+DURABILITY_NONE = 'none'            # только атомарная замена файла
+DURABILITY_FSYNC = 'fsync'          # данные файла сброшены на диск до замены
+DURABILITY_FSYNC_DIR = 'fsync_dir'  # плюс fsync каталога после замены
+
+DURABILITY_MODES = (DURABILITY_NONE, DURABILITY_FSYNC, DURABILITY_FSYNC_DIR)
+
+
+class _PendingWrite:
+    """Запись, ожидающая фиксации"""
+
+    __slots__ = ('temp_path', 'final_path', 'done', 'error')
+
+    def __init__(self, temp_path: str, final_path: str):
+        self.temp_path = temp_path
+        self.final_path = final_path
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class WriteBarrier:
+    """Барьер записи
+
+    Записи выполняются параллельно под общей блокировкой, а снимок данных
+    берет исключительную: дожидается завершения начатых записей и на время
+    снимка задерживает новые. Общая блокировка повторно входима в пределах
+    потока, поэтому запись документа внутри единицы работы не ждет саму себя.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._writers = 0
+        self._closed = False
+        self._local = threading.local()
+
+    @contextmanager
+    def write(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            with self._condition:
+                while self._closed:
+                    self._condition.wait()
+                self._writers += 1
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._condition:
+                    self._writers -= 1
+                    if not self._writers:
+                        self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            while self._closed:
+                self._condition.wait()
+            self._closed = True
+            while self._writers:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._closed = False
+                self._condition.notify_all()
+
+
+class GroupCommitter:
+    """Групповая фиксация записей всех чатов
+
+    Записи, пришедшие в течение окна `window` секунд, фиксируются одной
+    пачкой: fsync временных файлов пачки, затем атомарные замены файлов и
+    по одному fsync на каждый затронутый каталог. Так fsync каталога
+    делится между всеми записями пачки, а не повторяется на каждое нажатие.
+    Если сброс не удался, запись завершается ошибкой у ее писателя.
+
+    Сравнение задержки и пропускной способности уровней надежности
+    (запуск из каталога src):
+        python -m utils.durability --threads 8 --ops 200
+    """
+
+    def __init__(self, mode: str = DURABILITY_NONE, window: float = 0.005):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Неизвестный уровень надежности: {mode}")
+        self.mode = mode
+        self.window = window
+        self._queue: List[_PendingWrite] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        # Статистика для мониторинга
+        self.batches = 0
+        self.writes = 0
+        self.barrier = WriteBarrier()
+        # Пути, замененные после начала снимка (None - снимок не идет)
+        self._changed: Optional[Set[str]] = None
+        self._changed_lock = threading.Lock()
+
+    def commit(self, temp_path: str, final_path: str) -> None:
+        """Атомарная замена final_path файлом temp_path с выбранной надежностью
+
+        Возвращает управление, когда запись зафиксирована.
+        """
+        self.commit_many([(temp_path, final_path)])
+
+    def commit_many(self, pairs: List[Tuple[str, str]]) -> None:
+        """Фиксация нескольких файлов (например, всех файлов документа) одной пачкой
+
+        Файлы попадают в одну пачку и заменяются в порядке `pairs`, поэтому
+        нажатие ждет одно окно и один fsync каталога, а не по одному на
+        файл. Если не зафиксировался хотя бы один файл, возникает ошибка.
+        """
+        with self.barrier.write():
+            if self.mode == DURABILITY_NONE:
+                for temp_path, final_path in pairs:
+                    os.replace(temp_path, final_path)
+                    self.record_change(final_path)
+                return
+
+            batch = [_PendingWrite(temp_path, final_path) for temp_path, final_path in pairs]
+            with self._lock:
+                self._ensure_thread()
+                self._queue.extend(batch)
+                self._wakeup.notify()
+            for pending in batch:
+                pending.done.wait()
+        for pending in batch:
+            if pending.error is not None:
+                raise pending.error
+
+    def track_changes(self) -> None:
+        """Начало учета замененных файлов (для снимка данных)"""
+        with self._changed_lock:
+            self._changed = set()
+
+    def take_changes(self) -> Set[str]:
+        """Замененные с начала учета файлы; учет прекращается"""
+        with self._changed_lock:
+            changed, self._changed = self._changed, None
+        return changed or set()
+
+    def record_change(self, final_path: str) -> None:
+        """Учет файла, замененного в обход commit (например, при переносе в шард)"""
+        if self._changed is not None:
+            with self._changed_lock:
+                if self._changed is not None:
+                    self._changed.add(final_path)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._wakeup.wait()
+            # Даем окну набрать записи других чатов
+            time.sleep(self.window)
+            with self._lock:
+                batch, self._queue = self._queue, []
+            self._flush(batch)
+
+    def _flush(self, batch: List[_PendingWrite]) -> None:
+        """Фиксация пачки записей"""
+        try:
+            self._sync_files(batch)
+        except OSError as e:
+            logger.error(f"Ошибка при сбросе данных на диск: {e}")
+            for pending in batch:
+                pending.error = e
+                pending.done.set()
+            return
+
+        directories: Dict[str, List[_PendingWrite]] = {}
+        for pending in batch:
+            try:
+                os.replace(pending.temp_path, pending.final_path)
+                self.record_change(pending.final_path)
+                directories.setdefault(os.path.dirname(pending.final_path), []).append(pending)
+            except OSError as e:
+                pending.error = e
+
+        if self.mode == DURABILITY_FSYNC_DIR:
+            for directory, written in directories.items():
+                try:
+                    self._fsync_directory(directory)
+                except OSError as e:
+                    # Замена могла не пережить сбой питания: запись не считается надежной
+                    logger.error(f"Ошибка при fsync каталога {directory}: {e}")
+                    for pending in written:
+                        pending.error = e
+
+        self.batches += 1
+        self.writes += len(batch)
+        for pending in batch:
+            pending.done.set()
+
+    @staticmethod
+    def _sync_files(batch: List[_PendingWrite]) -> None:
+        """Сброс данных временных файлов пачки
+
+        Сбрасываются только файлы пачки: общий os.sync() ждал бы грязные
+        страницы всех процессов машины, и задержка нажатия зависела бы от
+        чужого ввода-вывода.
+        """
+        for pending in batch:
+            fd = os.open(pending.temp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _fsync_directory(directory: str) -> None:
+        """fsync каталога, чтобы переименование пережило сбой питания"""
+        if os.name == 'nt':
+            return
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+# Общий планировщик для всех менеджеров данных процесса
+group_committer = GroupCommitter(STORAGE_DURABILITY, GROUP_COMMIT_WINDOW)
+
+
+def _benchmark(mode: str, threads: int, ops: int, size: int, window: float) -> None:
+    """Записи `threads` потоков по `ops` файлов в своем каталоге с уровнем `mode`"""
+    from utils.fileio import write_private_file
+
+    committer = GroupCommitter(mode, window)
+    data_dir = tempfile.mkdtemp(prefix=f'durability-{mode}-')
+    payload = os.urandom(size)
+    latencies: List[float] = []
+    guard = threading.Lock()
+
+    def worker(index: int) -> None:
+        local = []
+        for step in range(ops):
+            target = os.path.join(data_dir, f'{index}-{step % 16}.json')
+            temp_file = f'{target}.{threading.get_ident()}.tmp'
+            started = time.perf_counter()
+            write_private_file(temp_file, payload)
+            committer.commit(temp_file, target)
+            local.append(time.perf_counter() - started)
+        with guard:
+            latencies.extend(local)
+
+    try:
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    batches = f", пачек: {committer.batches}" if committer.batches else ""
+    print(f"{mode:<10} {len(latencies) / elapsed:8.0f} записей/с  p50={percentiles[49] * 1e3:7.2f} мс  "
+          f"p99={percentiles[98] * 1e3:7.2f} мс{batches}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сравнение уровней надежности записи')
+    parser.add_argument('--mode', choices=('all',) + DURABILITY_MODES, default='all')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=200, help='записей на поток')
+    parser.add_argument('--size', type=int, default=2048, help='размер документа в байтах')
+    parser.add_argument('--window', type=float, default=GROUP_COMMIT_WINDOW, help='окно групповой фиксации, с')
+    args = parser.parse_args()
+    for mode in DURABILITY_MODES if args.mode == 'all' else (args.mode,):
+        _benchmark(mode, args.threads, args.ops, args.size, args.window)
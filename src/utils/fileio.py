@@ -0,0 +1,57 @@
+import os
+import threading
+from typing import Optional, Set
+
+# Временный файл создается сразу с правами только для владельца,
+# поэтому отдельный chmod после записи не нужен
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_CLOEXEC', 0) | getattr(os, 'O_BINARY', 0)
+_READ_FLAGS = os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0) | getattr(os, 'O_BINARY', 0)
+_READ_CHUNK = 1 << 16
+
+
+def write_private_file(path: str, payload: bytes) -> None:
+    """Запись файла с правами 0600: open, write, close"""
+    fd = os.open(path, _WRITE_FLAGS, 0o600)
+    try:
+        view = memoryview(payload)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+
+
+def read_file(path: str) -> Optional[bytes]:
+    """Чтение файла целиком без предварительных exists/stat; None, если файла нет"""
+    try:
+        fd = os.open(path, _READ_FLAGS)
+    except FileNotFoundError:
+        return None
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, _READ_CHUNK)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+    finally:
+        os.close(fd)
+
+
+class DirectoryRegistry:
+    """Каталоги, созданные процессом: makedirs выполняется один раз на каталог"""
+
+    def __init__(self):
+        self._known: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def ensure(self, path: str) -> None:
+        if path in self._known:
+            return
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        with self._lock:
+            self._known.add(path)
+
+
+directories = DirectoryRegistry()
@@ -0,0 +1,216 @@
+"""
+Замер памяти, которую занимают данные чата в кэше процесса
+
+Строится набор документов одного размера в нескольких представлениях, и
+tracemalloc показывает, сколько байт приходится на один документ.
+
+Отметки посещений (models.attendance):
+- dict - старый словарь {"номер занятия": "дд.мм"};
+- bitmap - Attendance после разбора: маска и массив дат;
+- lazy - Attendance, прочитанный из документа и еще не разобранный.
+Для каждого представления печатается и размер на диске (JSON).
+
+Абонементы в кэше менеджера (models.domain), отметки во всех вариантах -
+Attendance:
+- dict - словари документа, как до перехода на модели;
+- slots - Subscription со __slots__ и загруженными отметками;
+- index - Subscription из индекса чата, отметки еще не загружались.
+
+С --tenants N замеряется и память кэша студий процесса: у каждой студии
+свое хранилище и свой раздел общего кэша (utils.cache), документы читаются
+с отметками, и для каждой студии печатается занятая память рядом с
+оценкой объема, по которой кэш ограничивается (DOCUMENT_CACHE_BYTES).
+
+Запуск из каталога src:
+    python -m utils.footprint [--documents 500] [--subscriptions 20] [--lessons 60] [--used 40] [--tenants 3]
+"""
+
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from models.attendance import Attendance
+from models.domain import Subscription
+from utils.cache import DocumentCache
+from utils.storage import MemoryStorage
+from utils.subscription_manager import SubscriptionManager
+
+# Первый день, от которого отсчитываются даты отметок
+START = date(2024, 9, 1)
+
+
+def measure(build: Callable[[], List]) -> int:
+    """Память, занятая результатом build(), в байтах"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return allocated
+
+
+def _marks(rng: random.Random, lessons: int, used: int) -> Dict[int, date]:
+    """Отметки одного абонемента: номер занятия -> дата"""
+    slots = sorted(rng.sample(range(1, lessons + 1), min(used, lessons)))
+    return {slot: START + timedelta(days=3 * position) for position, slot in enumerate(slots)}
+
+
+def attendance_documents(documents: int, subscriptions: int, lessons: int,
+                         used: int) -> Dict[str, Callable[[], List]]:
+    """Построители документов с отметками в каждом представлении"""
+    rng = random.Random(0)
+    marks = [[_marks(rng, lessons, used) for _ in range(subscriptions)] for _ in range(documents)]
+
+    def as_dict() -> List:
+        return [[{str(slot): day.strftime('%d.%m') for slot, day in sub.items()} for sub in doc] for doc in marks]
+
+    def as_bitmap() -> List:
+        result = []
+        for doc in marks:
+            subs = []
+            for sub in doc:
+                attendance = Attendance()
+                for slot, day in sub.items():
+                    attendance.mark(slot, day)
+                subs.append(attendance)
+            result.append(subs)
+        return result
+
+    encoded = [[attendance.encode() for attendance in doc] for doc in as_bitmap()]
+
+    def as_lazy() -> List:
+        # Строки из документа читаются заново, как при загрузке с диска
+        return [[Attendance.decode(''.join(value)) for value in doc] for doc in encoded]
+
+    return {'dict': as_dict, 'bitmap': as_bitmap, 'lazy': as_lazy}
+
+
+def report_attendance(documents: int, subscriptions: int, lessons: int, used: int) -> None:
+    print(f"Отметки: {documents} документов x {subscriptions} абонементов, "
+          f"{used} из {lessons} занятий отмечено")
+    builders = attendance_documents(documents, subscriptions, lessons, used)
+    on_disk = {
+        'dict': lambda doc: doc,
+        'bitmap': lambda doc: [attendance.encode() for attendance in doc],
+        'lazy': lambda doc: [attendance.encode() for attendance in doc],
+    }
+    for name, build in builders.items():
+        memory = measure(build)
+        sample = build()[0]
+        disk = len(json.dumps(on_disk[name](sample), ensure_ascii=False).encode('utf-8'))
+        print(f"  {name:<7} {memory / documents:10.0f} байт/документ в памяти, {disk:7d} байт на диске")
+
+
+def subscription_documents(documents: int, subscriptions: int, lessons: int,
+                           used: int) -> Dict[str, Callable[[], List]]:
+    """Построители документов с абонементами в каждом представлении"""
+    rng = random.Random(1)
+    marks = [[_marks(rng, lessons, used) for _ in range(subscriptions)] for _ in range(documents)]
+    created_at = START.isoformat()
+
+    def attendance(sub: Dict[int, date]) -> Attendance:
+        result = Attendance()
+        for slot, day in sub.items():
+            result.mark(slot, day)
+        return result
+
+    def records() -> List:
+        return [
+            [{'id': f"{chat:03x}{index:03x}", 'name': f"Ученица {index}", 'total_lessons': lessons,
+              'used_lessons': attendance(sub), 'created_at': created_at}
+             for index, sub in enumerate(doc)]
+            for chat, doc in enumerate(marks)
+        ]
+
+    def as_slots() -> List:
+        return [
+            [Subscription(f"Ученица {index}", lessons, attendance(sub), created_at, f"{chat:03x}{index:03x}")
+             for index, sub in enumerate(doc)]
+            for chat, doc in enumerate(marks)
+        ]
+
+    def as_index() -> List:
+        # Источник отметок общий у документа, как у менеджера
+        source = object()
+        return [
+            [Subscription.from_dict({'id': f"{chat:03x}{index:03x}", 'name': f"Ученица {index}",
+                                     'total_lessons': lessons, 'used_count': len(sub),
+                                     'created_at': created_at}, source)
+             for index, sub in enumerate(doc)]
+            for chat, doc in enumerate(marks)
+        ]
+
+    return {'dict': records, 'slots': as_slots, 'index': as_index}
+
+
+def report_subscriptions(documents: int, subscriptions: int, lessons: int, used: int) -> None:
+    print(f"Абонементы: {documents} документов x {subscriptions} абонементов")
+    results = {name: measure(build) for name, build in
+               subscription_documents(documents, subscriptions, lessons, used).items()}
+    for name, memory in results.items():
+        print(f"  {name:<7} {memory / documents:10.0f} байт/документ, "
+              f"{memory / documents / subscriptions:6.0f} байт/абонемент "
+              f"({memory / results['dict']:.0%} от dict)")
+
+
+def _studio_storage(chats: int, subscriptions: int, lessons: int, used: int, seed: int) -> MemoryStorage:
+    """Хранилище студии с `chats` чатами, записанными менеджером"""
+    storage = MemoryStorage()
+    writer = SubscriptionManager(storage=storage, cache=DocumentCache(capacity=0))
+    rng = random.Random(seed)
+    created_at = START.isoformat()
+    for chat_id in range(1, chats + 1):
+        subs = []
+        for index in range(subscriptions):
+            attendance = Attendance()
+            for slot, day in _marks(rng, lessons, used).items():
+                attendance.mark(slot, day)
+            subs.append(Subscription(f"Ученица {index}", lessons, attendance, created_at))
+        writer.save_subscriptions(chat_id, 'group', subs)
+    return storage
+
+
+def report_tenants(tenants: int, documents: int, subscriptions: int, lessons: int, used: int) -> None:
+    """Память кэша по студиям: студия k держит documents * k чатов"""
+    print(f"Студии: {tenants}, в общем кэше чаты со всеми отметками")
+    cache = DocumentCache(capacity=0)
+    managers: List[SubscriptionManager] = []
+    for number in range(1, tenants + 1):
+        chats = documents * number
+        storage = _studio_storage(chats, subscriptions, lessons, used, number)
+
+        def load() -> List:
+            manager = SubscriptionManager(storage=storage, cache=cache)
+            for chat_id in range(1, chats + 1):
+                for sub in manager.get_subscriptions(chat_id, 'group'):
+                    sub.used_lessons
+            managers.append(manager)
+            return managers
+
+        memory = measure(load)
+        partition = managers[-1]._cache
+        print(f"  студия {number}: {len(partition):5d} документов, в памяти {memory / 1024:8.0f} КБ, "
+              f"оценка кэша {partition.size / 1024:8.0f} КБ (x{memory / partition.size:.1f})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Память данных чата в кэше процесса')
+    parser.add_argument('--documents', type=int, default=500)
+    parser.add_argument('--subscriptions', type=int, default=20, help='абонементов в документе')
+    parser.add_argument('--lessons', type=int, default=60, help='занятий в абонементе')
+    parser.add_argument('--used', type=int, default=40, help='отмеченных занятий')
+    parser.add_argument('--tenants', type=int, default=0, help='студий в общем кэше (0 - без замера); студия k держит documents/10 * k чатов')
+    args = parser.parse_args()
+    report_attendance(args.documents, args.subscriptions, args.lessons, args.used)
+    report_subscriptions(args.documents, args.subscriptions, args.lessons, args.used)
+    if args.tenants:
+        report_tenants(args.tenants, args.documents // 10 or 1, args.subscriptions, args.lessons, args.used)
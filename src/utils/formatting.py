@@ -1,32 +1,28 @@
 import random
-from typing import Dict, Any
 from config import RANDOM_EMOJIS
+from models.domain import Subscription
 
 def get_random_emoji() -> str:
     """Получение случайного эмодзи"""
     return random.choice(RANDOM_EMOJIS)
 
+# Таблица экранирования строится один раз: str.translate обходит строку в C
+_MARKDOWN_V2_ESCAPES = str.maketrans({char: f'\\{char}' for char in '_*[]()~`>#+-=|{}.!'})
+
 def escape_markdown_v2(text: str) -> str:
     """Экранирование специальных символов для Markdown V2"""
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    escaped_text = ''
-    for char in text:
-        if char in special_chars:
-            escaped_text += f'\\{char}'
-        else:
-            escaped_text += char
-    return escaped_text
+    return text.translate(_MARKDOWN_V2_ESCAPES)
 
-def format_subscription_info(sub: Dict[str, Any], show_lessons: bool = False) -> str:
+def format_subscription_info(sub: Subscription, show_lessons: bool = False) -> str:
     """Форматирование информации об абонементе"""
-    emoji = RANDOM_EMOJIS[hash(sub['name'] + sub['surname']) % len(RANDOM_EMOJIS)]
-    name = f"{sub['name']} {sub['surname']}"
+    # Фамилия есть только у абонементов старого формата
+    surname = (sub.extra or {}).get('surname', '')
+    name = f"{sub.name} {surname}".strip()
+    emoji = RANDOM_EMOJIS[hash(name) % len(RANDOM_EMOJIS)]
     text = f"{emoji} {name}"
     
     if show_lessons:
-        used = len(sub.get('used_lessons', {}))
-        total = sub['lessons']
-        text += f" ({used}/{total})"
+        text += f" ({sub.used_count}/{sub.total_lessons})"
     
     return text
 
@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from telegram.error import TimedOut
+from telegram.utils.request import Request
+
+from config import CONNECTION_SETTINGS, API_METHOD_TIMEOUTS
+from utils.metrics import metrics
+from utils.throttling import TokenBucket
+from utils.tracing import span
+
+
+class OutboundLimiter:
+    """Ограничение частоты исходящих вызовов Bot API
+
+    Один ограничитель на все боты процесса: студии делят общий запас, и
+    всплеск рассылки одной студии не упирается в лимиты Telegram за всех.
+    Вызов, которому не хватило токена, ждет его, а не отбрасывается.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(burst, time.monotonic())
+
+    def acquire(self) -> None:
+        """Ожидание разрешения на один вызов"""
+        started = None
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._bucket.take(self.rate, self.burst, now):
+                    break
+                wait = (1 - self._bucket.tokens) / self.rate
+            started = started or now
+            time.sleep(wait)
+        if started is not None:
+            metrics.observe('http.rate_wait', time.monotonic() - started)
+
+
+class PooledRequest(Request):
+    """Запросы к Bot API через пул соединений фиксированного размера
+
+    Число одновременных запросов ограничено размером пула, поэтому
+    соединения переиспользуются (keep-alive), а не открываются заново.
+    Время ожидания свободного соединения пишется в метрику http.pool_wait:
+    по ней видно, что вызовы API упираются в пул, а не в сеть.
+    """
+
+    def __init__(self, con_pool_size: int, pool_timeout: Optional[float] = None,
+                 method_timeouts: Optional[Dict[str, float]] = None,
+                 limiter: Optional[OutboundLimiter] = None, **kwargs):
+        super().__init__(con_pool_size=con_pool_size, **kwargs)
+        self._slots = threading.BoundedSemaphore(con_pool_size)
+        self._pool_timeout = pool_timeout
+        self._method_timeouts = method_timeouts or {}
+        self._limiter = limiter
+
+    def _request_wrapper(self, *args, **kwargs):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self._pool_timeout):
+            metrics.increment('http.pool_timeouts')
+            raise TimedOut()
+        metrics.observe('http.pool_wait', time.monotonic() - started)
+        try:
+            return super()._request_wrapper(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+    def post(self, url: str, data, timeout: float = None):
+        # Таймаут по методу API, если вызывающий не задал свой
+        method = url.rsplit('/', 1)[-1]
+        if timeout is None:
+            timeout = self._method_timeouts.get(method)
+        # Long polling не ограничивается: это входящие обновления
+        if self._limiter is not None and method != 'getUpdates':
+            self._limiter.acquire()
+        with span(f'telegram.{method}'):
+            return super().post(url, data, timeout=timeout)
+
+
+def build_request(workers: int, pollers: int = 1, limiter: Optional[OutboundLimiter] = None) -> PooledRequest:
+    """Request из CONNECTION_SETTINGS с пулом под число обработчиков
+
+    PTB требует не меньше workers + 4 соединений: по одному на каждый
+    поток диспетчера плюс getUpdates и служебные вызовы. Один Request
+    могут делить несколько ботов (`pollers`): каждый long poll держит свое
+    соединение. У urllib3 нет отдельного таймаута записи, поэтому для
+    чтения берется больший из read_timeout и write_timeout.
+    """
+    return PooledRequest(
+        con_pool_size=workers + pollers + 3,
+        pool_timeout=CONNECTION_SETTINGS['pool_timeout'],
+        method_timeouts=API_METHOD_TIMEOUTS,
+        limiter=limiter,
+        connect_timeout=CONNECTION_SETTINGS['connect_timeout'],
+        read_timeout=max(CONNECTION_SETTINGS['read_timeout'], CONNECTION_SETTINGS['write_timeout']),
+    )
@@ -0,0 +1,67 @@
+import threading
+from collections import Counter
+from typing import Any, Dict
+
+
+class _Timing:
+    """Накопленная статистика длительностей"""
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        average = self.total / self.count if self.count else 0.0
+        return {'count': self.count, 'avg_ms': average * 1000, 'max_ms': self.max * 1000}
+
+
+class Metrics:
+    """Потокобезопасные счетчики и длительности для мониторинга бота"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Counter = Counter()
+        self._timings: Dict[str, _Timing] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = _Timing()
+            timing.add(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'timings': {name: timing.as_dict() for name, timing in self._timings.items()},
+            }
+
+    def format(self) -> str:
+        """Текстовый отчет для администратора"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"{name}: {value}")
+        for name, timing in sorted(snapshot['timings'].items()):
+            lines.append(
+                f"{name}: n={timing['count']}, avg={timing['avg_ms']:.2f} мс, max={timing['max_ms']:.2f} мс"
+            )
+        return '\n'.join(lines) or 'Метрик пока нет'
+
+
+# Общий реестр метрик процесса
+metrics = Metrics()
@@ -0,0 +1,21 @@
+from typing import Tuple
+
+
+def paginate(total_items: int, page: int, page_size: int) -> Tuple[int, int, int, int]:
+    """Вычисление границ страницы: (start, end, page, pages)
+
+    Номер страницы приводится к допустимому диапазону, поэтому устаревшие
+    кнопки навигации никогда не приводят к пустому экрану.
+    """
+    pages = max(1, -(-total_items // page_size))
+    page = min(max(page, 0), pages - 1)
+    start = page * page_size
+    return start, min(start + page_size, total_items), page, pages
+
+
+def parse_page(value: str) -> int:
+    """Разбор номера страницы из callback_data"""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,195 @@
+import logging
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from telegram import Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Updater
+
+from utils.fileio import read_file, write_private_file
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OffsetStore:
+    """Последний обработанный update_id, сохраняемый между перезапусками"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._last: Optional[int] = None
+
+    def load(self) -> Optional[int]:
+        raw = read_file(self.path)
+        if raw is None:
+            return None
+        try:
+            self._last = int(raw.decode('ascii').strip())
+        except ValueError:
+            logger.error(f"Некорректный файл смещения {self.path}, начинаем с очереди Telegram")
+            return None
+        return self._last
+
+    @property
+    def last(self) -> Optional[int]:
+        return self._last
+
+    def mark_processed(self, update_id: int) -> None:
+        """Фиксация обработанного обновления
+
+        Пишется без fsync: после падения процесса повтора не будет, а после
+        сбоя питания могут повториться лишь последние нажатия.
+        """
+        with self._lock:
+            if self._last is not None and update_id <= self._last:
+                return
+            self._last = update_id
+            temp_file = f"{self.path}.tmp"
+            write_private_file(temp_file, str(update_id).encode('ascii'))
+            os.replace(temp_file, self.path)
+
+
+def _callback_key(update: Update) -> Optional[Tuple]:
+    """Кнопка, нажатие которой пришло в обновлении: чат, сообщение и данные кнопки"""
+    query = update.callback_query
+    if query is None:
+        return None
+    if query.message is not None:
+        return query.message.chat_id, query.message.message_id, query.data
+    if query.inline_message_id is not None:
+        return None, query.inline_message_id, query.data
+    return None
+
+
+def collapse_stale_callbacks(updates: List[Update]) -> Tuple[List[Update], List[Update]]:
+    """Схлопывание повторных нажатий одной и той же кнопки
+
+    Используется после перезапуска: из нескольких накопившихся нажатий
+    одной кнопки (тот же чат, то же сообщение и те же данные) остается
+    последнее. Нажатия разных кнопок, даже в одном чате, сохраняются все -
+    это разные действия. Возвращает оставленные и отброшенные обновления;
+    на отброшенные запросы нужно ответить, иначе у пользователя кнопка
+    останется в состоянии загрузки.
+    """
+    latest = {}
+    for position, update in enumerate(updates):
+        key = _callback_key(update)
+        if key is not None:
+            latest[key] = position
+
+    kept, dropped = [], []
+    for position, update in enumerate(updates):
+        key = _callback_key(update)
+        if key is not None and latest[key] != position:
+            metrics.increment('polling.drained_callbacks')
+            dropped.append(update)
+            continue
+        kept.append(update)
+    return kept, dropped
+
+
+class TunedUpdater(Updater):
+    """Updater с настраиваемым long polling
+
+    - размер пачки getUpdates ограничен `limit`;
+    - пауза между запросами адаптивная: сразу после полной пачки,
+      `poll_interval` после неполной и с экспоненциальным ростом до
+      `max_poll_interval` после ошибок сети;
+    - обработанные update_id сохраняются в OffsetStore, поэтому после
+      перезапуска уже обработанные нажатия не повторяются;
+    - в режиме разгрузки после старта устаревшие нажатия кнопок одного
+      одной кнопки схлопываются, пока не будет выбрана вся очередь, а на
+      отброшенные нажатия бот отвечает пустым answerCallbackQuery.
+    """
+
+    def __init__(self, *args, offset_store: Optional[OffsetStore] = None, limit: int = 100,
+                 max_poll_interval: float = 5.0, drain_on_start: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.offset_store = offset_store
+        self.limit = limit
+        self.max_poll_interval = max_poll_interval
+        self.drain_on_start = drain_on_start
+
+    def _start_polling(self, poll_interval, timeout, read_latency, bootstrap_retries,
+                       drop_pending_updates, allowed_updates, ready=None):
+        self.logger.debug('Updater thread started (tuned polling)')
+
+        self._bootstrap(
+            bootstrap_retries,
+            drop_pending_updates=drop_pending_updates,
+            webhook_url='',
+            allowed_updates=None,
+        )
+
+        last_processed = self.offset_store.load() if self.offset_store else None
+        if last_processed is not None and (self.last_update_id or 0) <= last_processed:
+            self.last_update_id = last_processed + 1
+            logger.info(f"Продолжаем с update_id={self.last_update_id}")
+
+        if ready is not None:
+            ready.set()
+
+        interval = poll_interval
+        draining = self.drain_on_start
+        while self.running:
+            try:
+                updates = self.bot.get_updates(
+                    self.last_update_id,
+                    limit=self.limit,
+                    timeout=timeout,
+                    read_latency=read_latency,
+                    allowed_updates=allowed_updates,
+                )
+            except RetryAfter as e:
+                time.sleep(e.retry_after)
+                continue
+            except TelegramError as e:
+                self.logger.error(f'Error while getting Updates: {e}')
+                metrics.increment('polling.errors')
+                interval = min(max(interval * 2, 1.0), self.max_poll_interval)
+                time.sleep(interval)
+                continue
+
+            full_batch = len(updates) >= self.limit
+            if updates:
+                if not self.running:
+                    self.logger.debug('Updates ignored and will be pulled again on restart')
+                    break
+
+                self.last_update_id = updates[-1].update_id + 1
+                metrics.increment('polling.updates', len(updates))
+                if draining:
+                    updates, dropped = collapse_stale_callbacks(updates)
+                    self._answer_dropped(dropped, last_processed)
+                for update in updates:
+                    if last_processed is not None and update.update_id <= last_processed:
+                        continue
+                    self.update_queue.put(update)
+
+            # Очередь выбрана - дальше работаем в обычном режиме
+            draining = draining and full_batch
+            interval = 0 if full_batch else poll_interval
+            if interval:
+                time.sleep(interval)
+
+    def _answer_dropped(self, dropped: List[Update], last_processed: Optional[int]) -> None:
+        """Ответ на отброшенные нажатия, которые еще не были обработаны"""
+        for update in dropped:
+            if last_processed is not None and update.update_id <= last_processed:
+                continue
+            try:
+                self.bot.answer_callback_query(update.callback_query.id)
+            except TelegramError as e:
+                # Запрос мог устареть, пока бот был остановлен
+                logger.debug(f"Не удалось ответить на отброшенное нажатие: {e}")
+
+    def record_processed(self, update: Update, context) -> None:
+        """Обработчик последней группы: сохранение обработанного update_id"""
+        if self.offset_store is not None and isinstance(update, Update):
+            try:
+                self.offset_store.mark_processed(update.update_id)
+            except OSError as e:
+                logger.error(f"Не удалось сохранить смещение: {e}")
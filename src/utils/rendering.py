@@ -0,0 +1,99 @@
+"""
+Замер времени отрисовки экранов handlers.views
+
+Для каждого экрана замеряются сборка клавиатуры без кэша (первое открытие
+экрана), повторное открытие из кэша и кодирование клавиатуры в JSON для
+Bot API - эту часть python-telegram-bot выполняет при каждой отправке.
+Статические экраны собираются при импорте, для них замеряется только
+кодирование.
+
+Запуск из каталога src (нужен python-telegram-bot):
+    python -m utils.rendering [--rounds 2000] [--subscriptions 8]
+"""
+
+import argparse
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, Optional
+
+from config import LESSONS_PAGE_SIZE
+from handlers import views
+from models.attendance import Attendance
+from utils.formatting import escape_markdown_v2
+
+CATEGORY = 'pole_dance'
+
+
+def _per_call(func: Callable[[], object], rounds: int) -> float:
+    """Среднее время одного вызова в микросекундах"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def _lesson_labels(used: int) -> tuple:
+    """Подписи первой страницы сетки занятий: даты отмеченных, номера остальных"""
+    attendance = Attendance()
+    for lesson in range(1, used + 1):
+        attendance.mark(lesson, date(2024, 9, 1) + timedelta(days=3 * lesson))
+    return tuple(attendance.get(str(i), str(i)) for i in range(1, LESSONS_PAGE_SIZE + 1))
+
+
+def screens(subscriptions: int) -> Dict[str, Dict[str, Optional[Callable[[], object]]]]:
+    """Экраны: (сборка без кэша, открытие из кэша)"""
+    categories = tuple((f"Категория {index}", f"category{index}") for index in range(6))
+    labels = _lesson_labels(LESSONS_PAGE_SIZE // 2)
+    entries = tuple(
+        (f"{index:06x}", f"Ученица {index} ({index % 8}/8)", index % 3 == 0, index % 5 != 0)
+        for index in range(subscriptions)
+    )
+    return {
+        'settings': {'markup': lambda: views.SETTINGS_MARKUP},
+        'main_menu': {
+            'build': lambda: views.main_menu.__wrapped__(categories),
+            'cached': lambda: views.main_menu(categories),
+        },
+        'category_menu': {
+            'build': lambda: views.category_menu.__wrapped__(CATEGORY, 'Pole Dance'),
+            'cached': lambda: views.category_menu(CATEGORY, 'Pole Dance'),
+        },
+        'lesson_page': {
+            'build': lambda: views.lesson_page.__wrapped__(CATEGORY, 'a1b2c3', 0, labels, 0, 3),
+            'cached': lambda: views.lesson_page(CATEGORY, 'a1b2c3', 0, labels, 0, 3),
+        },
+        # Выбор меняется с каждым нажатием, поэтому экран всегда собирается заново
+        'mark_class': {
+            'build': lambda: views.mark_class(CATEGORY, entries, 3, 0, 2),
+        },
+    }
+
+
+def _markup_of(screen: object):
+    """Клавиатура из результата экрана (category_menu возвращает и текст)"""
+    return screen[1] if isinstance(screen, tuple) else screen
+
+
+def run(rounds: int, subscriptions: int) -> None:
+    print(f"{'экран':<14} {'сборка':>10} {'из кэша':>10} {'в JSON':>10}   (мкс на вызов)")
+    for name, variants in screens(subscriptions).items():
+        build, cached = variants.get('build'), variants.get('cached')
+        markup = _markup_of((build or cached or variants['markup'])())
+        columns = [
+            _per_call(build, rounds) if build else None,
+            _per_call(cached, rounds) if cached else None,
+            _per_call(markup.to_json, rounds),
+        ]
+        print(f"{name:<14} " + ' '.join(f"{value:10.1f}" if value is not None else f"{'-':>10}"
+                                        for value in columns))
+
+    text = "Ученица (Пример) - 12.09, 15.09! " * 4
+    print(f"{'escape_md_v2':<14} {_per_call(lambda: escape_markdown_v2(text), rounds):10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Время отрисовки экранов бота')
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--subscriptions', type=int, default=8, help='абонементов на странице отметки группы')
+    args = parser.parse_args()
+    run(args.rounds, args.subscriptions)
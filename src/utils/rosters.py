@@ -0,0 +1,157 @@
+"""
+Общие списки студии
+
+Несколько тренеров (чатов) работают с одним списком абонементов и
+категорий. Документ списка - это обычный документ чата владельца; чат
+участника при каждом обращении к данным отображается на него через
+`document_id`. Одновременные записи в общий документ разрешаются
+версиями и повтором изменений (utils.versioning).
+
+Реестр - один небольшой файл: участники {chat_id: владелец} и
+приглашения {код: владелец}. Файл проверяется не чаще раза в
+ROSTERS_REFRESH_INTERVAL секунд и перечитывается, только если изменился
+(по mtime и размеру), поэтому отображение обычно не стоит ни одного
+системного вызова.
+"""
+
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import ROSTERS_FILE, ROSTERS_REFRESH_INTERVAL
+from utils.durability import group_committer
+from utils.fileio import read_file, write_private_file
+from utils.metrics import metrics
+from utils.tenants import TenantLocal
+from utils.versioning import VERSION_KEY, document_lock, version_of
+
+logger = logging.getLogger(__name__)
+
+
+class RosterError(ValueError):
+    """Недопустимая операция с общим списком"""
+
+
+class RosterRegistry:
+    """Участники и приглашения общих списков"""
+
+    def __init__(self, path: str = ROSTERS_FILE, refresh_interval: float = ROSTERS_REFRESH_INTERVAL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._checked: Optional[float] = None
+        self._members: Dict[int, int] = {}
+        self._invites: Dict[str, int] = {}
+
+    def _refresh(self, force: bool = False) -> None:
+        """Перечитывание реестра, если файл изменился (в том числе другим процессом)"""
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.refresh_interval:
+            return
+        self._checked = now
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp:
+            return
+        raw = read_file(self.path)
+        try:
+            state = json.loads(raw) if raw is not None else {}
+        except ValueError as e:
+            logger.error(f"Не удалось прочитать реестр общих списков: {e}")
+            return
+        members, invites = self._parse(state)
+        with self._lock:
+            self._members, self._invites, self._stamp = members, invites, stamp
+
+    @staticmethod
+    def _parse(state: dict) -> Tuple[Dict[int, int], Dict[str, int]]:
+        members = {int(chat_id): int(owner) for chat_id, owner in state.get('members', {}).items()}
+        invites = {code: int(owner) for code, owner in state.get('invites', {}).items()}
+        return members, invites
+
+    def _update(self, change) -> None:
+        """Изменение реестра: чтение с диска и запись под блокировкой документа"""
+        # Барьер снимка - до блокировки документа, как у всех записей (utils.storage)
+        with group_committer.barrier.write(), document_lock(self.path):
+            raw = read_file(self.path)
+            state = json.loads(raw) if raw is not None else {}
+            members, invites = self._parse(state)
+            change(members, invites)
+            content = {
+                VERSION_KEY: version_of(state) + 1,
+                'members': {str(chat_id): owner for chat_id, owner in members.items()},
+                'invites': invites,
+            }
+            temp_file = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            write_private_file(temp_file, json.dumps(content, separators=(',', ':')).encode())
+            group_committer.commit(temp_file, self.path)
+        self._stamp = None
+        self._refresh(force=True)
+
+    def document_id(self, chat_id: int) -> int:
+        """Чат, в документе которого хранятся данные чата `chat_id`"""
+        self._refresh()
+        return self._members.get(chat_id, chat_id)
+
+    def members(self, owner: int) -> List[int]:
+        """Участники списка владельца (без самого владельца)"""
+        self._refresh()
+        return sorted(chat_id for chat_id, roster in self._members.items() if roster == owner)
+
+    def invite(self, chat_id: int, reset: bool = False) -> str:
+        """Код приглашения в список, с которым работает чат"""
+        owner = self.document_id(chat_id)
+        if not reset:
+            for code, roster in self._invites.items():
+                if roster == owner:
+                    return code
+        code = secrets.token_urlsafe(6)
+
+        def change(members, invites):
+            for old in [old for old, roster in invites.items() if roster == owner]:
+                del invites[old]
+            invites[code] = owner
+
+        self._update(change)
+        return code
+
+    def join(self, chat_id: int, code: str) -> int:
+        """Подключение чата к списку по коду; возвращает владельца списка"""
+        self._refresh()
+        owner = self._invites.get(code)
+        if owner is None:
+            raise RosterError("Приглашение не найдено")
+        if owner == chat_id:
+            raise RosterError("Это ваш собственный список")
+        if self.members(chat_id):
+            raise RosterError("К вашему списку уже подключены другие тренеры")
+
+        def change(members, invites):
+            if invites.get(code) != owner:
+                raise RosterError("Приглашение больше не действует")
+            members[chat_id] = owner
+
+        self._update(change)
+        metrics.increment('rosters.joined')
+        logger.info(f"Чат {chat_id} подключен к общему списку {owner}")
+        return owner
+
+    def leave(self, chat_id: int) -> bool:
+        """Отключение чата от общего списка; собственные данные чата снова видны"""
+        if self.document_id(chat_id) == chat_id:
+            return False
+        self._update(lambda members, invites: members.pop(chat_id, None))
+        logger.info(f"Чат {chat_id} отключен от общего списка")
+        return True
+
+
+# Реестр процесса; в режиме нескольких студий - реестр студии обновления
+rosters = TenantLocal('rosters', RosterRegistry())
@@ -0,0 +1,105 @@
+"""
+Замер масштабирования многопроцессного режима по числу процессов
+
+Основной процесс раскладывает поток нажатий «отметить занятие» по N
+процессам так же, как workers.WorkerPool (utils.sharding.worker_for), а
+каждый процесс обрабатывает свою очередь по порядку своим менеджером
+абонементов: загрузка документа, отметка, кодирование и запись. Сетевые
+вызовы и сборка клавиатур Bot API в замер не входят - они требуют
+python-telegram-bot и сети.
+
+Запуск из каталога src:
+    python -m utils.scaling [--processes 1 2 4] [--updates 4000] [--chats 64] [--durability none]
+"""
+
+import argparse
+import multiprocessing
+import random
+import shutil
+import tempfile
+import time
+
+from config import GROUP_COMMIT_WINDOW, STORAGE_DURABILITY
+from utils.durability import DURABILITY_MODES, GroupCommitter
+from utils.sharding import worker_for
+from utils.storage import FileStorage
+from utils.subscription_manager import SubscriptionManager
+
+SUBSCRIPTIONS_PER_CHAT = 20
+LESSONS = 60
+
+
+def _worker(data_dir: str, durability: str, updates: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    manager = SubscriptionManager(storage=FileStorage(data_dir, GroupCommitter(durability, GROUP_COMMIT_WINDOW)))
+    results.put('ready')
+    processed = 0
+    while True:
+        item = updates.get()
+        if item is None:
+            break
+        chat_id, position, lesson = item
+        subscriptions = manager.get_subscriptions(chat_id, 'group')
+        manager.mark_lesson(chat_id, subscriptions[position].id, lesson)
+        processed += 1
+    results.put(processed)
+
+
+def _prepare(data_dir: str, chats: int) -> None:
+    """Чаты с абонементами и частью отметок, как в живой студии"""
+    manager = SubscriptionManager(storage=FileStorage(data_dir, GroupCommitter('none')))
+    rng = random.Random(0)
+    for chat_id in range(1, chats + 1):
+        for k in range(SUBSCRIPTIONS_PER_CHAT):
+            manager.add_subscription(chat_id, 'group', f"Ученица {k}", LESSONS)
+        for sub in manager.get_subscriptions(chat_id, 'group'):
+            for lesson in rng.sample(range(1, LESSONS + 1), LESSONS // 3):
+                manager.mark_lesson(chat_id, sub.id, lesson)
+
+
+def run(processes: int, updates: int, chats: int, data_dir: str, durability: str) -> float:
+    """Один прогон; возвращает обработанных обновлений в секунду"""
+    queues = [multiprocessing.Queue() for _ in range(processes)]
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_worker, args=(data_dir, durability, queue, results))
+        for queue in queues
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        results.get()
+
+    rng = random.Random(processes)
+    started = time.perf_counter()
+    for _ in range(updates):
+        chat_id = rng.randrange(1, chats + 1)
+        queues[worker_for(chat_id, processes)].put(
+            (chat_id, rng.randrange(SUBSCRIPTIONS_PER_CHAT), rng.randrange(1, LESSONS + 1))
+        )
+    for queue in queues:
+        queue.put(None)
+    processed = sum(results.get() for _ in workers)
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.join()
+    return processed / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Масштабирование обработки по числу процессов')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--updates', type=int, default=4000)
+    parser.add_argument('--chats', type=int, default=64)
+    parser.add_argument('--durability', choices=DURABILITY_MODES, default=STORAGE_DURABILITY)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='scaling-')
+    try:
+        _prepare(data_dir, args.chats)
+        baseline = None
+        for count in args.processes:
+            rate = run(count, args.updates, args.chats, data_dir, args.durability)
+            baseline = baseline or rate
+            print(f"процессов: {count:<3} {rate:8.0f} обновлений/с  (x{rate / baseline:.2f})")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
@@ -0,0 +1,119 @@
+import heapq
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Подстроки слов короче триграммы индексируются целиком: запросы такой
+# длины ищутся по ним, более длинные - по триграммам
+SHORT_GRAM_LENGTH = 2
+
+
+def normalize(text: str) -> str:
+    """Приведение текста к виду для поиска: регистр и ё"""
+    return text.casefold().replace('ё', 'е')
+
+
+def _trigrams(word: str) -> Set[str]:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def _short_grams(word: str) -> Set[str]:
+    return {word[i:i + length] for length in range(1, SHORT_GRAM_LENGTH + 1) for i in range(len(word) - length + 1)}
+
+
+class SubscriptionSearchIndex:
+    """Инкрементальный поисковый индекс абонементов одного чата
+
+    Слово запроса ищется как подстрока слов названия при любой длине:
+    одно-двухсимвольные - по таблице коротких подстрок, длинные -
+    пересечением списков триграмм с проверкой подстроки. Индекс обновляется
+    по одному абонементу, без перестроения.
+    """
+
+    __slots__ = ('_names', '_keys', '_short', '_trigrams')
+
+    def __init__(self):
+        # id абонемента -> нормализованное название
+        self._names: Dict[str, str] = {}
+        # id абонемента -> ключи, под которыми он записан (для удаления)
+        self._keys: Dict[str, Tuple[Set[str], Set[str]]] = {}
+        self._short: Dict[str, Set[str]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[str, str]]) -> 'SubscriptionSearchIndex':
+        """Построение индекса из пар (id, название)"""
+        index = cls()
+        for sub_id, name in items:
+            index.update(sub_id, name)
+        return index
+
+    def update(self, sub_id: str, name: str) -> None:
+        """Добавление абонемента или смена его названия"""
+        normalized = normalize(name or '')
+        if self._names.get(sub_id) == normalized:
+            return
+        self.remove(sub_id)
+
+        words = normalized.split()
+        short = set().union(*(_short_grams(word) for word in words)) if words else set()
+        trigrams = set().union(*(_trigrams(word) for word in words)) if words else set()
+        for key in short:
+            self._short.setdefault(key, set()).add(sub_id)
+        for key in trigrams:
+            self._trigrams.setdefault(key, set()).add(sub_id)
+        self._names[sub_id] = normalized
+        self._keys[sub_id] = (short, trigrams)
+
+    def remove(self, sub_id: str) -> None:
+        """Удаление абонемента из индекса"""
+        keys = self._keys.pop(sub_id, None)
+        if keys is None:
+            return
+        del self._names[sub_id]
+        short, trigrams = keys
+        for postings, removed in ((self._short, short), (self._trigrams, trigrams)):
+            for key in removed:
+                ids = postings[key]
+                ids.discard(sub_id)
+                if not ids:
+                    del postings[key]
+
+    def retain(self, sub_ids: Iterable[str]) -> None:
+        """Удаление всех абонементов, кроме перечисленных"""
+        keep = set(sub_ids)
+        for sub_id in [sub_id for sub_id in self._names if sub_id not in keep]:
+            self.remove(sub_id)
+
+    def _candidates(self, word: str) -> Set[str]:
+        """Абонементы, в названии которых может быть слово запроса"""
+        if len(word) <= SHORT_GRAM_LENGTH:
+            return self._short.get(word, set())
+        postings = []
+        for trigram in _trigrams(word):
+            ids = self._trigrams.get(trigram)
+            if not ids:
+                return set()
+            postings.append(ids)
+        # Пересечение начинаем с самого короткого списка
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates &= ids
+            if not candidates:
+                break
+        return {sub_id for sub_id in candidates if word in self._names[sub_id]}
+
+    def search(self, query: str, limit: int = 50) -> List[str]:
+        """id абонементов, название которых содержит все слова запроса"""
+        words = normalize(query).split()
+        if not words:
+            return []
+        result = None
+        for word in sorted(words, key=len, reverse=True):
+            candidates = self._candidates(word)
+            result = set(candidates) if result is None else result & candidates
+            if not result:
+                return []
+        return heapq.nsmallest(limit, result, key=self._names.__getitem__)
+
+    def __len__(self) -> int:
+        return len(self._names)
@@ -0,0 +1,258 @@
+import argparse
+import gzip
+import json
+import lzma
+import struct
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Сигнатуры форматов в начале файла
+BINARY_MAGIC = b'DSB\x01'
+GZIP_MAGIC = b'\x1f\x8b'
+LZMA_MAGIC = b'\xfd7zXZ\x00'
+
+Default = Optional[Callable[[Any], Any]]
+
+
+class Serializer:
+    """Базовый сериализатор документов хранилища"""
+
+    name = 'base'
+
+    def dumps(self, obj: Any, default: Default = None) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonSerializer(Serializer):
+    """JSON: с отступами (старый формат) или компактный"""
+
+    def __init__(self, indent: Optional[int] = None):
+        self.indent = indent
+        self.name = 'json' if indent else 'json-compact'
+        self._separators = None if indent else (',', ':')
+
+    def dumps(self, obj: Any, default: Default = None) -> bytes:
+        return json.dumps(
+            obj, ensure_ascii=False, indent=self.indent,
+            separators=self._separators, default=default
+        ).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data.decode('utf-8'))
+
+
+class BinarySerializer(Serializer):
+    """Компактный бинарный формат без marshal/pickle
+
+    Значения кодируются тегом из одного байта, целые числа и длины -
+    varint (целые - в zigzag-кодировке), строки - UTF-8.
+    """
+
+    name = 'binary'
+
+    def dumps(self, obj: Any, default: Default = None) -> bytes:
+        out = bytearray(BINARY_MAGIC)
+        self._encode(obj, out, default)
+        return bytes(out)
+
+    def loads(self, data: bytes) -> Any:
+        if not data.startswith(BINARY_MAGIC):
+            raise ValueError("Данные не в бинарном формате")
+        value, _ = self._decode(memoryview(data), len(BINARY_MAGIC))
+        return value
+
+    @staticmethod
+    def _write_varint(value: int, out: bytearray) -> None:
+        while value > 0x7f:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    @staticmethod
+    def _read_varint(data: memoryview, pos: int):
+        result = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return result, pos
+            shift += 7
+
+    def _encode(self, obj: Any, out: bytearray, default: Default) -> None:
+        if obj is None:
+            out += b'N'
+        elif obj is True:
+            out += b'T'
+        elif obj is False:
+            out += b'F'
+        elif isinstance(obj, int):
+            out += b'I'
+            self._write_varint(obj << 1 if obj >= 0 else (-obj << 1) - 1, out)
+        elif isinstance(obj, float):
+            out += b'D'
+            out += struct.pack('<d', obj)
+        elif isinstance(obj, str):
+            raw = obj.encode('utf-8')
+            out += b'S'
+            self._write_varint(len(raw), out)
+            out += raw
+        elif isinstance(obj, (list, tuple)):
+            out += b'L'
+            self._write_varint(len(obj), out)
+            for item in obj:
+                self._encode(item, out, default)
+        elif isinstance(obj, dict):
+            out += b'M'
+            self._write_varint(len(obj), out)
+            for key, value in obj.items():
+                self._encode(str(key), out, default)
+                self._encode(value, out, default)
+        elif default is not None:
+            # Результат default может сам содержать нестандартные значения
+            self._encode(default(obj), out, default)
+        else:
+            raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+    def _decode(self, data: memoryview, pos: int):
+        tag = data[pos]
+        pos += 1
+        if tag == 0x4e:  # N
+            return None, pos
+        if tag == 0x54:  # T
+            return True, pos
+        if tag == 0x46:  # F
+            return False, pos
+        if tag == 0x49:  # I
+            value, pos = self._read_varint(data, pos)
+            return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+        if tag == 0x44:  # D
+            return struct.unpack_from('<d', data, pos)[0], pos + 8
+        if tag == 0x53:  # S
+            length, pos = self._read_varint(data, pos)
+            return str(data[pos:pos + length], 'utf-8'), pos + length
+        if tag == 0x4c:  # L
+            count, pos = self._read_varint(data, pos)
+            items = []
+            for _ in range(count):
+                item, pos = self._decode(data, pos)
+                items.append(item)
+            return items, pos
+        if tag == 0x4d:  # M
+            count, pos = self._read_varint(data, pos)
+            result = {}
+            for _ in range(count):
+                key, pos = self._decode(data, pos)
+                result[key], pos = self._decode(data, pos)
+            return result, pos
+        raise ValueError(f"Неизвестный тег бинарного формата: {tag}")
+
+
+class CompressedSerializer(Serializer):
+    """Сжатие поверх другого сериализатора (gzip или lzma)"""
+
+    def __init__(self, inner: Serializer, method: str = 'gzip'):
+        if method not in ('gzip', 'lzma'):
+            raise ValueError(f"Неизвестный метод сжатия: {method}")
+        self.inner = inner
+        self.method = method
+        self.name = f'{inner.name}-{method}'
+
+    def dumps(self, obj: Any, default: Default = None) -> bytes:
+        raw = self.inner.dumps(obj, default)
+        if self.method == 'gzip':
+            # mtime=0 делает вывод детерминированным
+            return gzip.compress(raw, compresslevel=6, mtime=0)
+        return lzma.compress(raw, preset=1)
+
+    def loads(self, data: bytes) -> Any:
+        return loads(data)
+
+
+SERIALIZERS: Dict[str, Serializer] = {
+    'json': JsonSerializer(indent=2),
+    'json-compact': JsonSerializer(),
+    'binary': BinarySerializer(),
+    'json-gzip': CompressedSerializer(JsonSerializer(), 'gzip'),
+    'json-lzma': CompressedSerializer(JsonSerializer(), 'lzma'),
+    'binary-gzip': CompressedSerializer(BinarySerializer(), 'gzip'),
+    'binary-lzma': CompressedSerializer(BinarySerializer(), 'lzma'),
+}
+
+
+def get_serializer(name: str) -> Serializer:
+    """Получение сериализатора по имени формата"""
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный формат хранения: {name}")
+
+
+def loads(data: bytes) -> Any:
+    """Чтение документа с определением формата по заголовку
+
+    Поэтому каталог может одновременно содержать файлы разных форматов.
+    """
+    if data.startswith(GZIP_MAGIC):
+        return loads(gzip.decompress(data))
+    if data.startswith(LZMA_MAGIC):
+        return loads(lzma.decompress(data))
+    if data.startswith(BINARY_MAGIC):
+        return SERIALIZERS['binary'].loads(data)
+    return SERIALIZERS['json-compact'].loads(data)
+
+
+def _sample_documents(documents: int, subscriptions: int, lessons: int) -> List[Any]:
+    """Документы чатов (индекс и отметки), записанные настоящим менеджером"""
+    import random
+
+    from utils.storage import MemoryStorage
+    from utils.subscription_manager import SubscriptionManager
+
+    storage = MemoryStorage()
+    manager = SubscriptionManager(storage=storage)
+    rng = random.Random(0)
+    for chat_id in range(1, documents + 1):
+        for index in range(subscriptions):
+            manager.add_subscription(chat_id, 'group', f"Ученица {index}", lessons)
+        for sub in manager.get_subscriptions(chat_id, 'group'):
+            for lesson in rng.sample(range(1, lessons + 1), rng.randrange(lessons)):
+                manager.mark_lesson(chat_id, sub.id, lesson)
+    return [loads(raw) for raw in storage._documents.values()]
+
+
+def _benchmark(names: List[str], documents: int, subscriptions: int, lessons: int, rounds: int) -> None:
+    """Скорость кодирования и чтения и размер документов в каждом формате"""
+    samples = _sample_documents(documents, subscriptions, lessons)
+    print(f"документов: {len(samples)} ({documents} чатов x индекс и отметки), "
+          f"{subscriptions} абонементов по {lessons} занятий")
+    for name in names:
+        serializer = get_serializer(name)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            encoded = [serializer.dumps(document) for document in samples]
+        dumps_time = (time.perf_counter() - started) / rounds / len(samples)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            decoded = [loads(raw) for raw in encoded]
+        loads_time = (time.perf_counter() - started) / rounds / len(samples)
+        if decoded != samples:
+            raise AssertionError(f"{name}: прочитанные документы не совпадают с записанными")
+        size = sum(len(raw) for raw in encoded) / len(samples)
+        print(f"  {name:<12} {size:8.0f} байт/документ  запись {dumps_time * 1e6:7.1f} мкс  "
+              f"чтение {loads_time * 1e6:7.1f} мкс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Размер и скорость форматов хранения')
+    parser.add_argument('--format', choices=['all', *SERIALIZERS], default='all')
+    parser.add_argument('--documents', type=int, default=50, help='чатов')
+    parser.add_argument('--subscriptions', type=int, default=20, help='абонементов в чате')
+    parser.add_argument('--lessons', type=int, default=60, help='занятий в абонементе')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    _benchmark(list(SERIALIZERS) if args.format == 'all' else [args.format],
+               args.documents, args.subscriptions, args.lessons, args.rounds)
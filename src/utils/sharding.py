@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import os
+import re
+from typing import Iterator, Optional
+
+from config import DATA_SHARD_LEVELS
+from utils.durability import group_committer
+
+logger = logging.getLogger(__name__)
+
+_CHAT_FILE_RE = re.compile(r'^-?\d+$')
+
+
+def shard_index(chat_id: int) -> int:
+    """Номер шарда верхнего уровня (первый байт хэша, 0..255)"""
+    return hashlib.md5(str(chat_id).encode('ascii')).digest()[0]
+
+
+def worker_for(chat_id: Optional[int], processes: int) -> int:
+    """Номер процесса-обработчика, владеющего чатом (многопроцессный режим)
+
+    Процесс выбирается по верхнему уровню шарда каталога данных, поэтому
+    каждый процесс владеет своими каталогами data/ab целиком, а все
+    обновления одного чата попадают в один процесс по порядку.
+    """
+    if chat_id is None:
+        return 0
+    return shard_index(chat_id) % processes
+
+
+def shard_dir(base_dir: str, chat_id: int, levels: int = DATA_SHARD_LEVELS) -> str:
+    """Каталог шарда чата: два символа хэша на каждый уровень (data/ab/cd)"""
+    digest = hashlib.md5(str(chat_id).encode('ascii')).hexdigest()
+    parts = [digest[2 * i:2 * i + 2] for i in range(levels)]
+    return os.path.join(base_dir, *parts)
+
+
+def sharded_path(base_dir: str, chat_id: int, suffix: str = '.json') -> str:
+    """Путь к файлу чата в шардированной раскладке"""
+    return os.path.join(shard_dir(base_dir, chat_id), f'{chat_id}{suffix}')
+
+
+def legacy_path(base_dir: str, chat_id: int, suffix: str = '.json') -> str:
+    """Путь к файлу чата в старой плоской раскладке"""
+    return os.path.join(base_dir, f'{chat_id}{suffix}')
+
+
+def migrate_file(base_dir: str, chat_id: int, suffix: str = '.json') -> bool:
+    """Перенос файла чата из плоской раскладки в шард
+
+    os.replace атомарен, поэтому читатель в любой момент находит файл
+    либо по старому, либо по новому пути. Если файл уже перенес другой
+    поток, просто ничего не делаем.
+    """
+    source = legacy_path(base_dir, chat_id, suffix)
+    if not os.path.exists(source):
+        return False
+    target = sharded_path(base_dir, chat_id, suffix)
+    os.makedirs(os.path.dirname(target), mode=0o700, exist_ok=True)
+    try:
+        # Перенос - тоже запись: снимок данных должен увидеть файл по новому пути
+        with group_committer.barrier.write():
+            if os.path.exists(target):
+                # Шардированная копия новее - старый файл больше не нужен
+                os.remove(source)
+                return False
+            os.replace(source, target)
+            group_committer.record_change(target)
+        # Старые файлы могли быть созданы с более широкими правами
+        os.chmod(target, 0o600)
+    except FileNotFoundError:
+        return False
+    logger.info(f"Файл чата перенесен в шард: {source} -> {target}")
+    return True
+
+
+def resolve_path(base_dir: str, chat_id: int, suffix: str = '.json') -> str:
+    """Путь для чтения: непереведенный файл переносится при первом обращении"""
+    migrate_file(base_dir, chat_id, suffix)
+    return sharded_path(base_dir, chat_id, suffix)
+
+
+def iter_chat_ids(base_dir: str, suffix: str = '.json') -> Iterator[int]:
+    """Все chat_id каталога данных: и в шардах, и в плоской раскладке"""
+    for root, dirs, files in os.walk(base_dir):
+        depth = os.path.relpath(root, base_dir).count(os.sep) + 1 if root != base_dir else 0
+        # Не заходим во вложенные каталоги данных (например, data/users)
+        dirs[:] = [name for name in dirs if len(name) == 2 and depth < DATA_SHARD_LEVELS]
+        for file_name in files:
+            if file_name.endswith(suffix) and _CHAT_FILE_RE.match(file_name[:-len(suffix)]):
+                yield int(file_name[:-len(suffix)])
+
+
+def migrate_directory(base_dir: str, suffix: str = '.json') -> int:
+    """Онлайн-миграция всего каталога в шардированную раскладку"""
+    moved = 0
+    for file_name in os.listdir(base_dir):
+        chat_part = file_name[:-len(suffix)] if file_name.endswith(suffix) else ''
+        if not _CHAT_FILE_RE.match(chat_part):
+            continue
+        try:
+            if migrate_file(base_dir, int(chat_part), suffix):
+                moved += 1
+        except OSError as e:
+            logger.error(f"Ошибка при переносе {file_name} в шард: {e}")
+    logger.info(f"Миграция каталога {base_dir} в шарды завершена: перенесено файлов={moved}")
+    return moved
+
+
+if __name__ == '__main__':
+    from config import DATA_DIR, USERS_DATA_DIR
+
+    logging.basicConfig(level=logging.INFO)
+    migrate_directory(DATA_DIR)
+    migrate_directory(USERS_DATA_DIR)
@@ -0,0 +1,253 @@
+"""
+Согласованные снимки каталога данных без остановки бота
+
+Файлы данных никогда не переписываются на месте: запись идет во временный
+файл и атомарно заменяет старый (os.replace). Поэтому жесткая ссылка на
+файл навсегда сохраняет его содержимое на момент создания ссылки, и снимок
+делается без копирования:
+
+1. учет замененных файлов включается, и дерево данных связывается
+   жесткими ссылками без каких-либо блокировок;
+2. под исключительным барьером записи перевязываются только файлы,
+   замененные за время первого шага. Обработчики ждут лишь этот шаг -
+   обычно миллисекунды.
+
+Готовый снимок атомарно переименовывается из {name}.partial в {name}
+и при SNAPSHOT_ARCHIVE упаковывается в {name}.tar.gz уже вне барьера.
+
+В многопроцессном режиме снимок делает основной процесс с committer из
+utils.worker_control.PoolCommitter: учет замененных файлов и исключительный барьер
+действуют во всех процессах-обработчиках (команды по каналу управления),
+поэтому снимок так же согласован на один момент.
+
+Запуск из каталога src (восстановление - только при остановленном боте):
+    python -m utils.snapshots create|list|prune
+    python -m utils.snapshots restore ИМЯ
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from config import DATA_DIR, POLLING_OFFSET_FILE, SNAPSHOT_ARCHIVE, SNAPSHOT_DIR, SNAPSHOT_RETENTION
+from utils.durability import GroupCommitter, group_committer
+from utils.metrics import metrics
+from utils.versioning import LOCK_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_SUFFIX = '.partial'
+ARCHIVE_SUFFIX = '.tar.gz'
+
+_snapshot_lock = threading.Lock()
+
+
+def _is_data_file(file_name: str) -> bool:
+    """Временные файлы незавершенных записей и файлы блокировок в снимок не попадают"""
+    return not file_name.endswith(('.tmp', LOCK_SUFFIX))
+
+
+def _link(source: str, target: str) -> None:
+    """Жесткая ссылка, а на файловых системах без них - копия"""
+    os.makedirs(os.path.dirname(target), mode=0o700, exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        os.remove(target)
+        _link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _link_tree(source_dir: str, target_dir: str) -> int:
+    """Связывание всех файлов дерева данных жесткими ссылками"""
+    linked = 0
+    for root, _, files in os.walk(source_dir):
+        relative = os.path.relpath(root, source_dir)
+        for file_name in files:
+            if not _is_data_file(file_name):
+                continue
+            try:
+                _link(os.path.join(root, file_name), os.path.join(target_dir, relative, file_name))
+                linked += 1
+            except FileNotFoundError:
+                # Файл перенесли во время обхода - он попадет в снимок по новому пути
+                continue
+    return linked
+
+
+def create_snapshot(data_dir: str = DATA_DIR, snapshot_dir: str = SNAPSHOT_DIR,
+                    committer: GroupCommitter = group_committer, archive: bool = SNAPSHOT_ARCHIVE,
+                    retention: int = SNAPSHOT_RETENTION) -> str:
+    """Создание согласованного снимка; возвращает имя снимка"""
+    name = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    target = os.path.join(snapshot_dir, name)
+    partial = target + PARTIAL_SUFFIX
+    os.makedirs(snapshot_dir, mode=0o700, exist_ok=True)
+
+    # Учет замененных файлов у committer один на процесс, поэтому снимки
+    # (например, нескольких студий) делаются по одному
+    with _snapshot_lock:
+        started = time.perf_counter()
+        committer.track_changes()
+        try:
+            # Первый проход: без блокировок, записи продолжаются. Каталог
+            # снимка создается сразу: данных может еще не быть
+            os.makedirs(partial, mode=0o700)
+            linked = _link_tree(data_dir, partial)
+
+            # Второй проход: перевязываем замененные за это время файлы
+            barrier_started = time.perf_counter()
+            with committer.barrier.exclusive():
+                changed = committer.take_changes()
+                for path in changed:
+                    relative = os.path.relpath(path, data_dir)
+                    if relative.startswith(os.pardir) or not os.path.exists(path):
+                        continue
+                    _link(path, os.path.join(partial, relative))
+            paused = time.perf_counter() - barrier_started
+        except BaseException:
+            committer.take_changes()
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+
+    os.replace(partial, target)
+    metrics.increment('snapshot.created')
+    metrics.observe('snapshot.total', time.perf_counter() - started)
+    metrics.observe('snapshot.barrier', paused)
+    logger.info(
+        f"Снимок данных {name}: файлов={linked}, перевязано={len(changed)}, "
+        f"барьер={paused * 1000:.1f} мс"
+    )
+
+    if archive:
+        archive_snapshot(name, snapshot_dir)
+    if retention:
+        prune_snapshots(retention, snapshot_dir)
+    return name
+
+
+def archive_snapshot(name: str, snapshot_dir: str = SNAPSHOT_DIR) -> str:
+    """Упаковка снимка в tar.gz (файлы снимка уже не меняются)"""
+    source = os.path.join(snapshot_dir, name)
+    archive_path = source + ARCHIVE_SUFFIX
+    temp_path = archive_path + PARTIAL_SUFFIX
+    with tarfile.open(temp_path, 'w:gz') as archive:
+        archive.add(source, arcname='.')
+    os.chmod(temp_path, 0o600)
+    os.replace(temp_path, archive_path)
+    logger.info(f"Снимок {name} упакован: {archive_path}")
+    return archive_path
+
+
+def list_snapshots(snapshot_dir: str = SNAPSHOT_DIR) -> List[str]:
+    """Имена готовых снимков от старых к новым"""
+    if not os.path.isdir(snapshot_dir):
+        return []
+    names = set()
+    for entry in os.listdir(snapshot_dir):
+        if entry.endswith(PARTIAL_SUFFIX):
+            continue
+        if entry.endswith(ARCHIVE_SUFFIX):
+            names.add(entry[:-len(ARCHIVE_SUFFIX)])
+        elif os.path.isdir(os.path.join(snapshot_dir, entry)):
+            names.add(entry)
+    return sorted(names)
+
+
+def prune_snapshots(keep: int = SNAPSHOT_RETENTION, snapshot_dir: str = SNAPSHOT_DIR) -> int:
+    """Удаление всех снимков, кроме `keep` последних, и брошенных .partial"""
+    removed = 0
+    names = list_snapshots(snapshot_dir)
+    for name in names[:-keep] if keep > 0 else names:
+        path = os.path.join(snapshot_dir, name)
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path + ARCHIVE_SUFFIX):
+            os.remove(path + ARCHIVE_SUFFIX)
+        removed += 1
+
+    latest = names[-1] if names else ''
+    for entry in os.listdir(snapshot_dir) if os.path.isdir(snapshot_dir) else ():
+        # Недописанные снимки старше последнего готового остались от сбоя
+        if entry.endswith(PARTIAL_SUFFIX) and entry < latest:
+            path = os.path.join(snapshot_dir, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+    if removed:
+        logger.info(f"Удалено старых снимков: {removed}")
+    return removed
+
+
+def _extract_archive(archive_path: str, target_dir: str) -> None:
+    """Распаковка архива снимка с проверкой путей"""
+    with tarfile.open(archive_path, 'r:gz') as archive:
+        members = archive.getmembers()
+        for member in members:
+            path = os.path.normpath(member.name)
+            if os.path.isabs(path) or path.startswith(os.pardir) or not (member.isfile() or member.isdir()):
+                raise ValueError(f"Недопустимый элемент архива: {member.name}")
+        if hasattr(tarfile, 'data_filter'):
+            archive.extractall(target_dir, members=members, filter='data')
+        else:
+            archive.extractall(target_dir, members=members)
+
+
+def restore_snapshot(name: str, data_dir: str = DATA_DIR, snapshot_dir: str = SNAPSHOT_DIR,
+                     offset_file: Optional[str] = POLLING_OFFSET_FILE) -> str:
+    """Восстановление каталога данных из снимка
+
+    Выполняется при остановленном боте. Текущий каталог не удаляется, а
+    переименовывается в {data_dir}.before-restore-{время}; его путь
+    возвращается. Смещение long polling берется текущее, чтобы после
+    восстановления не обрабатывать старые нажатия повторно.
+    """
+    source = os.path.join(snapshot_dir, name)
+    staging = data_dir.rstrip(os.sep) + '.restore'
+    shutil.rmtree(staging, ignore_errors=True)
+
+    if os.path.isdir(source):
+        _link_tree(source, staging)
+    elif os.path.exists(source + ARCHIVE_SUFFIX):
+        _extract_archive(source + ARCHIVE_SUFFIX, staging)
+    else:
+        raise FileNotFoundError(f"Снимок не найден: {name}")
+    os.chmod(staging, 0o700)
+
+    if offset_file and os.path.exists(offset_file):
+        relative = os.path.relpath(offset_file, data_dir)
+        if not relative.startswith(os.pardir):
+            shutil.copy2(offset_file, os.path.join(staging, relative))
+
+    backup = f"{data_dir.rstrip(os.sep)}.before-restore-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    if os.path.exists(data_dir):
+        os.rename(data_dir, backup)
+    os.rename(staging, data_dir)
+    logger.info(f"Каталог данных восстановлен из снимка {name}, прежние данные: {backup}")
+    return backup
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Снимки каталога данных')
+    parser.add_argument('command', choices=('create', 'list', 'prune', 'restore'))
+    parser.add_argument('name', nargs='?', help='имя снимка для restore')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        print(create_snapshot())
+    elif args.command == 'list':
+        print('\n'.join(list_snapshots()))
+    elif args.command == 'prune':
+        prune_snapshots()
+    else:
+        if not args.name:
+            parser.error('для restore нужно имя снимка')
+        restore_snapshot(args.name)
@@ -0,0 +1,273 @@
+"""
+Хранилища документов
+
+Менеджеры читают и пишут документы только через интерфейс Storage.
+Документ задается чатом и видом - суффиксом файла: '.json' (индекс или
+данные пользователя), '.lessons.json' (отметки), '.archive' (архив) - и
+хранится как байты. Формат, версии и повтор изменений при конфликте
+остаются в менеджерах, поэтому хранилище можно заменить, не трогая их.
+
+FileStorage - файлы каталога данных: шарды, атомарная замена через
+временный файл, fsync пачкой (utils.durability) и flock на время записи.
+MemoryStorage - словарь в памяти процесса: замеры обработчиков без шума
+диска и отладка без каталога данных.
+
+Замер пропускной способности и задержек хранилищ (запуск из каталога src):
+    python -m utils.storage --threads 4 --ops 2000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils import sharding
+from utils.durability import GroupCommitter, group_committer
+from utils.fileio import directories, read_file, write_private_file
+from utils.versioning import document_lock
+
+# Основной документ чата
+DOCUMENT = '.json'
+
+
+class Storage:
+    """Интерфейс хранилища документов чатов"""
+
+    def load(self, chat_id: int, kind: str = DOCUMENT) -> Optional[bytes]:
+        """Содержимое документа; None, если его нет"""
+        raise NotImplementedError
+
+    def save(self, chat_id: int, files: List[Tuple[str, bytes]]) -> None:
+        """Запись документов чата [(вид, содержимое)] в указанном порядке
+
+        Каждый документ заменяется атомарно, снимок данных видит их вместе.
+        Блокировка не берется: проверку версии и запись вызывающий
+        выполняет под `locked`.
+        """
+        raise NotImplementedError
+
+    def locked(self, chat_id: int, kind: str = DOCUMENT):
+        """Исключительная блокировка записи документа (контекстный менеджер)
+
+        Порядок блокировок при записи везде один: барьер снимка
+        (utils.durability), блокировка документа, блокировка изменений
+        менеджера. Под блокировкой документа барьер только повторно входит.
+        """
+        raise NotImplementedError
+
+    def delete(self, chat_id: int, kind: str = DOCUMENT) -> bool:
+        """Удаление документа; False, если его не было"""
+        raise NotImplementedError
+
+    def chat_ids(self, kind: str = DOCUMENT) -> Iterator[int]:
+        """Чаты, у которых есть документ вида `kind`"""
+        raise NotImplementedError
+
+    def update(self, chat_id: int, change: Callable[[Optional[bytes]], Optional[bytes]],
+               kind: str = DOCUMENT) -> Optional[bytes]:
+        """Атомарное изменение: чтение, `change` и запись под блокировкой документа
+
+        Если `change` вернула None, документ удаляется.
+        """
+        with self.locked(chat_id, kind):
+            content = change(self.load(chat_id, kind))
+            if content is None:
+                self.delete(chat_id, kind)
+            else:
+                self.save(chat_id, [(kind, content)])
+            return content
+
+
+class FileStorage(Storage):
+    """Документы - файлы шардированного каталога данных"""
+
+    def __init__(self, data_dir: str, committer: GroupCommitter = group_committer):
+        self.data_dir = os.path.abspath(data_dir)
+        self.committer = committer
+        # Создаем директорию с правильными правами доступа
+        os.makedirs(self.data_dir, mode=0o700, exist_ok=True)
+        # Устанавливаем права доступа даже если директория уже существует
+        os.chmod(self.data_dir, 0o700)
+        # Проверенные пути к файлам чатов: проверка выполняется один раз
+        self._paths: Dict[Tuple[int, str], str] = {}
+        self._prefix = os.path.join(self.data_dir, '')
+
+    def path(self, chat_id: int, kind: str = DOCUMENT) -> str:
+        """Путь к файлу документа"""
+        file_path = self._paths.get((chat_id, kind))
+        if file_path is not None:
+            return file_path
+
+        if not isinstance(chat_id, int):
+            raise ValueError(f"Некорректный chat_id: {chat_id}")
+        file_name = f'{chat_id}{kind}'
+        if '..' in file_name or '/' in file_name:
+            raise ValueError(f"Некорректное имя файла: {file_name}")
+
+        file_path = sharding.sharded_path(self.data_dir, chat_id, kind)
+        # Проверяем, что путь не вышел за пределы каталога данных
+        if not os.path.abspath(file_path).startswith(self._prefix):
+            raise ValueError(f"Попытка доступа к файлу вне разрешенной директории: {file_path}")
+
+        self._paths[(chat_id, kind)] = file_path
+        return file_path
+
+    def load(self, chat_id: int, kind: str = DOCUMENT) -> Optional[bytes]:
+        file_path = self.path(chat_id, kind)
+        raw = read_file(file_path)
+        if raw is None and kind == DOCUMENT:
+            # Файл в старой плоской раскладке переносим в шард при первом чтении.
+            # Перечитываем в любом случае: файл мог перенести фоновый мигратор
+            sharding.migrate_file(self.data_dir, chat_id)
+            raw = read_file(file_path)
+        return raw
+
+    def save(self, chat_id: int, files: List[Tuple[str, bytes]]) -> None:
+        targets = [(self.path(chat_id, kind), content) for kind, content in files]
+        temp_files = []
+        try:
+            # Каталог шарда создается один раз за время работы процесса
+            directories.ensure(os.path.dirname(targets[0][0]))
+            with self.committer.barrier.write():
+                for target, content in targets:
+                    # Временный файл свой у каждого потока, чтобы параллельные
+                    # записи одной пачки не затирали друг друга; права сразу 0600
+                    temp_file = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    temp_files.append(temp_file)
+                    write_private_file(temp_file, content)
+                # Атомарная замена с выбранным уровнем надежности: все файлы
+                # документа в одной пачке, с одним ожиданием окна и fsync каталога
+                self.committer.commit_many(
+                    [(temp_file, target) for temp_file, (target, _) in zip(temp_files, targets)]
+                )
+        except Exception:
+            for temp_file in temp_files:
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
+            raise
+
+    @contextmanager
+    def locked(self, chat_id: int, kind: str = DOCUMENT):
+        file_path = self.path(chat_id, kind)
+        directories.ensure(os.path.dirname(file_path))
+        # Барьер снимка берется до блокировки документа, как в UnitOfWork.commit:
+        # при обратном порядке запись под блокировкой ждала бы закрытый снимком
+        # барьер, а снимок - единицу работы, которая ждет эту блокировку
+        with self.committer.barrier.write(), document_lock(file_path):
+            yield
+
+    def delete(self, chat_id: int, kind: str = DOCUMENT) -> bool:
+        try:
+            with self.committer.barrier.write():
+                os.remove(self.path(chat_id, kind))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def chat_ids(self, kind: str = DOCUMENT) -> Iterator[int]:
+        return sharding.iter_chat_ids(self.data_dir, kind)
+
+
+class MemoryStorage(Storage):
+    """Документы в памяти процесса (пропадают при перезапуске)"""
+
+    def __init__(self):
+        self._documents: Dict[Tuple[int, str], bytes] = {}
+        self._guard = threading.Lock()
+        self._locks: Dict[Tuple[int, str], threading.Lock] = {}
+
+    def load(self, chat_id: int, kind: str = DOCUMENT) -> Optional[bytes]:
+        return self._documents.get((chat_id, kind))
+
+    def save(self, chat_id: int, files: List[Tuple[str, bytes]]) -> None:
+        with self._guard:
+            for kind, content in files:
+                self._documents[(chat_id, kind)] = bytes(content)
+
+    @contextmanager
+    def locked(self, chat_id: int, kind: str = DOCUMENT):
+        lock = self._locks.get((chat_id, kind))
+        if lock is None:
+            with self._guard:
+                lock = self._locks.setdefault((chat_id, kind), threading.Lock())
+        with lock:
+            yield
+
+    def delete(self, chat_id: int, kind: str = DOCUMENT) -> bool:
+        with self._guard:
+            return self._documents.pop((chat_id, kind), None) is not None
+
+    def chat_ids(self, kind: str = DOCUMENT) -> Iterator[int]:
+        with self._guard:
+            keys = list(self._documents)
+        return iter(sorted(chat_id for chat_id, document_kind in keys if document_kind == kind))
+
+
+def _benchmark(name: str, storage: Storage, threads: int, ops: int, chats: int, size: int) -> None:
+    """Смесь операций одного хранилища: 60% чтений, 30% записей, 10% update"""
+    payload = os.urandom(size)
+    latencies: Dict[str, List[float]] = {'load': [], 'save': [], 'update': []}
+    guard = threading.Lock()
+
+    def worker(index: int) -> None:
+        rng = random.Random(index)
+        local: Dict[str, List[float]] = {key: [] for key in latencies}
+        for _ in range(ops):
+            chat_id = rng.randrange(1, chats + 1)
+            roll = rng.random()
+            started = time.perf_counter()
+            if roll < 0.6:
+                storage.load(chat_id)
+                operation = 'load'
+            elif roll < 0.9:
+                with storage.locked(chat_id):
+                    storage.save(chat_id, [(DOCUMENT, payload)])
+                operation = 'save'
+            else:
+                storage.update(chat_id, lambda raw: (raw or b'')[:size - 1] + b'+')
+                operation = 'update'
+            local[operation].append(time.perf_counter() - started)
+        with guard:
+            for key, values in local.items():
+                latencies[key].extend(values)
+
+    for chat_id in range(1, chats + 1):
+        storage.save(chat_id, [(DOCUMENT, payload)])
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{name}: {threads * ops / elapsed:.0f} операций/с")
+    for operation, values in latencies.items():
+        if len(values) < 2:
+            continue
+        percentiles = statistics.quantiles(values, n=100)
+        print(f"  {operation:<6} n={len(values):<6} p50={percentiles[49] * 1e6:.0f} мкс, "
+              f"p99={percentiles[98] * 1e6:.0f} мкс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замер пропускной способности и задержек хранилищ')
+    parser.add_argument('--backend', choices=('all', 'file', 'memory'), default='all')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=2000, help='операций на поток')
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--size', type=int, default=2048, help='размер документа в байтах')
+    args = parser.parse_args()
+    if args.backend in ('all', 'memory'):
+        _benchmark('memory', MemoryStorage(), args.threads, args.ops, args.chats, args.size)
+    if args.backend in ('all', 'file'):
+        _benchmark('file', FileStorage(tempfile.mkdtemp(prefix='storage-bench-')),
+                   args.threads, args.ops, args.chats, args.size)
@@ -0,0 +1,214 @@
+"""
+Нагрузочная проверка менеджера абонементов из многих потоков
+
+Потоки выполняют случайную смесь операций на нескольких чатах через один
+менеджер (общий кэш, индексы и журналы изменений): отметки занятий,
+добавление абонементов, замену списка категории целиком и чтение списков
+с отметками. После каждого прогона данные перечитываются новым
+менеджером и проверяются инварианты:
+
+- ни одна отметка не потеряна, счетчики индекса совпадают с отметками;
+- все добавленные абонементы на месте, id в чате не повторяются;
+- список, замененный целиком, совпадает с одной из записанных версий;
+- все документы хранилища разбираются, временных файлов не осталось.
+
+Запуск из каталога src:
+    python -m utils.stress [--threads 1 4 16 64] [--ops 4800] [--chats 8] [--backend file]
+
+Число операций прогона не зависит от числа потоков, поэтому документы к
+концу прогонов одного размера и замеры сравнимы между собой.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Set, Tuple
+
+from models.domain import Subscription
+from utils import serialization
+from utils.archive import ARCHIVE_SUFFIX
+from utils.metrics import metrics
+from utils.storage import DOCUMENT, FileStorage, MemoryStorage, Storage
+from utils.subscription_manager import PAYLOAD_SUFFIX, SubscriptionManager
+
+# Доли операций в смеси
+MIX = (('mark', 0.5), ('read', 0.3), ('add', 0.15), ('replace', 0.05))
+SUBSCRIPTIONS_PER_CHAT = 4
+
+
+class Expected:
+    """Что должно оказаться в хранилище после прогона"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.marks: Set[Tuple[int, str, int]] = set()
+        self.added: Set[Tuple[int, str]] = set()
+        self.replaced: Dict[int, List[Tuple[str, ...]]] = {}
+
+
+def _pick(rng: random.Random) -> str:
+    roll = rng.random()
+    for operation, share in MIX:
+        if roll < share:
+            return operation
+        roll -= share
+    return MIX[-1][0]
+
+
+def _worker(manager: SubscriptionManager, index: int, threads: int, ops: int, chats: List[int],
+            sub_ids: Dict[int, List[str]], expected: Expected, latencies: Dict[str, List[float]],
+            errors: List[str]) -> None:
+    rng = random.Random(index)
+    local: Dict[str, List[float]] = {operation: [] for operation, _ in MIX}
+    # Дни потоков чередуются (index+1, index+1+threads...): отметки разных
+    # потоков не совпадают, а номера дней остаются небольшими, как в жизни
+    marked: Dict[str, int] = {}
+    for step in range(ops):
+        chat_id = rng.choice(chats)
+        operation = _pick(rng)
+        started = time.perf_counter()
+        try:
+            if operation == 'mark':
+                sub_id = rng.choice(sub_ids[chat_id])
+                lesson = marked.get(sub_id, 0) * threads + index + 1
+                marked[sub_id] = marked.get(sub_id, 0) + 1
+                if manager.mark_lesson(chat_id, sub_id, lesson):
+                    with expected.lock:
+                        expected.marks.add((chat_id, sub_id, lesson))
+                else:
+                    errors.append(f"mark_lesson вернул False: {chat_id}/{sub_id}/{lesson}")
+            elif operation == 'read':
+                for sub in manager.get_subscriptions(chat_id, 'stress'):
+                    if sub.used_lessons.used_count != sub.used_count:
+                        errors.append(f"Счетчик не совпадает с отметками: {chat_id}/{sub.id}")
+            elif operation == 'add':
+                name = f"t{index}-{step}"
+                if manager.add_subscription(chat_id, 'added', name, 8):
+                    with expected.lock:
+                        expected.added.add((chat_id, name))
+                else:
+                    errors.append(f"add_subscription вернул False: {chat_id}/{name}")
+            else:
+                names = tuple(f"r{index}-{step}-{k}" for k in range(3))
+                # Версия запоминается до записи: ее может сразу заменить другой поток
+                with expected.lock:
+                    expected.replaced.setdefault(chat_id, []).append(names)
+                if not manager.save_subscriptions(chat_id, 'replaced', [Subscription(name, 4) for name in names]):
+                    errors.append(f"save_subscriptions вернул False: {chat_id}")
+        except Exception as e:
+            errors.append(f"{operation}: {type(e).__name__}: {e}")
+        local[operation].append(time.perf_counter() - started)
+    with expected.lock:
+        for operation, values in local.items():
+            latencies[operation].extend(values)
+
+
+def _check(storage: Storage, chats: List[int], expected: Expected, data_dir: str = None) -> List[str]:
+    """Проверка инвариантов по данным, перечитанным новым менеджером"""
+    problems = []
+    manager = SubscriptionManager(storage=storage)
+    for chat_id in chats:
+        for kind in (DOCUMENT, PAYLOAD_SUFFIX, ARCHIVE_SUFFIX):
+            raw = storage.load(chat_id, kind)
+            if raw is None:
+                continue
+            try:
+                serialization.loads(raw)
+            except ValueError as e:
+                problems.append(f"Документ {chat_id}{kind} не разбирается: {e}")
+
+        subscriptions = {sub.id: sub for sub in manager.get_subscriptions(chat_id, 'stress')}
+        for sub in subscriptions.values():
+            if sub.used_lessons.used_count != sub.used_count:
+                problems.append(f"Счетчик индекса не совпадает с отметками: {chat_id}/{sub.id}")
+
+        ids = [sub.id for category in ('stress', 'added', 'replaced')
+               for sub in manager.get_subscriptions(chat_id, category)]
+        if len(ids) != len(set(ids)):
+            problems.append(f"Повторяющиеся id абонементов в чате {chat_id}")
+
+        added = {sub.name for sub in manager.get_subscriptions(chat_id, 'added')}
+        replaced = tuple(sub.name for sub in manager.get_subscriptions(chat_id, 'replaced'))
+        if replaced and replaced not in expected.replaced.get(chat_id, []):
+            problems.append(f"Список категории не совпадает ни с одной записанной версией: {chat_id} {replaced}")
+        for expected_chat, name in expected.added:
+            if expected_chat == chat_id and name not in added:
+                problems.append(f"Потерян добавленный абонемент: {chat_id}/{name}")
+
+        for expected_chat, sub_id, lesson in expected.marks:
+            if expected_chat != chat_id:
+                continue
+            sub = subscriptions.get(sub_id)
+            if sub is None or not sub.used_lessons.is_used(lesson):
+                problems.append(f"Потеряна отметка: {chat_id}/{sub_id}/{lesson}")
+
+    if data_dir is not None:
+        for root, _, files in os.walk(data_dir):
+            problems.extend(f"Остался временный файл: {name}" for name in files if name.endswith('.tmp'))
+    return problems
+
+
+def run(threads: int, total_ops: int, chats: int, backend: str) -> bool:
+    """Один прогон: нагрузка, замер и проверка; True, если инварианты выполнены"""
+    ops = max(1, total_ops // threads)
+    data_dir = tempfile.mkdtemp(prefix='stress-') if backend == 'file' else None
+    storage = FileStorage(data_dir) if data_dir else MemoryStorage()
+    manager = SubscriptionManager(storage=storage)
+    chat_ids = list(range(1, chats + 1))
+
+    sub_ids: Dict[int, List[str]] = {}
+    for chat_id in chat_ids:
+        for k in range(SUBSCRIPTIONS_PER_CHAT):
+            manager.add_subscription(chat_id, 'stress', f"s{k}", threads * ops)
+        sub_ids[chat_id] = [sub.id for sub in manager.get_subscriptions(chat_id, 'stress')]
+
+    expected = Expected()
+    latencies: Dict[str, List[float]] = {operation: [] for operation, _ in MIX}
+    errors: List[str] = []
+    workers = [
+        threading.Thread(target=_worker, args=(manager, index, threads, ops, chat_ids, sub_ids, expected, latencies, errors))
+        for index in range(threads)
+    ]
+    before = metrics.snapshot()['counters']
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    counters = metrics.snapshot()['counters']
+    writes, coalesced = (counters.get(name, 0) - before.get(name, 0) for name in ('cas.commits', 'storage.coalesced'))
+
+    problems = errors + _check(storage, chat_ids, expected, data_dir)
+    if data_dir is not None:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    print(f"потоков: {threads:<3} {threads * ops / elapsed:8.0f} операций/с, {elapsed:.2f} с, "
+          f"записей: {writes}, изменений записано чужой записью: {coalesced}")
+    for operation, values in latencies.items():
+        if len(values) < 2:
+            continue
+        percentiles = statistics.quantiles(values, n=100)
+        print(f"  {operation:<8} n={len(values):<6} p50={percentiles[49] * 1e3:7.2f} мс  "
+              f"p95={percentiles[94] * 1e3:7.2f} мс  p99={percentiles[98] * 1e3:7.2f} мс")
+    for problem in problems[:20]:
+        print(f"  ОШИБКА: {problem}")
+    if len(problems) > 20:
+        print(f"  ... и еще {len(problems) - 20}")
+    return not problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Многопоточная проверка менеджера абонементов')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--ops', type=int, default=4800, help='операций за прогон (делятся между потоками)')
+    parser.add_argument('--chats', type=int, default=8)
+    parser.add_argument('--backend', choices=('file', 'memory'), default='file')
+    args = parser.parse_args()
+    results = [run(threads, args.ops, args.chats, args.backend) for threads in args.threads]
+    sys.exit(0 if all(results) else 1)
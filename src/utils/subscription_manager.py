@@ -1,155 +1,543 @@
-import json
-import os
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+import secrets
+from typing import Callable, Dict, List, Optional, Any, Tuple
+from datetime import datetime, date
 import logging
 from threading import Lock
+from models.attendance import Attendance
+from models.domain import Subscription
+from utils.archive import ArchivedSubscription, identity, is_archivable, read_archive, update_archive
+from utils.cache import DocumentCache, document_cache
+from utils.search_index import SubscriptionSearchIndex
+from utils.unit_of_work import current_unit_of_work
+from utils import serialization
+from utils.metrics import metrics
+from utils.rosters import rosters
+from utils.storage import DOCUMENT, FileStorage, Storage
+from utils.tracing import span
+from utils.versioning import (
+    CAS_RETRIES, VERSION_KEY, VersionConflict, backoff, check_version, stored_version, version_of
+)
+from config import STORAGE_FORMAT
 
 logger = logging.getLogger(__name__)
 
+class Document(Dict[str, List[Subscription]]):
+    """Документ чата: категория -> абонементы
+
+    `version` - версия, от которой документ прочитан, `changes` -
+    изменения, еще не записанные на диск (повторяются при конфликте версий).
+    """
+
+    __slots__ = ('version', 'changes')
+
+    def __init__(self, *args, version: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = version
+        self.changes: List[Callable[['Document'], Any]] = []
+
+
+# Отметки посещений хранятся рядом с индексом чата: {chat}.lessons.json
+PAYLOAD_SUFFIX = '.lessons.json'
+
+
+class PayloadSource:
+    """Отложенная загрузка отметок посещений одного чата
+
+    Файл отметок читается целиком при первом обращении к отметкам любого
+    абонемента чата (открытие сетки занятий, отметка), а не при показе
+    меню и списков, которым хватает счетчиков индекса.
+    """
+
+    __slots__ = ('storage', 'chat_id', 'on_load', '_lock', '_payload', '_decoded')
+
+    def __init__(self, storage: Storage, chat_id: int, on_load: Optional[Callable[[int, int], None]] = None):
+        self.storage = storage
+        self.chat_id = chat_id
+        # Вызывается с (chat_id, размер файла отметок) после его чтения
+        self.on_load = on_load
+        self._lock = Lock()
+        self._payload: Optional[Dict[str, Any]] = None
+        # Уже выданные отметки: параллельные потоки получают один объект
+        self._decoded: Dict[Optional[str], Attendance] = {}
+
+    def attendance(self, sub_id: Optional[str], created_at: Optional[str]) -> Attendance:
+        loaded = 0
+        with self._lock:
+            attendance = self._decoded.get(sub_id)
+            if attendance is not None:
+                return attendance
+            if self._payload is None:
+                with span('storage.load_payload'):
+                    raw = self.storage.load(self.chat_id, PAYLOAD_SUFFIX)
+                    self._payload = serialization.loads(raw) if raw is not None else {}
+                metrics.increment('storage.payload_loads')
+                loaded = len(raw) if raw is not None else 0
+            attendance = self._decoded[sub_id] = Attendance.coerce(self._payload.get(sub_id), created_at)
+        # Без блокировки источника: обработчик берет блокировку кэша
+        if loaded and self.on_load is not None:
+            self.on_load(self.chat_id, loaded)
+        return attendance
+
+
+def _encode_value(value: Any) -> Any:
+    """Сериализация нестандартных значений документа"""
+    if isinstance(value, Attendance):
+        return value.encode()
+    if isinstance(value, Subscription):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
 class SubscriptionManager:
-    def __init__(self, data_dir: str = 'data'):
-        """Инициализация менеджера абонементов"""
-        self.data_dir = data_dir
-        # Создаем директорию с абсолютным путем
-        if not os.path.isabs(data_dir):
-            self.data_dir = os.path.abspath(data_dir)
-        
-        # Создаем директорию с правильными правами доступа
-        os.makedirs(self.data_dir, mode=0o700, exist_ok=True)
-        # Устанавливаем права доступа даже если директория уже существует
-        os.chmod(self.data_dir, 0o700)
-        
-        # Инициализация кэша и блокировки
-        self._cache: Dict[int, Dict[str, Any]] = {}
-        self._cache_lock = Lock()
-        
-        logger.info(f"Инициализация SubscriptionManager: data_dir={self.data_dir}")
-    
-    def _get_user_file(self, chat_id: int) -> str:
-        """Получение пути к файлу пользователя"""
-        # Проверяем, что chat_id является положительным числом
-        if not isinstance(chat_id, int) or chat_id <= 0:
-            raise ValueError(f"Некорректный chat_id: {chat_id}")
-        
-        # Создаем безопасный путь к файлу
-        safe_filename = f'{chat_id}.json'
-        if '..' in safe_filename or '/' in safe_filename:
-            raise ValueError(f"Некорректное имя файла: {safe_filename}")
+    def __init__(self, data_dir: str = 'data', storage_format: str = STORAGE_FORMAT,
+                 storage: Optional[Storage] = None, cache: Optional[DocumentCache] = None):
+        """Инициализация менеджера абонементов
+
+        По умолчанию документы хранятся в файлах каталога `data_dir`, а
+        прочитанные документы - в своем разделе общего кэша процесса.
+        """
+        self.serializer = serialization.get_serializer(storage_format)
+        self.storage = storage if storage is not None else FileStorage(data_dir)
+        # Каталог данных нужен только для переноса файлов в шарды
+        self.data_dir = getattr(self.storage, 'data_dir', None)
         
-        file_path = os.path.join(self.data_dir, safe_filename)
-        # Проверяем, что путь не вышел за пределы data_dir
-        if not os.path.abspath(file_path).startswith(os.path.abspath(self.data_dir)):
-            raise ValueError(f"Попытка доступа к файлу вне разрешенной директории: {file_path}")
+        # Раздел общего кэша; блокировка кэша общая для всех разделов, ею
+        # защищены и индексы ниже (их очищает вытеснение из раздела)
+        cache = cache if cache is not None else document_cache
+        self._cache = cache.partition(self.data_dir or type(self.storage).__name__, self._forget)
+        self._cache_lock = cache.lock
+        # Индекс абонементов чата: id -> (категория, абонемент)
+        self._index: Dict[int, Dict[str, Tuple[str, Subscription]]] = {}
+        # Поисковые индексы названий по чатам: строятся при первом поиске
+        # и дальше обновляются по одному абонементу
+        self._search: Dict[int, SubscriptionSearchIndex] = {}
+        # Блокировки изменений документов: изменение применяется к кэшу и
+        # записывается в журнал документа атомарно относительно его записи
+        self._mutation_locks: Dict[int, Lock] = {}
+        # Документы, закрепленные за этим процессом (многопроцессный режим,
+        # см. workers.WorkerPool); None - все. Документ другого процесса мог
+        # оказаться в кэше, пока чат не вступил в общий список, поэтому при
+        # чтении из кэша он сверяется с версией в хранилище
+        self.owns: Optional[Callable[[int], bool]] = None
         
-        return file_path
+        logger.info(f"Инициализация SubscriptionManager: storage={type(self.storage).__name__}, data_dir={self.data_dir}")
+    
+    @staticmethod
+    def _check_chat_id(chat_id: int) -> None:
+        """Проверка, что chat_id является положительным числом"""
+        if not isinstance(chat_id, int) or chat_id <= 0:
+            raise ValueError(f"Некорректный chat_id: {chat_id}")
     
-    def _load_user_data(self, chat_id: int) -> Dict[str, Any]:
+    def _load_user_data(self, chat_id: int) -> Document:
         """Загрузка данных пользователя"""
         try:
-            # Проверяем кэш
-            with self._cache_lock:
-                if chat_id in self._cache:
-                    return self._cache[chat_id]
-            
-            file_path = self._get_user_file(chat_id)
-            logger.info(f"Загрузка данных пользователя: chat_id={chat_id}, file_path={file_path}")
-            
-            if os.path.exists(file_path):
-                # Проверяем права доступа к файлу
-                stat = os.stat(file_path)
-                if stat.st_mode & 0o777 != 0o600:
-                    # Если права неправильные, исправляем их
-                    os.chmod(file_path, 0o600)
-                
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logger.info(f"Загружены данные для chat_id={chat_id}")
-                    # Сохраняем в кэш
-                    with self._cache_lock:
-                        self._cache[chat_id] = data
+            # В рамках одного обновления документ загружается один раз
+            uow = current_unit_of_work()
+            if uow is not None:
+                data = uow.get(('subscriptions', chat_id))
+                if data is not None:
                     return data
-            else:
-                # Создаем пустой файл с правильными правами
-                logger.info(f"Создаем новый файл данных: {file_path}")
-                empty_data = {}
-                self._save_user_data(chat_id, empty_data)
-                # Сохраняем в кэш
-                with self._cache_lock:
-                    self._cache[chat_id] = empty_data
-                return empty_data
+            
+            with span('storage.load', doc=('subscriptions', chat_id)):
+                # Документ единицы работы закреплен в кэше до ее закрытия
+                data = self._read_user_data(chat_id, pin=uow is not None)
+            if uow is not None:
+                uow.loaded(('subscriptions', chat_id), data)
+                uow.on_close(lambda: self._unpin(chat_id))
+            return data
             
         except Exception as e:
             logger.error(f"Ошибка при загрузке данных пользователя: {e}, chat_id={chat_id}")
-            return {}
+            return Document()
     
-    def _save_user_data(self, chat_id: int, data: Dict[str, Any]) -> bool:
-        """Сохранение данных пользователя"""
+    def _read_user_data(self, chat_id: int, pin: bool = False) -> Document:
+        """Чтение данных пользователя из кэша или с диска
+
+        С `pin` документ закрепляется в кэше (см. _unpin) еще до чтения,
+        чтобы его нельзя было вытеснить между чтением и закреплением.
+        """
+        # Проверяем кэш
+        with self._cache_lock:
+            if pin:
+                self._cache.pin(chat_id)
+            cached = self._cache.get(chat_id)
+        if cached is not None:
+            if self.owns is not None and not self.owns(chat_id):
+                self._revalidate(chat_id, cached)
+            return cached
+        
         try:
-            file_path = self._get_user_file(chat_id)
-            logger.info(f"Сохранение данных пользователя: chat_id={chat_id}, file_path={file_path}")
-            
-            # Создаем директорию, если её нет
-            os.makedirs(os.path.dirname(file_path), mode=0o700, exist_ok=True)
-            
-            # Сначала сохраняем во временный файл
-            temp_file = f"{file_path}.tmp"
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            # Устанавливаем права доступа только для владельца
-            os.chmod(temp_file, 0o600)
-            
-            # Затем переименовываем временный файл в целевой
-            os.replace(temp_file, file_path)
-            
-            # Устанавливаем права доступа для целевого файла
-            os.chmod(file_path, 0o600)
-            
-            # Обновляем кэш
+            self._check_chat_id(chat_id)
+            return self._load_document(chat_id)
+        except BaseException:
+            if pin:
+                self._unpin(chat_id)
+            raise
+    
+    def _revalidate(self, chat_id: int, data: Document) -> None:
+        """Перечитывание документа из кэша, если его записал другой процесс"""
+        if data.changes:
+            # Незаписанные изменения сверит с хранилищем сама запись
+            return
+        if stored_version(self.storage, chat_id) != data.version:
+            metrics.increment('cache.revalidated')
+            self._refresh(chat_id, data)
+    
+    def _load_document(self, chat_id: int) -> Document:
+        """Чтение документа с диска в кэш"""
+        logger.info(f"Загрузка данных пользователя: chat_id={chat_id}")
+        
+        raw = self.storage.load(chat_id)
+        if raw is None:
+            # Документ создается при первом сохранении
+            logger.info(f"Новый чат без данных: chat_id={chat_id}")
+            return self._cache_document(chat_id, Document())
+        
+        data = self._decode_document(serialization.loads(raw), self._payload_source(chat_id))
+        logger.info(f"Загружены данные для chat_id={chat_id}")
+        cached = self._cache_document(chat_id, data, len(raw))
+        if cached is not data:
+            return cached
+        
+        # Старым абонементам без id присваиваем его один раз
+        with self._mutation_lock(chat_id):
+            assigned = self._assign_ids(data)
+        if assigned:
+            logger.info(f"Присвоены идентификаторы абонементам: chat_id={chat_id}")
+            self._save_user_data(chat_id, data)
+        return data
+    
+    def _cache_document(self, chat_id: int, data: Document, size: int = 0) -> Document:
+        """Помещение прочитанного документа в кэш; `size` - размер его файла
+        
+        Если документ одновременно прочитали несколько потоков, в кэш
+        попадает первый, и все потоки получают его: изменения двух копий
+        одного документа пришлось бы сводить через конфликт версий.
+        """
+        with self._cache_lock:
+            cached = self._cache.get(chat_id)
+            if cached is not None:
+                return cached
+            self._cache.put(chat_id, data, size)
+            self._index[chat_id] = self._build_index(data)
+            self._search.pop(chat_id, None)
+        return data
+    
+    def _payload_source(self, chat_id: int) -> PayloadSource:
+        """Источник отметок чата; прочитанные отметки добавляются к объему документа в кэше"""
+        return PayloadSource(self.storage, chat_id, self._payload_loaded)
+    
+    def _payload_loaded(self, chat_id: int, size: int) -> None:
+        with self._cache_lock:
+            self._cache.grow(chat_id, size)
+    
+    def _unpin(self, chat_id: int) -> None:
+        """Открепление документа, закрепленного чтением в единице работы"""
+        with self._cache_lock:
+            self._cache.unpin(chat_id)
+    
+    def _forget(self, chat_id: int) -> None:
+        """Очистка индексов вытесненного из кэша документа (под блокировкой кэша)"""
+        self._index.pop(chat_id, None)
+        self._search.pop(chat_id, None)
+    
+    def _save_user_data(self, chat_id: int, data: Document, change: Optional[Callable] = None) -> bool:
+        """Сохранение данных пользователя
+
+        Кэш и индекс обновляются сразу, а запись в хранилище внутри единицы
+        работы откладывается до конца обработки обновления. `change` -
+        изменение, ради которого нужна запись (см. _write_user_data).
+        """
+        try:
+            # Документ обходится под блокировкой: другой поток может в это
+            # время добавлять в него категории и абонементы
+            with self._mutation_lock(chat_id):
+                self._assign_ids(data)
+                index = self._build_index(data)
             with self._cache_lock:
                 self._cache[chat_id] = data
-            
-            logger.info(f"Данные успешно сохранены: {file_path}")
-            return True
+                self._index[chat_id] = index
         except Exception as e:
-            logger.error(f"Ошибка при сохранении данных пользователя: {e}, chat_id={chat_id}, file_path={file_path}")
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
+            logger.error(f"Ошибка при сохранении данных пользователя: {e}, chat_id={chat_id}")
             return False
+        
+        uow = current_unit_of_work()
+        if uow is not None:
+            uow.defer_save(('subscriptions', chat_id), data, lambda: self._write_user_data(chat_id, data, change))
+            return True
+        return self._write_user_data(chat_id, data, change)
+    
+    def _mutation_lock(self, chat_id: int) -> Lock:
+        lock = self._mutation_locks.get(chat_id)
+        if lock is None:
+            with self._cache_lock:
+                lock = self._mutation_locks.setdefault(chat_id, Lock())
+        return lock
+    
+    def _mutate(self, chat_id: int, change: Callable[[Document], Any]) -> bool:
+        """Изменение документа функцией `change`
+
+        Функция применяется к документу сразу и запоминается в его журнале:
+        если к моменту записи документ на диске изменил другой тренер общего
+        списка или другой процесс, она применяется повторно к свежей версии.
+        Функция должна искать абонементы по id, а не держать ссылки на
+        объекты. Если она вернула False, изменений нет и запись не нужна.
+        """
+        data = self._load_user_data(chat_id)
+        with self._mutation_lock(chat_id):
+            if change(data) is False:
+                return False
+            data.changes.append(change)
+        return self._save_user_data(chat_id, data, change)
+    
+    def _refresh(self, chat_id: int, data: Document) -> None:
+        """Перечитывание документа после конфликта версий и повтор изменений
+
+        Документ обновляется на месте, поэтому кэш и единица работы
+        продолжают ссылаться на тот же объект.
+        """
+        fresh = self._read_document(chat_id) or Document()
+        with self._mutation_lock(chat_id):
+            data.clear()
+            data.update(fresh)
+            data.version = fresh.version
+            with self._cache_lock:
+                self._cache[chat_id] = data
+                self._index[chat_id] = self._build_index(data)
+                self._search.pop(chat_id, None)
+            for change in data.changes:
+                change(data)
+            self._assign_ids(data)
+            with self._cache_lock:
+                self._index[chat_id] = self._build_index(data)
+    
+    def _encode_files(self, data: Document) -> List[Tuple[str, bytes]]:
+        """Содержимое документов чата [(вид, байты)]: отметки (если загружались) и индекс с новой версией"""
+        subscriptions = [sub for _, sub in self._iter_subscriptions(data)]
+        index = {
+            category: [sub.to_index() for sub in value] if isinstance(value, list) else value
+            for category, value in data.items()
+        }
+        index[VERSION_KEY] = data.version + 1
+        files = []
+        if any(sub.is_loaded for sub in subscriptions):
+            payload = {sub.id: sub.used_lessons for sub in subscriptions}
+            files.append((PAYLOAD_SUFFIX, self.serializer.dumps(payload, default=_encode_value)))
+        files.append((DOCUMENT, self.serializer.dumps(index, default=_encode_value)))
+        return files
+    
+    def _write_user_data(self, chat_id: int, data: Document, change: Optional[Callable] = None) -> bool:
+        """Запись данных пользователя в хранилище
+
+        Запись выполняется, только если версия документа в хранилище совпадает
+        с версией, от которой он прочитан (compare-and-swap под блокировкой
+        документа). Иначе документ перечитывается, изменения из его журнала
+        применяются к свежей версии, и записывается уже она.
+
+        Сначала пишутся отметки, затем индекс: после сбоя между ними
+        индекс остается прежним, а отметки новых абонементов просто лишние.
+        Если отметки чата так и не загружались, их документ не трогается.
+
+        Изменения из журнала снимаются только после записи, поэтому если
+        `change` в журнале уже нет, его записал другой поток вместе со своими
+        изменениями, и повторная запись не нужна: одновременные изменения
+        одного документа записываются одной пачкой.
+        """
+        for attempt in range(CAS_RETRIES + 1):
+            try:
+                self._check_chat_id(chat_id)
+                if change is not None and change not in data.changes:
+                    metrics.increment('storage.coalesced')
+                    return True
+                logger.info(f"Сохранение данных пользователя: chat_id={chat_id}")
+                
+                with self.storage.locked(chat_id):
+                    # Пока ждали блокировку, изменение мог записать предыдущий писатель
+                    if change is not None and change not in data.changes:
+                        metrics.increment('storage.coalesced')
+                        return True
+                    if stored_version(self.storage, chat_id) != data.version:
+                        # Документ изменил другой тренер или процесс: журнал
+                        # изменений применяется к свежей версии, не отпуская блокировку
+                        metrics.increment('cas.conflicts')
+                        with span('storage.rebase', changes=len(data.changes)):
+                            self._refresh(chat_id, data)
+                        check_version(self.storage, chat_id, data.version)
+                    # Снимок документа и журнала берется атомарно относительно изменений
+                    with self._mutation_lock(chat_id):
+                        files = self._encode_files(data)
+                        applied = len(data.changes)
+                    
+                    # Оба документа записываются вместе: снимок видит их согласованными
+                    self.storage.save(chat_id, files)
+                    
+                    data.version += 1
+                    del data.changes[:applied]
+                    with self._cache_lock:
+                        # Записанные файлы - новая оценка объема документа в кэше;
+                        # файл отметок пишется, только если отметки загружены
+                        self._cache.resize(chat_id, sum(len(content) for _, content in files))
+                
+                metrics.increment('cas.commits')
+                logger.info(f"Данные успешно сохранены: chat_id={chat_id}")
+                return True
+            except VersionConflict as e:
+                # Без межпроцессной блокировки документ мог измениться снова
+                logger.info(f"{e}; повтор записи, попытка {attempt + 1}")
+                backoff(attempt)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении данных пользователя: {e}, chat_id={chat_id}")
+                break
+        else:
+            metrics.increment('cas.exhausted')
+            logger.error(f"Не удалось записать данные: документ постоянно меняется, chat_id={chat_id}")
+        
+        # Кэш больше не совпадает с хранилищем - перечитаем при следующем обращении
+        with self._cache_lock:
+            self._cache.pop(chat_id, None)
+            self._index.pop(chat_id, None)
+            self._search.pop(chat_id, None)
+        return False
+    
+    def _read_document(self, chat_id: int) -> Optional[Document]:
+        """Чтение документа из хранилища мимо кэша; None, если его нет"""
+        raw = self.storage.load(chat_id)
+        if raw is None:
+            return None
+        return self._decode_document(serialization.loads(raw), self._payload_source(chat_id))
+    
+    @staticmethod
+    def _decode_document(data: Dict[str, Any], source: Optional[PayloadSource] = None) -> Document:
+        """Приведение абонементов документа к Subscription
+
+        Отметки записей индекса загружаются из `source` при первом
+        обращении. Старые документы с отметками внутри абонементов, словари
+        отметок {"1": "дд.мм"} и ключ `lessons` мигрируют на лету и
+        записываются в новом виде при следующем сохранении.
+        """
+        document = Document(version=version_of(data))
+        for category, subscriptions in data.items():
+            if category == VERSION_KEY:
+                continue
+            if isinstance(subscriptions, list):
+                subscriptions = [
+                    Subscription.from_dict(sub, source) for sub in subscriptions if isinstance(sub, dict)
+                ]
+            document[category] = subscriptions
+        return document
+    
+    @staticmethod
+    def _iter_subscriptions(data: Document):
+        """Обход всех абонементов документа: (категория, абонемент)"""
+        for category, subscriptions in data.items():
+            if not isinstance(subscriptions, list):
+                continue
+            for sub in subscriptions:
+                if isinstance(sub, Subscription):
+                    yield category, sub
+    
+    @classmethod
+    def _build_index(cls, data: Document) -> Dict[str, Tuple[str, Subscription]]:
+        """Построение индекса id -> (категория, абонемент)"""
+        return {sub.id: (category, sub) for category, sub in cls._iter_subscriptions(data) if sub.id}
+    
+    @classmethod
+    def _assign_ids(cls, data: Document) -> bool:
+        """Присвоение стабильных коротких id абонементам без id"""
+        used = set()
+        missing = []
+        for _, sub in cls._iter_subscriptions(data):
+            if sub.id and sub.id not in used:
+                used.add(sub.id)
+            else:
+                missing.append(sub)
+        for sub in missing:
+            sub.id = cls._new_id(used)
+            used.add(sub.id)
+        return bool(missing)
+    
+    @staticmethod
+    def _new_id(used) -> str:
+        """Генерация короткого id, уникального в пределах чата"""
+        while True:
+            sub_id = secrets.token_hex(3)
+            if sub_id not in used:
+                return sub_id
+    
+    def _update_search(self, chat_id: int, updated=(), removed=()) -> None:
+        """Инкрементальное обновление поискового индекса чата, если он построен"""
+        with self._cache_lock:
+            index = self._search.get(chat_id)
+            if index is None:
+                return
+            for sub_id in removed:
+                index.remove(sub_id)
+            for sub in updated:
+                index.update(sub.id, sub.name)
+    
+    def migrate_attendance(self) -> int:
+        """Перевод всех файлов каталога на компактный формат посещений"""
+        migrated = 0
+        for chat_id in list(self.storage.chat_ids()):
+            if chat_id <= 0:
+                continue
+            data = self._load_user_data(chat_id)
+            if data and self._save_user_data(chat_id, data):
+                migrated += 1
+        logger.info(f"Миграция посещений завершена: документов={migrated}")
+        return migrated
+    
+    def _located(self, chat_id: int, sub_id: str,
+                 data: Optional[Document] = None) -> Optional[Tuple[str, Subscription]]:
+        """Абонемент по id: (категория, абонемент)
+
+        Индекс документа, вытесненного из кэша, строится заново по самому
+        документу. `data` передают изменения документа: они уже выполняются
+        под его блокировкой изменений.
+        """
+        with self._cache_lock:
+            index = self._index.get(chat_id)
+        if index is None:
+            if data is None:
+                data = self._load_user_data(chat_id)
+                with self._mutation_lock(chat_id):
+                    index = self._build_index(data)
+            else:
+                index = self._build_index(data)
+            with self._cache_lock:
+                # Индекс нужен кэшу, только если в нем этот же документ
+                if chat_id in self._cache and self._cache.get(chat_id) is data:
+                    self._index[chat_id] = index
+        return index.get(sub_id)
     
     def add_subscription(self, chat_id: int, category: str, name: str, days: int) -> bool:
         """Добавление нового абонемента"""
+        chat_id = rosters.document_id(chat_id)
         try:
             logger.info(f"Добавление абонемента: chat_id={chat_id}, category={category}, name={name}, days={days}")
+            created_at = datetime.now().isoformat()
+            sub_id = self._new_id(self._index.get(chat_id, {}))
+            added = []
             
-            # Загружаем или создаем данные пользователя
-            data = self._load_user_data(chat_id)
-            logger.info(f"Текущие данные пользователя: {data}")
+            def change(data: Document) -> None:
+                # Создаем категорию, если её нет
+                if category not in data:
+                    logger.info(f"Создание новой категории: {category}")
+                    data[category] = []
+                # Id сверяются с самим документом: индекса вытесненного документа нет
+                ids = {sub.id for _, sub in self._iter_subscriptions(data)}
+                # Создаем новый абонемент; id мог занять другой тренер
+                subscription = Subscription(
+                    name=name,
+                    total_lessons=days,
+                    created_at=created_at,
+                    id=sub_id if sub_id not in ids else self._new_id(ids)
+                )
+                data[category].append(subscription)
+                added[:] = [subscription]
             
-            # Создаем категорию, если её нет
-            if category not in data:
-                logger.info(f"Создание новой категории: {category}")
-                data[category] = []
-            
-            # Создаем новый абонемент
-            subscription = {
-                'name': name,
-                'total_lessons': days,
-                'used_lessons': {},
-                'created_at': datetime.now().isoformat()
-            }
-            logger.info(f"Новый абонемент: {subscription}")
-            
-            # Добавляем абонемент в список
-            data[category].append(subscription)
-            
-            # Сохраняем обновленные данные
-            success = self._save_user_data(chat_id, data)
+            success = self._mutate(chat_id, change)
             if success:
+                self._update_search(chat_id, updated=added)
                 logger.info(f"Абонемент успешно добавлен: chat_id={chat_id}, category={category}")
             else:
                 logger.error(f"Не удалось сохранить данные для chat_id={chat_id}, category={category}")
@@ -159,56 +547,313 @@ class SubscriptionManager:
             logger.error(f"Ошибка при добавлении абонемента: {e}, chat_id={chat_id}, category={category}")
             return False
     
-    def get_subscriptions(self, chat_id: int, category: str) -> List[Dict[str, Any]]:
+    def get_subscriptions(self, chat_id: int, category: str) -> List[Subscription]:
         """Получение списка абонементов в категории"""
-        data = self._load_user_data(chat_id)
+        data = self._load_user_data(rosters.document_id(chat_id))
         return data.get(category, [])
     
-    def get_subscription(self, chat_id: int, category: str, index: int) -> Optional[Dict[str, Any]]:
-        """Получение абонемента по индексу"""
-        subscriptions = self.get_subscriptions(chat_id, category)
-        if 0 <= index < len(subscriptions):
-            return subscriptions[index]
-        return None
+    def locate_subscription(self, chat_id: int, sub_id: str) -> Optional[Tuple[str, Subscription]]:
+        """Поиск абонемента по id: (категория, абонемент)"""
+        chat_id = rosters.document_id(chat_id)
+        self._load_user_data(chat_id)
+        return self._located(chat_id, sub_id)
     
-    def mark_lesson(self, chat_id: int, category: str, sub_index: int, lesson_num: int) -> bool:
-        """Отметка занятия"""
+    def get_subscription(self, chat_id: int, sub_id: str) -> Optional[Subscription]:
+        """Получение абонемента по id"""
+        located = self.locate_subscription(chat_id, sub_id)
+        return located[1] if located else None
+    
+    def mark_lesson(self, chat_id: int, sub_id: str, lesson_num: int) -> bool:
+        """Отметка занятия или снятие отметки
+
+        Что делать, решается по текущему состоянию; при повторе после
+        конфликта версий решение не меняется, поэтому одновременные
+        нажатия двух тренеров не отменяют друг друга.
+        """
+        chat_id = rosters.document_id(chat_id)
         try:
-            data = self._load_user_data(chat_id)
-            subscription = data[category][sub_index]
-            
+            subscription = self.get_subscription(chat_id, sub_id)
+            if subscription is None:
+                return False
             # Если занятие уже отмечено, снимаем отметку
-            if str(lesson_num) in subscription['used_lessons']:
-                del subscription['used_lessons'][str(lesson_num)]
-            else:
-                # Проверяем, не превышено ли количество занятий
-                if len(subscription['used_lessons']) >= subscription['total_lessons']:
+            unmark = subscription.used_lessons.is_used(lesson_num)
+            today = date.today()
+            
+            def change(data: Document) -> bool:
+                located = self._located(chat_id, sub_id, data)
+                if located is None:
                     return False
-                
-                # Отмечаем занятие
-                subscription['used_lessons'][str(lesson_num)] = datetime.now().strftime('%d.%m')
+                used_lessons = located[1].used_lessons
+                if unmark:
+                    # При повторе отметку мог уже снять другой тренер
+                    if used_lessons.is_used(lesson_num):
+                        used_lessons.unmark(lesson_num)
+                elif not used_lessons.is_used(lesson_num):
+                    # Проверяем, не превышено ли количество занятий
+                    if located[1].is_finished:
+                        return False
+                    # Отмечаем занятие
+                    used_lessons.mark(lesson_num, today)
+                return True
             
-            return self._save_user_data(chat_id, data)
+            return self._mutate(chat_id, change)
         except Exception:
             return False
     
-    def delete_subscription(self, chat_id: int, category: str, sub_index: int) -> bool:
+    def mark_class(self, chat_id: int, sub_ids: List[str],
+                   day: Optional[date] = None) -> Optional[Dict[str, Optional[int]]]:
+        """Отметка занятия группы: следующий свободный день у каждого абонемента
+
+        Все отметки - одно изменение документа и одна запись. Возвращает
+        {id абонемента: номер отмеченного дня или None, если свободных дней
+        нет или абонемент удален}; None - если записать не удалось.
+        """
+        chat_id = rosters.document_id(chat_id)
+        day = day or date.today()
+        slots: Dict[str, Optional[int]] = {}
+        
+        def change(data: Document) -> bool:
+            for sub_id in sub_ids:
+                located = self._located(chat_id, sub_id, data)
+                if located is None:
+                    slots.setdefault(sub_id, None)
+                    continue
+                used_lessons = located[1].used_lessons
+                if sub_id not in slots:
+                    # День выбирается один раз: при повторе после конфликта
+                    # версий отмечается тот же день, а не следующий
+                    slots[sub_id] = used_lessons.next_free(located[1].total_lessons)
+                lesson_num = slots[sub_id]
+                if lesson_num is not None and not used_lessons.is_used(lesson_num):
+                    used_lessons.mark(lesson_num, day)
+            return any(lesson_num is not None for lesson_num in slots.values())
+        
+        try:
+            if self._mutate(chat_id, change):
+                return slots
+            # Отмечать было нечего - это не ошибка записи
+            return slots if not any(lesson_num is not None for lesson_num in slots.values()) else None
+        except Exception as e:
+            logger.error(f"Ошибка при отметке занятия группы: {e}, chat_id={chat_id}")
+            return None
+    
+    def delete_subscription(self, chat_id: int, sub_id: str) -> bool:
         """Удаление абонемента"""
+        chat_id = rosters.document_id(chat_id)
+        
+        def change(data: Document) -> bool:
+            located = self._located(chat_id, sub_id, data)
+            if located is None:
+                return False
+            category, subscription = located
+            data[category] = [sub for sub in data[category] if sub is not subscription]
+            return True
+        
         try:
-            data = self._load_user_data(chat_id)
-            if category in data and 0 <= sub_index < len(data[category]):
-                data[category].pop(sub_index)
-                return self._save_user_data(chat_id, data)
+            self._load_user_data(chat_id)
+            if self._located(chat_id, sub_id) is None:
+                return False
+            # Из индекса поиска абонемент убирается только после записи документа
+            if not self._mutate(chat_id, change):
+                return False
+            self._update_search(chat_id, removed=[sub_id])
+            return True
         except Exception:
             pass
         return False
     
-    def save_subscriptions(self, chat_id: int, category: str, subscriptions: List[Dict[str, Any]]) -> bool:
-        """Сохранение списка абонементов"""
+    def save_subscriptions(self, chat_id: int, category: str, subscriptions: List[Subscription]) -> bool:
+        """Сохранение списка абонементов
+
+        Список категории заменяется целиком, в том числе при повторе после
+        конфликта версий: для точечных изменений общих списков есть
+        add_subscription, mark_lesson и delete_subscription.
+        """
+        chat_id = rosters.document_id(chat_id)
         try:
-            data = self._load_user_data(chat_id)
-            data[category] = subscriptions
-            return self._save_user_data(chat_id, data)
+            # Принимаются и объекты, и словари старого формата
+            subscriptions = [Subscription.coerce(sub) for sub in subscriptions]
+            previous: List[str] = []
+            
+            def change(data: Document) -> None:
+                # Замененный список - тот, что был в документе в момент записи
+                previous[:] = [sub.id for sub in data.get(category, [])]
+                data[category] = subscriptions
+            
+            success = self._mutate(chat_id, change)
+            if success:
+                # Id новым абонементам присваиваются при сохранении
+                current = [sub for sub in subscriptions if sub.id]
+                current_ids = {sub.id for sub in current}
+                self._update_search(
+                    chat_id, updated=current, removed=[sub_id for sub_id in previous if sub_id not in current_ids]
+                )
+            return success
         except Exception as e:
             logger.error(f"Ошибка при сохранении абонементов: {e}")
-            return False 
\ No newline at end of file
+            return False
+    
+    def _archived(self, chat_id: int) -> List[ArchivedSubscription]:
+        """Архив документа без абонементов, которые есть и в документе (сбой при переносе)"""
+        self._load_user_data(chat_id)
+        with self._cache_lock:
+            present = {identity(sub) for _, sub in self._index.get(chat_id, {}).values()}
+        archived = read_archive(self.storage, chat_id)
+        return [entry for entry in archived if identity(entry[1]) not in present]
+    
+    def _archive_subscriptions(self, chat_id: int, sub_ids: List[str],
+                               predicate: Optional[Callable[[Subscription], bool]] = None) -> int:
+        """Перенос абонементов документа `chat_id` в архив; возвращает число перенесенных"""
+        self._load_user_data(chat_id)
+        moving = [
+            located for located in (self._located(chat_id, sub_id) for sub_id in sub_ids)
+            if located is not None and (predicate is None or predicate(located[1]))
+        ]
+        if not moving:
+            return 0
+        keys = {identity(sub) for _, sub in moving}
+        archived_at = datetime.now().isoformat(timespec='seconds')
+        
+        def add(archived: List[ArchivedSubscription]) -> None:
+            archived[:] = [entry for entry in archived if identity(entry[1]) not in keys]
+            archived.extend((category, sub, archived_at) for category, sub in moving)
+        
+        # Сначала архив: пока он не записан, документ чата не меняется.
+        # Отметки кодируются атомарно относительно изменений документа: блокировка
+        # изменений берется под блокировкой архива, как при записи документа
+        update_archive(self.storage, chat_id, add, guard=self._mutation_lock(chat_id))
+        
+        removed: List[str] = []
+        
+        def change(data: Document) -> bool:
+            # При повторе после конфликта версий список собирается заново
+            removed.clear()
+            for _, sub in moving:
+                located = self._located(chat_id, sub.id, data)
+                if located is None or identity(located[1]) != identity(sub):
+                    continue
+                data[located[0]] = [other for other in data[located[0]] if other is not located[1]]
+                removed.append(sub.id)
+            return bool(removed)
+        
+        # Индекс поиска меняется только после записи документа
+        if not self._mutate(chat_id, change):
+            return 0
+        self._update_search(chat_id, removed=removed)
+        metrics.increment('archive.archived', len(moving))
+        logger.info(f"В архив перенесено абонементов: {len(moving)}, chat_id={chat_id}")
+        return len(moving)
+    
+    def archive_subscriptions(self, chat_id: int, sub_ids: List[str]) -> int:
+        """Перенос абонементов в архив чата"""
+        chat_id = rosters.document_id(chat_id)
+        try:
+            return self._archive_subscriptions(chat_id, sub_ids)
+        except Exception as e:
+            logger.error(f"Ошибка при переносе абонементов в архив: {e}, chat_id={chat_id}")
+            return 0
+    
+    def archive_idle(self, today: Optional[date] = None, owns: Optional[Callable[[int], bool]] = None) -> int:
+        """Перенос в архив закончившихся и брошенных абонементов всех чатов
+        
+        Документы просматриваются мимо кэша; в кэш попадают только чаты,
+        в которых есть что переносить. Документы участников общих списков
+        обрабатываются как есть, без перехода к документу владельца.
+        `owns` ограничивает проход своими чатами (процесс-обработчик
+        архивирует только свой шард).
+        """
+        today = today or date.today()
+        
+        def archivable(sub: Subscription) -> bool:
+            return is_archivable(sub, today)
+        
+        archived = 0
+        for chat_id in list(self.storage.chat_ids()):
+            if chat_id <= 0 or (owns is not None and not owns(chat_id)):
+                continue
+            try:
+                document = self._read_document(chat_id)
+                if document is None:
+                    continue
+                candidates = [sub.id for _, sub in self._iter_subscriptions(document) if sub.id and archivable(sub)]
+                if candidates:
+                    archived += self._archive_subscriptions(chat_id, candidates, archivable)
+            except Exception as e:
+                logger.error(f"Ошибка при архивации абонементов: {e}, chat_id={chat_id}")
+        logger.info(f"Архивация завершена: перенесено абонементов={archived}")
+        return archived
+    
+    def get_archived(self, chat_id: int, category: Optional[str] = None) -> List[ArchivedSubscription]:
+        """Абонементы архива чата (последние перенесенные - первыми)"""
+        chat_id = rosters.document_id(chat_id)
+        try:
+            archived = self._archived(chat_id)
+        except Exception as e:
+            logger.error(f"Ошибка при чтении архива: {e}, chat_id={chat_id}")
+            return []
+        return [entry for entry in reversed(archived) if category is None or entry[0] == category]
+    
+    def restore_subscription(self, chat_id: int, sub_id: str) -> Optional[str]:
+        """Возврат абонемента из архива; возвращает его категорию или None
+        
+        Из архива абонемент удаляется только после записи документа чата
+        (внутри единицы работы - следующей записью в конце обновления).
+        """
+        chat_id = rosters.document_id(chat_id)
+        try:
+            entry = next((entry for entry in reversed(self._archived(chat_id)) if entry[1].id == sub_id), None)
+            if entry is None:
+                return None
+            category, subscription, _ = entry
+            key = identity(subscription)
+            data = self._load_user_data(chat_id)
+            present = []
+            
+            def change(data: Document) -> bool:
+                if any(identity(sub) == key for _, sub in self._iter_subscriptions(data)):
+                    present[:] = [True]
+                    return False
+                # Пока абонемент был в архиве, его id мог получить новый абонемент
+                if self._located(chat_id, subscription.id, data) is not None:
+                    subscription.id = self._new_id({sub.id for _, sub in self._iter_subscriptions(data)})
+                data.setdefault(category, []).append(subscription)
+                return True
+            
+            if not self._mutate(chat_id, change) and not present:
+                return None
+            self._update_search(chat_id, updated=[subscription])
+            
+            def remove() -> bool:
+                # Изменение осталось в журнале - документ чата не записан
+                if change in data.changes:
+                    return False
+                
+                def drop(archived: List[ArchivedSubscription]) -> None:
+                    archived[:] = [entry for entry in archived if identity(entry[1]) != key]
+                
+                update_archive(self.storage, chat_id, drop)
+                return True
+            
+            uow = current_unit_of_work()
+            if uow is not None:
+                uow.defer_save(('archive', chat_id), None, remove)
+            elif not remove():
+                return None
+            metrics.increment('archive.restored')
+            return category
+        except Exception as e:
+            logger.error(f"Ошибка при восстановлении абонемента из архива: {e}, chat_id={chat_id}")
+            return None
+    
+    def search_subscriptions(self, chat_id: int, query: str, limit: int = 50) -> List[Tuple[str, Subscription]]:
+        """Поиск абонементов чата по названию: [(категория, абонемент)]"""
+        chat_id = rosters.document_id(chat_id)
+        self._load_user_data(chat_id)
+        with self._cache_lock:
+            entries = self._index.get(chat_id, {})
+            index = self._search.get(chat_id)
+            if index is None:
+                index = self._search[chat_id] = SubscriptionSearchIndex.build(
+                    (sub_id, sub.name) for sub_id, (_, sub) in entries.items()
+                )
+            return [entries[sub_id] for sub_id in index.search(query, limit) if sub_id in entries] 
\ No newline at end of file
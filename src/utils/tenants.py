@@ -0,0 +1,73 @@
+"""
+Студии в одном процессе
+
+В режиме нескольких студий (config.TENANTS) у каждой свой бот, каталог
+данных, хранилище данных пользователей и реестр общих списков. Обработчики,
+модели и реестр обращаются к ним через объекты процесса (`rosters`,
+`UserDataManager.storage`), которые на время обработки обновления
+указывают на объекты студии этого обновления: диспетчер студии включает
+ее в потоке перед вызовом обработчиков (см. activate).
+
+Без включенной студии - в режиме одной студии, в фоновых задачах и
+утилитах - используются объекты по умолчанию из config.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+_local = threading.local()
+
+
+class Tenant:
+    """Студия: имя, токен бота и ее объекты данных"""
+
+    def __init__(self, name: str, token: str, data_dir: str, **resources: Any):
+        self.name = name
+        self.token = token
+        self.data_dir = data_dir
+        # Объекты студии, которые подставляет TenantLocal: rosters, user_storage
+        self.resources = resources
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.name!r}, data_dir={self.data_dir!r})"
+
+
+def current_tenant() -> Optional[Tenant]:
+    """Студия, включенная в текущем потоке"""
+    return getattr(_local, 'tenant', None)
+
+
+@contextmanager
+def activate(tenant: Optional[Tenant]) -> Iterator[None]:
+    """Включение студии в текущем потоке на время блока"""
+    previous = current_tenant()
+    _local.tenant = tenant
+    try:
+        yield
+    finally:
+        _local.tenant = previous
+
+
+class TenantLocal:
+    """Объект, свой у каждой студии
+
+    Обращения к атрибутам передаются объекту `resource` включенной студии,
+    а без студии (или если у нее такого объекта нет) - объекту `default`.
+    """
+
+    def __init__(self, resource: str, default: Any):
+        self._resource = resource
+        self._default = default
+
+    def resolve(self) -> Any:
+        tenant = current_tenant()
+        if tenant is None:
+            return self._default
+        return tenant.resources.get(self._resource, self._default)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.resolve(), name)
+
+    def __repr__(self) -> str:
+        return f"TenantLocal({self._resource!r}, {self.resolve()!r})"
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import CallbackContext, DispatcherHandlerStop
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Причины отбрасывания обновления
+THROTTLED = 'throttled'
+DEBOUNCED = 'debounced'
+
+# Как часто (в проверках) чистить состояние давно неактивных чатов
+_PURGE_EVERY = 1024
+
+
+class TokenBucket:
+    """Ведро токенов: `rate` токенов в секунду, не больше `burst` в запасе"""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Throttle:
+    """Ограничение частоты обновлений каждого чата
+
+    Ставится перед всеми обработчиками (TypeHandler в группе -1):
+    - повторное нажатие той же кнопки того же сообщения в течение
+      `debounce_window` секунд схлопывается с первым;
+    - сверх ведра токенов чата обновления отбрасываются.
+    На отброшенные нажатия отвечается только answerCallbackQuery, без
+    загрузки данных и редактирования сообщения.
+    """
+
+    def __init__(self, rate: float, burst: float, debounce_window: float):
+        self.rate = rate
+        self.burst = burst
+        self.debounce_window = debounce_window
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._last_presses: Dict[Tuple[int, Hashable, str], float] = {}
+        self._checks = 0
+
+    @staticmethod
+    def _chat_id(update: Update) -> Optional[int]:
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    def check(self, update: Update, now: Optional[float] = None) -> Optional[str]:
+        """Причина отбрасывания обновления или None, если его нужно обработать"""
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            return None
+        now = time.monotonic() if now is None else now
+        query = update.callback_query
+
+        with self._lock:
+            self._checks += 1
+            if self._checks % _PURGE_EVERY == 0:
+                self._purge(now)
+
+            if query is not None and self.debounce_window > 0:
+                message = query.message.message_id if query.message else query.inline_message_id
+                key = (chat_id, message, query.data)
+                last = self._last_presses.get(key)
+                self._last_presses[key] = now
+                if last is not None and now - last < self.debounce_window:
+                    return DEBOUNCED
+
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._buckets[chat_id] = TokenBucket(self.burst, now)
+            if not bucket.take(self.rate, self.burst, now):
+                return THROTTLED
+        return None
+
+    def _purge(self, now: float) -> None:
+        """Удаление состояния чатов, которые давно ничего не присылали"""
+        idle = self.burst / self.rate if self.rate > 0 else 0
+        self._buckets = {
+            chat_id: bucket for chat_id, bucket in self._buckets.items() if now - bucket.updated < idle
+        }
+        self._last_presses = {
+            key: pressed for key, pressed in self._last_presses.items() if now - pressed < self.debounce_window
+        }
+
+    def middleware(self, update: Update, context: CallbackContext) -> None:
+        """Обработчик группы -1: отбрасывает лишние обновления до остальных групп"""
+        if not isinstance(update, Update):
+            return
+        reason = self.check(update)
+        if reason is None:
+            return
+
+        metrics.increment(f'throttle.{reason}')
+        if update.callback_query:
+            try:
+                # Кнопка перестает "крутиться", но данные и сообщение не трогаем
+                update.callback_query.answer(
+                    "⏳ Слишком много нажатий, подождите немного" if reason == THROTTLED else None
+                )
+            except TelegramError as e:
+                logger.debug(f"Не удалось ответить на отброшенное нажатие: {e}")
+        raise DispatcherHandlerStop()
@@ -0,0 +1,288 @@
+"""
+Трассировка обработки обновлений и журнал медленных обновлений
+
+На каждое обновление открывается корневой спан, внутри него - дочерние:
+маршрутизация (все время вне обработчиков: проверки групп и фильтров),
+обработчик, загрузка и запись документов, отрисовка и каждый вызов Bot
+API. Спаны живут только в памяти потока; если обновление обрабатывалось дольше SLOW_UPDATE_THRESHOLD,
+дерево спанов пишется одной JSON-строкой в ротируемый журнал
+SLOW_LOG_FILE, иначе просто отбрасывается.
+
+Вне обновления (getUpdates, задачи JobQueue) `span` ничего не делает.
+Обработчики с run_async выполняются в другом потоке, поэтому в трассу
+попадает только постановка их в очередь.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from config import SLOW_LOG_BACKUPS, SLOW_LOG_FILE, SLOW_LOG_MAX_BYTES, SLOW_UPDATE_THRESHOLD
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Сколько байт с конца каждого журнала читает /slow
+_TAIL_BYTES = 256 * 1024
+
+
+class Span:
+    """Участок обработки обновления"""
+
+    __slots__ = ('name', 'started', 'duration', 'attrs', 'children')
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.attrs = attrs
+        self.children: List['Span'] = []
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            'name': self.name,
+            'at_ms': round((self.started - origin) * 1000, 3),
+            'ms': round(self.duration * 1000, 3),
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+class Trace:
+    """Трасса одного обновления: корневой спан и стек открытых спанов"""
+
+    __slots__ = ('root', 'stack')
+
+    def __init__(self, attrs: Dict[str, Any]):
+        self.root = Span('update', attrs)
+        self.stack = [self.root]
+
+
+class _SpanContext:
+    __slots__ = ('trace', 'span')
+
+    def __init__(self, trace: Trace, name: str, attrs: Optional[Dict[str, Any]]):
+        self.trace = trace
+        self.span = Span(name, attrs)
+
+    def __enter__(self) -> Span:
+        self.trace.stack[-1].children.append(self.span)
+        self.trace.stack.append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.span.duration = time.perf_counter() - self.span.started
+        if exc_type is not None:
+            self.span.attrs = dict(self.span.attrs or (), error=exc_type.__name__)
+        self.trace.stack.pop()
+
+
+class _NoSpan:
+    """Спан вне трассы: ничего не измеряет"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+def span(name: str, **attrs):
+    """Дочерний спан текущего обновления: `with span('storage.load', doc=...)`"""
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NO_SPAN
+    return _SpanContext(trace, name, attrs or None)
+
+
+def traced(name: str):
+    """Декоратор: вызов функции - отдельный спан"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _describe(update) -> Dict[str, Any]:
+    """Что это за обновление - без текстов сообщений и имен"""
+    attrs: Dict[str, Any] = {'update_id': update.update_id}
+    chat = update.effective_chat or update.effective_user
+    if chat is not None:
+        attrs['chat_id'] = chat.id
+    if update.callback_query:
+        attrs['kind'] = 'callback'
+        attrs['data'] = update.callback_query.data
+    elif update.inline_query:
+        attrs['kind'] = 'inline_query'
+    elif update.message:
+        attrs['kind'] = 'message'
+        text = update.message.text or ''
+        if text.startswith('/'):
+            attrs['command'] = text.split()[0]
+    return attrs
+
+
+class SlowLog:
+    """Ротируемый журнал медленных обновлений (JSON по строке на обновление)"""
+
+    def __init__(self, path: str = SLOW_LOG_FILE, threshold: float = SLOW_UPDATE_THRESHOLD,
+                 max_bytes: int = SLOW_LOG_MAX_BYTES, backups: int = SLOW_LOG_BACKUPS):
+        # Журналы всех процессов лежат рядом: {base}.log, {base}.worker1.log...
+        self.base_path = path
+        self.path = path
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._logger: Optional[logging.Logger] = None
+
+    def configure(self, suffix: str) -> None:
+        """Отдельный файл для процесса-обработчика: ротация не делится между процессами"""
+        root, ext = os.path.splitext(self.base_path)
+        self.path = f"{root}.{suffix}{ext}"
+
+    def _get_logger(self) -> logging.Logger:
+        # Файл создается только при первом медленном обновлении
+        with self._lock:
+            if self._logger is None:
+                os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+                handler = RotatingFileHandler(
+                    self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding='utf-8'
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                slow_logger = logging.getLogger(f'slow_updates.{self.path}')
+                slow_logger.setLevel(logging.INFO)
+                slow_logger.propagate = False
+                slow_logger.addHandler(handler)
+                self._logger = slow_logger
+            return self._logger
+
+    def record(self, trace: Trace) -> None:
+        root = trace.root
+        entry = {
+            'ts': datetime.now().isoformat(timespec='milliseconds'),
+            'pid': os.getpid(),
+            'ms': round(root.duration * 1000, 3),
+            'trace': root.to_dict(root.started),
+        }
+        try:
+            self._get_logger().info(json.dumps(entry, ensure_ascii=False, default=str))
+        except OSError as e:
+            logger.error(f"Не удалось записать медленное обновление: {e}")
+
+    def latest(self, limit: int = 5) -> List[Dict[str, Any]]:
+        """Последние медленные обновления всех процессов (по текущим файлам журнала)"""
+        root, ext = os.path.splitext(self.base_path)
+        entries = []
+        for path in set(glob.glob(f"{root}*{ext}")) | {self.path}:
+            try:
+                with open(path, 'rb') as file:
+                    file.seek(0, os.SEEK_END)
+                    file.seek(max(0, file.tell() - _TAIL_BYTES))
+                    lines = file.read().splitlines()
+            except FileNotFoundError:
+                continue
+            for line in lines[-limit:]:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Первая строка хвоста может быть обрезана
+                    continue
+        entries.sort(key=lambda entry: entry.get('ts', ''))
+        return entries[-limit:]
+
+
+slow_log = SlowLog()
+
+
+def finish(trace: Trace) -> None:
+    """Закрытие трассы: спан маршрутизации, метрика и журнал медленных"""
+    root = trace.root
+    root.duration = time.perf_counter() - root.started
+    # Проверки обработчиков не оборачиваются по отдельности (их десятки на
+    # обновление): маршрутизация - это все время корня вне обработчиков
+    routing = Span('routing')
+    routing.started = root.started
+    routing.duration = max(0.0, root.duration - sum(child.duration for child in root.children))
+    root.children.insert(0, routing)
+    if root.duration >= slow_log.threshold:
+        metrics.increment('trace.slow_updates')
+        slow_log.record(trace)
+
+
+def instrument_dispatcher(dispatcher) -> None:
+    """Трассировка обновлений диспетчера
+
+    Вызывается после регистрации всех обработчиков: обертки ставятся на
+    process_update и на handle_update каждого обработчика.
+    """
+    process_update = dispatcher.process_update
+
+    def traced_process_update(update):
+        if getattr(update, 'update_id', None) is None or current_trace() is not None:
+            return process_update(update)
+        trace = _local.trace = Trace(_describe(update))
+        try:
+            return process_update(update)
+        finally:
+            _local.trace = None
+            finish(trace)
+
+    dispatcher.process_update = traced_process_update
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+
+def _instrument_handler(handler) -> None:
+    handle_update = handler.handle_update
+    callback = getattr(handler, 'callback', None)
+    name = getattr(callback, '__qualname__', None) or type(handler).__name__
+
+    def traced_handle_update(*args, **kwargs):
+        with span('handler', callback=name):
+            return handle_update(*args, **kwargs)
+
+    handler.handle_update = traced_handle_update
+
+
+def format_trace(entry: Dict[str, Any]) -> str:
+    """Текстовое дерево спанов для администратора"""
+    root = entry['trace']
+    attrs = root.get('attrs', {})
+    title = attrs.get('data') or attrs.get('command') or attrs.get('kind', 'update')
+    lines = [f"🐢 {entry.get('ts', '')} - {entry['ms']:.0f} мс, {title} (чат {attrs.get('chat_id', '-')})"]
+
+    def walk(node: Dict[str, Any], depth: int) -> None:
+        for child in node.get('children', ()):
+            details = child.get('attrs') or {}
+            suffix = ', '.join(f"{key}={value}" for key, value in details.items())
+            lines.append(f"{'  ' * depth}{child['name']} {child['ms']:.1f} мс" + (f" ({suffix})" if suffix else ''))
+            walk(child, depth + 1)
+
+    walk(root, 1)
+    return '\n'.join(lines)
@@ -0,0 +1,124 @@
+import logging
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from config import STORAGE_IO_DEBUG
+from utils.durability import group_committer
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class UnitOfWork:
+    """Единица работы одного обновления
+    
+    Документы загружаются из хранилища один раз за обновление, а запись
+    откладывается до выхода из обработчика: сколько бы раз обработчик ни
+    сохранял документ, на диск он попадет не более одного раза.
+    """
+    
+    def __init__(self, chat_id: Optional[int] = None):
+        self.chat_id = chat_id
+        self._documents: Dict[Hashable, Any] = {}
+        self._pending: 'OrderedDict[Hashable, Callable[[], bool]]' = OrderedDict()
+        # Вызываются после записи, когда документы обновления больше не нужны
+        self._on_close: List[Callable[[], None]] = []
+        # Счетчики реального ввода-вывода по документам
+        self.loads: Counter = Counter()
+        self.saves: Counter = Counter()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Документ, уже загруженный в рамках обновления"""
+        return self._documents.get(key)
+    
+    def loaded(self, key: Hashable, document: Any) -> None:
+        """Регистрация загруженного из хранилища документа"""
+        self.loads[key] += 1
+        self._documents[key] = document
+    
+    def defer_save(self, key: Hashable, document: Any, flush: Callable[[], bool]) -> None:
+        """Отложенная запись документа до конца обновления"""
+        self._documents[key] = document
+        # Повторное сохранение заменяет предыдущее, порядок первой записи сохраняется
+        self._pending[key] = flush
+    
+    def on_close(self, callback: Callable[[], None]) -> None:
+        """Действие при закрытии единицы работы (например, открепление документа в кэше)"""
+        self._on_close.append(callback)
+    
+    def close(self) -> None:
+        """Закрытие после записи: документы обновления отпускаются"""
+        callbacks, self._on_close = self._on_close, []
+        for callback in callbacks:
+            callback()
+    
+    def commit(self) -> bool:
+        """Запись всех измененных документов"""
+        success = True
+        if not self._pending:
+            self.check_budget()
+            return success
+        # Документы одного обновления попадают в снимок данных вместе
+        with group_committer.barrier.write():
+            while self._pending:
+                key, flush = self._pending.popitem(last=False)
+                self.saves[key] += 1
+                with span('storage.save', doc=key):
+                    ok = flush()
+                if not ok:
+                    logger.error(f"Не удалось записать документ {key} в конце обновления")
+                    success = False
+        self.check_budget()
+        return success
+    
+    def check_budget(self) -> None:
+        """Проверка бюджета ввода-вывода: одна загрузка и одна запись на документ"""
+        if not STORAGE_IO_DEBUG:
+            return
+        logger.debug(f"Ввод-вывод обновления chat_id={self.chat_id}: загрузки={dict(self.loads)}, записи={dict(self.saves)}")
+        over_budget = [key for key in set(self.loads) | set(self.saves)
+                       if self.loads[key] > 1 or self.saves[key] > 1]
+        assert not over_budget, f"Превышен бюджет ввода-вывода для {over_budget}"
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    """Активная единица работы текущего потока"""
+    return getattr(_local, 'unit_of_work', None)
+
+
+@contextmanager
+def unit_of_work(chat_id: Optional[int] = None):
+    """Открытие единицы работы; вложенные вызовы присоединяются к внешней"""
+    outer = current_unit_of_work()
+    if outer is not None:
+        yield outer
+        return
+    
+    uow = UnitOfWork(chat_id)
+    _local.unit_of_work = uow
+    try:
+        yield uow
+    finally:
+        _local.unit_of_work = None
+        # Записываем изменения даже если обработчик упал после сохранения
+        try:
+            uow.commit()
+        finally:
+            uow.close()
+
+
+def transactional(func: Callable) -> Callable:
+    """Декоратор обработчика: одна загрузка и не более одной записи на обновление"""
+    @wraps(func)
+    def wrapper(self, update, context, *args, **kwargs):
+        chat = getattr(update, 'effective_chat', None)
+        user = getattr(update, 'effective_user', None)
+        chat_id = chat.id if chat else (user.id if user else None)
+        with unit_of_work(chat_id):
+            return func(self, update, context, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,186 @@
+"""
+Канал управления процессами-обработчиками
+
+В многопроцессном режиме (workers.WorkerPool) у каждого процесса свой
+барьер записи и свой учет замененных файлов (utils.durability). Чтобы
+снимок данных оставался согласованным на один момент, основной процесс
+по каналу управления включает учет изменений во всех процессах, берет
+их исключительные барьеры и собирает замененные файлы - так же, как
+utils.snapshots делает это в одном процессе.
+
+Команды: track - начать учет замененных файлов, pause - дождаться
+начатых записей и задержать новые, take - замененные файлы, resume -
+снять паузу. Если основной процесс пропал, пауза снимается.
+
+В обратную сторону процессы сообщают update_id обработанных обновлений
+(очередь WorkerControl.processed): основной процесс сохраняет смещение
+polling только до первого еще не обработанного обновления (UpdateTracker),
+поэтому обновления, оставшиеся в очереди упавшего или остановленного
+процесса, после перезапуска будут получены снова.
+"""
+
+import logging
+import multiprocessing
+import threading
+from contextlib import contextmanager
+from multiprocessing.connection import Connection
+from typing import Any, List, Optional, Set
+
+from utils.durability import GroupCommitter, group_committer
+
+logger = logging.getLogger(__name__)
+
+
+def serve_control(connection: Connection, committer: GroupCommitter = group_committer) -> None:
+    """Обработка команд основного процесса (поток процесса-обработчика)"""
+    paused = None
+    while True:
+        try:
+            command = connection.recv()
+        except (EOFError, OSError):
+            break
+        reply: Any = True
+        if command == 'track':
+            committer.track_changes()
+        elif command == 'pause' and paused is None:
+            paused = committer.barrier.exclusive()
+            paused.__enter__()
+        elif command == 'take':
+            reply = sorted(committer.take_changes())
+        elif command == 'resume' and paused is not None:
+            paused.__exit__(None, None, None)
+            paused = None
+        connection.send(reply)
+    if paused is not None:
+        logger.error("Основной процесс пропал во время снимка, пауза записей снята")
+        paused.__exit__(None, None, None)
+
+
+class WorkerControl:
+    """Каналы управления от основного процесса к процессам-обработчикам"""
+
+    def __init__(self, processes: int):
+        channels = [multiprocessing.Pipe() for _ in range(processes)]
+        self.connections: List[Connection] = [front for front, _ in channels]
+        self._worker_ends: List[Connection] = [worker for _, worker in channels]
+        self._lock = threading.Lock()
+        # update_id обработанных обновлений от всех процессов (см. UpdateTracker)
+        self.processed: multiprocessing.Queue = multiprocessing.Queue()
+
+    def worker_end(self, index: int) -> Connection:
+        """Конец канала, который передается процессу `index` при запуске"""
+        return self._worker_ends[index]
+
+    def started(self) -> None:
+        """Процессы запущены: свои копии их концов закрываем, тогда смерть процесса видна как EOF"""
+        for connection in self._worker_ends:
+            connection.close()
+
+    def control(self, command: str) -> List[Any]:
+        """Команда всем процессам; ответы в порядке процессов
+
+        Команда отправляется каждому живому процессу, даже если другой не
+        ответил: иначе пауза одного процесса могла бы остаться неснятой.
+        """
+        with self._lock:
+            errors = []
+            sent = []
+            for connection in self.connections:
+                try:
+                    connection.send(command)
+                    sent.append(connection)
+                except (OSError, ValueError) as e:
+                    errors.append(e)
+            replies = []
+            for connection in sent:
+                try:
+                    replies.append(connection.recv())
+                except (EOFError, OSError) as e:
+                    errors.append(e)
+        if errors:
+            raise OSError(f"Процесс-обработчик не выполнил команду {command}: {errors[0]!r}")
+        return replies
+
+
+class PoolCommitter:
+    """Учет замененных файлов и барьер записи всех процессов для снимка данных
+
+    Подставляется в utils.snapshots.create_snapshot вместо group_committer:
+    исключительный барьер берется в основном процессе и во всех
+    процессах-обработчиках, а замененные файлы собираются со всех.
+    """
+
+    def __init__(self, channels: WorkerControl, committer: GroupCommitter = group_committer):
+        self.channels = channels
+        self.committer = committer
+        self.barrier = self
+
+    def track_changes(self) -> None:
+        self.committer.track_changes()
+        self.channels.control('track')
+
+    def take_changes(self) -> Set[str]:
+        changed = self.committer.take_changes()
+        for paths in self.channels.control('take'):
+            changed.update(paths)
+        return changed
+
+    @contextmanager
+    def exclusive(self):
+        with self.committer.barrier.exclusive():
+            try:
+                # Если какой-то процесс не ответил, остальные все равно снимают паузу
+                self.channels.control('pause')
+                yield
+            finally:
+                self.channels.control('resume')
+
+
+class UpdateTracker:
+    """Смещение polling в многопроцессном режиме
+
+    Обновление считается обработанным, когда процесс-обработчик сообщил о
+    нем, а не когда основной процесс положил его в очередь. Сохраняется
+    последний update_id, до которого обработано все: обновления после
+    первого необработанного после перезапуска повторятся, но ни одно не
+    потеряется.
+    """
+
+    def __init__(self, store):
+        # utils.polling.OffsetStore или другой объект с mark_processed(update_id)
+        self.store = store
+        self._lock = threading.Lock()
+        self._pending: Set[int] = set()
+        self._highest: Optional[int] = None
+
+    def dispatched(self, update_id: int) -> None:
+        """Обновление передано процессу-обработчику"""
+        with self._lock:
+            self._pending.add(update_id)
+            if self._highest is None or update_id > self._highest:
+                self._highest = update_id
+
+    def processed(self, update_id: int) -> None:
+        """Обновление обработано (процессом-обработчиком или основным процессом)"""
+        with self._lock:
+            self._pending.discard(update_id)
+            if self._highest is None or update_id > self._highest:
+                self._highest = update_id
+            done = min(self._pending) - 1 if self._pending else self._highest
+        try:
+            self.store.mark_processed(done)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить смещение: {e}")
+
+    def pending(self) -> int:
+        """Обновлений в очередях процессов"""
+        with self._lock:
+            return len(self._pending)
+
+    def follow(self, processed: multiprocessing.Queue) -> None:
+        """Прием сообщений процессов об обработанных обновлениях (поток основного процесса)"""
+        while True:
+            update_id = processed.get()
+            if update_id is None:
+                break
+            self.processed(update_id)
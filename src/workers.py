@@ -0,0 +1,168 @@
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import List, Optional
+
+from telegram import Bot, Update
+from telegram.ext import CallbackContext, Dispatcher
+
+from config import ARCHIVE_INTERVAL, BOT_TOKEN, WORKER_QUEUE_SIZE
+from utils.http import build_request
+from utils.rosters import rosters
+from utils.sharding import worker_for
+from utils.worker_control import PoolCommitter, UpdateTracker, WorkerControl, serve_control
+from utils.tracing import slow_log
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: Update) -> Optional[int]:
+    """chat_id, по которому обновление закрепляется за процессом
+
+    Участник общего списка работает с документом владельца, поэтому его
+    обновления обрабатывает процесс владельца: у документа один процесс.
+    """
+    if update.effective_chat:
+        chat_id = update.effective_chat.id
+    elif update.effective_user:
+        chat_id = update.effective_user.id
+    else:
+        return None
+    return rosters.document_id(chat_id)
+
+
+def _archive_shard(manager, owns) -> None:
+    """Периодическая архивация чатов своего шарда
+
+    Архивирует процесс, владеющий чатами: его кэш и индексы сразу видят
+    перенос, а записи не пересекаются с другими процессами.
+    """
+    # Первый проход вскоре после запуска: бот может перезапускаться чаще ARCHIVE_INTERVAL
+    delay = 60
+    while True:
+        time.sleep(delay)
+        delay = ARCHIVE_INTERVAL
+        try:
+            manager.archive_idle(owns=owns)
+        except Exception as e:
+            logger.error(f"Ошибка при архивации абонементов: {e}")
+
+
+def _worker_main(index: int, processes: int, token: str, updates: multiprocessing.Queue,
+                 control: Connection, processed: multiprocessing.Queue) -> None:
+    """Точка входа процесса-обработчика"""
+    # Импорт здесь, чтобы не было циклического импорта с bot.py
+    from bot import DanceBot
+
+    slow_log.configure(f'worker{index}')
+    bot = Bot(token, request=build_request(1))
+    dispatcher = Dispatcher(bot, queue.Queue(), workers=1, use_context=True)
+    dance_bot = DanceBot(dispatcher=dispatcher)
+    manager = dance_bot.subscription_manager
+    manager.owns = lambda chat_id: worker_for(chat_id, processes) == index
+    threading.Thread(target=serve_control, args=(control,), name='control', daemon=True).start()
+    if ARCHIVE_INTERVAL > 0:
+        threading.Thread(target=_archive_shard, args=(manager, manager.owns), name='archive', daemon=True).start()
+    logger.info(f"Процесс-обработчик {index} запущен")
+
+    while True:
+        payload = updates.get()
+        if payload is None:
+            break
+        data = json.loads(payload)
+        try:
+            # Обрабатываем последовательно: порядок обновлений чата сохраняется
+            dispatcher.process_update(Update.de_json(data, bot))
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления в процессе {index}: {e}")
+        finally:
+            # Обработанным считается и обновление, обработчик которого упал:
+            # повтор после перезапуска упал бы так же
+            processed.put(data['update_id'])
+
+    logger.info(f"Процесс-обработчик {index} остановлен")
+
+
+class WorkerPool:
+    """Процессы-обработчики, шардированные по документу чата (rosters.document_id)
+
+    Основной процесс только получает обновления и раскладывает их по
+    очередям процессов; каждый процесс запускает свой Dispatcher с теми же
+    обработчиками, обслуживает и архивирует только свои чаты. По каналу
+    управления основной процесс приостанавливает записи процессов на время
+    снимка данных (см. utils.worker_control). Смещение polling сохраняется
+    по сообщениям процессов об обработанных обновлениях (track).
+    """
+
+    def __init__(self, processes: int, token: str = BOT_TOKEN):
+        if processes < 1:
+            raise ValueError("Число процессов должно быть положительным")
+        self.token = token
+        self.queues: List[multiprocessing.Queue] = [
+            multiprocessing.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(processes)
+        ]
+        self.channels = WorkerControl(processes)
+        self.committer = PoolCommitter(self.channels)
+        self.processes = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(i, processes, token, q, self.channels.worker_end(i), self.channels.processed),
+                name=f'bot-worker-{i}', daemon=True
+            )
+            for i, q in enumerate(self.queues)
+        ]
+        self.tracker: Optional[UpdateTracker] = None
+        self._follower: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        for process in self.processes:
+            process.start()
+        self.channels.started()
+        logger.info(f"Запущено процессов-обработчиков: {len(self.processes)}")
+
+    def track(self, store) -> UpdateTracker:
+        """Сохранение в `store` (OffsetStore) смещения по обработанным процессами обновлениям"""
+        self.tracker = UpdateTracker(store)
+        self._follower = threading.Thread(
+            target=self.tracker.follow, args=(self.channels.processed,), name='processed-updates', daemon=True
+        )
+        self._follower.start()
+        return self.tracker
+
+    def dispatch(self, update: Update) -> None:
+        """Передача обновления процессу, владеющему чатом"""
+        index = worker_for(update_chat_id(update), len(self.queues))
+        if self.tracker is not None:
+            self.tracker.dispatched(update.update_id)
+        self.queues[index].put(update.to_json())
+
+    def forward(self, update: Update, context: CallbackContext) -> None:
+        """Обработчик основного процесса: пересылка обновления"""
+        self.dispatch(update)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Остановка процессов
+
+        Не успевшие обработаться за `timeout` обновления теряются только в
+        этом запуске: смещение до них не сохранено, и после перезапуска
+        Telegram отдаст их снова.
+        """
+        for q in self.queues:
+            q.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._follower is not None:
+            # Сообщения об обработке, отправленные до остановки, учитываются
+            self.channels.processed.put(None)
+            self._follower.join(timeout)
+            if self.tracker.pending():
+                logger.warning(f"Не обработано обновлений: {self.tracker.pending()}, "
+                               f"они будут получены после перезапуска")
+        logger.info("Процессы-обработчики остановлены")
+
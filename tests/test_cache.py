@@ -0,0 +1,103 @@
+import threading
+from types import SimpleNamespace
+
+from utils.cache import ENTRY_OVERHEAD, DocumentCache
+from utils.storage import MemoryStorage
+from utils.subscription_manager import SubscriptionManager
+from utils.unit_of_work import unit_of_work
+
+KB = 1024
+
+
+def document(changes=()):
+    return SimpleNamespace(changes=list(changes))
+
+
+def test_cache_is_bounded_by_bytes_not_documents():
+    cache = DocumentCache(capacity=12 * KB)
+    partition = cache.partition('studio')
+    for key in range(3):
+        partition.put(key, document(), 3 * KB)
+    assert len(partition) == 3
+
+    # Один большой документ вытесняет давние маленькие, а не один самый давний
+    partition.put('big', document(), 6 * KB)
+    assert list(partition._entries) == [2, 'big']
+    assert cache.size == partition.size == 9 * KB + 2 * ENTRY_OVERHEAD
+
+
+def test_growing_document_evicts_others():
+    cache = DocumentCache(capacity=10 * KB)
+    partition = cache.partition('studio')
+    partition.put('a', document(), 4 * KB)
+    partition.put('b', document(), 4 * KB)
+    partition.grow('b', 3 * KB)
+    assert 'a' not in partition
+    partition.resize('b', KB)
+    assert partition.size == KB + ENTRY_OVERHEAD
+
+
+def test_eviction_takes_from_the_largest_partition_and_keeps_unsaved_documents():
+    cache = DocumentCache(capacity=10 * KB)
+    quiet, busy = cache.partition('quiet'), cache.partition('busy')
+    quiet.put('q', document(), 2 * KB)
+    busy.put('unsaved', document(changes=[object()]), 3 * KB)
+    for key in range(4):
+        busy.put(key, document(), 2 * KB)
+    assert 'q' in quiet and 'unsaved' in busy
+    assert cache.size <= cache.capacity
+    assert cache.usage() == {'quiet': (1, quiet.size), 'busy': (len(busy), busy.size)}
+
+
+def test_manager_estimates_documents_by_their_files():
+    storage = MemoryStorage()
+    cache = DocumentCache(capacity=0)
+    manager = SubscriptionManager(storage=storage, cache=cache)
+    manager.add_subscription(1, 'group', 'Иван Петров', 8)
+    sub = manager.get_subscriptions(1, 'group')[0]
+    manager.mark_lesson(1, sub.id, 1)
+
+    stored = sum(len(raw) for (chat_id, _), raw in storage._documents.items() if chat_id == 1)
+    assert cache.size == stored + ENTRY_OVERHEAD
+
+    # Холодное чтение: сначала индекс, отметки добавляются при загрузке
+    cold_cache = DocumentCache(capacity=0)
+    cold = SubscriptionManager(storage=storage, cache=cold_cache)
+    assert cold.get_subscriptions(1, 'group')[0].used_count == 1
+    assert cold_cache.size < stored + ENTRY_OVERHEAD
+    assert cold.get_subscriptions(1, 'group')[0].used_lessons.is_used(1)
+    assert cold_cache.size == stored + ENTRY_OVERHEAD
+
+
+def test_documents_of_a_unit_of_work_are_not_evicted():
+    storage = MemoryStorage()
+    cache = DocumentCache(capacity=3000)
+    manager = SubscriptionManager(storage=storage, cache=cache)
+    assert manager.add_subscription(1, 'group', 'Иван Петров', 8)
+    sub_id = manager.get_subscriptions(1, 'group')[0].id
+
+    with unit_of_work(1):
+        loaded = manager.get_subscriptions(1, 'group')
+        # Другой поток тем временем заполняет кэш своими чатами
+        writer = threading.Thread(target=lambda: [
+            manager.add_subscription(chat_id, 'group', 'Ученица ' * 20, 8) for chat_id in range(2, 12)
+        ])
+        writer.start()
+        writer.join()
+        assert 1 in manager._cache
+        assert manager.mark_lesson(1, sub_id, 1)
+        assert manager.get_subscriptions(1, 'group') is loaded
+
+    assert cache.size <= cache.capacity
+    fresh = SubscriptionManager(storage=storage, cache=DocumentCache(capacity=0))
+    assert fresh.get_subscriptions(1, 'group')[0].used_count == 1
+
+
+def test_lookup_rebuilds_the_index_of_an_evicted_document():
+    manager = SubscriptionManager(storage=MemoryStorage(), cache=DocumentCache(capacity=0))
+    assert manager.add_subscription(1, 'group', 'Иван Петров', 8)
+    sub_id = manager.get_subscriptions(1, 'group')[0].id
+    with manager._cache_lock:
+        manager._forget(1)
+    assert manager.mark_lesson(1, sub_id, 1)
+    assert manager.get_subscription(1, sub_id).used_count == 1
@@ -0,0 +1,52 @@
+"""Групповая фиксация записей"""
+
+import os
+import threading
+
+import pytest
+
+from utils.durability import DURABILITY_FSYNC_DIR, GroupCommitter
+from utils.fileio import write_private_file
+from utils.storage import FileStorage
+
+
+def _write(committer, directory, name, payload=b'{}'):
+    target = os.path.join(directory, name)
+    temp_file = f'{target}.{threading.get_ident()}.tmp'
+    write_private_file(temp_file, payload)
+    committer.commit(temp_file, target)
+    return target
+
+
+def test_batch_syncs_only_its_own_files(tmp_path, monkeypatch):
+    def host_wide_sync():
+        raise AssertionError("os.sync сбрасывает страницы всех процессов")
+
+    monkeypatch.setattr(os, 'sync', host_wide_sync, raising=False)
+    committer = GroupCommitter(DURABILITY_FSYNC_DIR, window=0.05)
+    threads = [threading.Thread(target=_write, args=(committer, str(tmp_path), f'{index}.json'))
+               for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(os.listdir(tmp_path)) == [f'{index}.json' for index in range(4)]
+    assert committer.writes == 4
+
+
+def test_directory_fsync_error_fails_the_write(tmp_path, monkeypatch):
+    def failing_fsync(directory):
+        raise OSError(5, 'Input/output error')
+
+    committer = GroupCommitter(DURABILITY_FSYNC_DIR, window=0)
+    monkeypatch.setattr(committer, '_fsync_directory', failing_fsync)
+    with pytest.raises(OSError):
+        _write(committer, str(tmp_path), 'chat.json')
+
+
+def test_document_files_are_committed_in_one_batch(tmp_path):
+    committer = GroupCommitter(DURABILITY_FSYNC_DIR, window=0.01)
+    storage = FileStorage(str(tmp_path), committer)
+    storage.save(1, [('.lessons.json', b'{}'), ('.json', b'{"group": []}')])
+    assert committer.batches == 1 and committer.writes == 2
+    assert storage.load(1) == b'{"group": []}'
@@ -0,0 +1,70 @@
+"""Порядок блокировок записи: барьер снимка берется до блокировки документа
+
+Обычная запись, запись в конце единицы работы и снимок данных выполняются
+одновременно в неудобном порядке: обычная запись уже держит блокировку
+документа, единица работы вошла в барьер и ждет эту блокировку, а снимок
+закрывает барьер. При разном порядке блокировок все три потока ждут друг
+друга вечно.
+"""
+
+import threading
+import time
+
+from utils.durability import group_committer
+from utils.storage import FileStorage
+from utils.subscription_manager import SubscriptionManager
+from utils.unit_of_work import unit_of_work
+
+CHAT_ID = 42
+# Пауза, за которую другой поток успевает дойти до ожидания блокировки
+STEP = 0.2
+
+
+class PausingStorage(FileStorage):
+    """Хранилище, в котором первая запись потока `plain` останавливается под блокировкой документа"""
+
+    def __init__(self, data_dir):
+        super().__init__(data_dir)
+        self.paused = threading.Event()
+        self.resume = threading.Event()
+
+    def save(self, chat_id, files):
+        if threading.current_thread().name == 'plain' and not self.paused.is_set():
+            self.paused.set()
+            self.resume.wait(5)
+        super().save(chat_id, files)
+
+
+def test_unit_of_work_plain_write_and_snapshot_do_not_deadlock(tmp_path):
+    storage = PausingStorage(str(tmp_path))
+    manager = SubscriptionManager(storage=storage)
+    assert manager.add_subscription(CHAT_ID, 'group', 'Первый', 8)
+    results = {}
+
+    def plain():
+        results['plain'] = manager.add_subscription(CHAT_ID, 'group', 'Обычная запись', 8)
+
+    def in_unit_of_work():
+        with unit_of_work(CHAT_ID):
+            manager.add_subscription(CHAT_ID, 'group', 'Единица работы', 8)
+        results['uow'] = True
+
+    def snapshot():
+        with group_committer.barrier.exclusive():
+            results['snapshot'] = True
+
+    threads = [threading.Thread(target=plain, name='plain', daemon=True)]
+    threads[0].start()
+    assert storage.paused.wait(5)
+    for target in (in_unit_of_work, snapshot):
+        threads.append(threading.Thread(target=target, daemon=True))
+        threads[-1].start()
+        time.sleep(STEP)
+    storage.resume.set()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert not [thread.name for thread in threads if thread.is_alive()], "потоки записи и снимка заблокировали друг друга"
+    assert results == {'plain': True, 'uow': True, 'snapshot': True}
+    names = {sub.name for sub in SubscriptionManager(storage=FileStorage(str(tmp_path))).get_subscriptions(CHAT_ID, 'group')}
+    assert names == {'Первый', 'Обычная запись', 'Единица работы'}
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from utils.polling import collapse_stale_callbacks  # noqa: E402
+
+
+def press(update_id, chat_id, message_id, data):
+    message = SimpleNamespace(chat_id=chat_id, message_id=message_id)
+    query = SimpleNamespace(id=f"q{update_id}", message=message, inline_message_id=None, data=data)
+    return SimpleNamespace(update_id=update_id, callback_query=query)
+
+
+def text(update_id):
+    return SimpleNamespace(update_id=update_id, callback_query=None)
+
+
+def ids(updates):
+    return [update.update_id for update in updates]
+
+
+def test_only_repeated_presses_of_the_same_button_collapse():
+    updates = [
+        press(1, 10, 100, 'mark:1'),
+        press(2, 10, 100, 'mark:2'),   # другая кнопка того же сообщения
+        press(3, 10, 101, 'mark:1'),   # та же кнопка другого сообщения
+        text(4),
+        press(5, 10, 100, 'mark:1'),
+        press(6, 20, 100, 'mark:1'),   # другой чат
+    ]
+    kept, dropped = collapse_stale_callbacks(updates)
+    assert ids(kept) == [2, 3, 4, 5, 6]
+    assert ids(dropped) == [1]
+
+
+def test_inline_messages_collapse_by_inline_message_id():
+    first, second, other = (
+        SimpleNamespace(update_id=n, callback_query=SimpleNamespace(
+            id=f"q{n}", message=None, inline_message_id=inline, data='open'))
+        for n, inline in ((1, 'a'), (2, 'a'), (3, 'b'))
+    )
+    kept, dropped = collapse_stale_callbacks([first, second, other])
+    assert ids(kept) == [2, 3]
+    assert ids(dropped) == [1]
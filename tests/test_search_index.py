@@ -0,0 +1,91 @@
+from models.domain import Subscription
+from utils.archive import ARCHIVE_SUFFIX
+from utils.search_index import SubscriptionSearchIndex
+from utils.storage import MemoryStorage
+from utils.subscription_manager import SubscriptionManager
+
+CHAT_ID = 42
+
+
+def test_words_of_any_length_match_as_substrings():
+    index = SubscriptionSearchIndex.build([('a', 'Иван Петров'), ('b', 'Анна Ванина'), ('c', 'Мария')])
+    assert sorted(index.search('ван')) == ['a', 'b']
+    assert sorted(index.search('ан')) == ['a', 'b']
+    assert index.search('ария') == ['c']
+    assert index.search('ив пет') == ['a']
+    assert index.search('ванин') == ['b']
+    assert index.search('я м') == ['c']
+    assert index.search('ю') == []
+
+
+def test_removed_names_are_not_found():
+    index = SubscriptionSearchIndex.build([('a', 'Иван Петров'), ('b', 'Анна Ванина')])
+    index.update('b', 'Ольга')
+    assert index.search('ван') == ['a']
+    index.remove('a')
+    assert index.search('ван') == []
+    assert index.search('о') == ['b']
+
+
+class FailingStorage(MemoryStorage):
+    fail = False
+    # Виды файлов, запись которых не отказывает
+    spared = ()
+    # Снимок поискового индекса, пока запись еще не завершилась ошибкой
+    during_save = None
+    seen = None
+
+    def save(self, chat_id, files):
+        if self.fail and not all(kind in self.spared for kind, _ in files):
+            if self.during_save is not None:
+                self.seen = self.during_save()
+            raise OSError('диск заполнен')
+        super().save(chat_id, files)
+
+
+def names(found):
+    return [sub.name for _, sub in found]
+
+
+def test_failed_save_does_not_reach_the_search_index():
+    storage = FailingStorage()
+    manager = SubscriptionManager(storage=storage)
+    assert manager.add_subscription(CHAT_ID, 'group', 'Иван Петров', 8)
+    assert names(manager.search_subscriptions(CHAT_ID, 'ван')) == ['Иван Петров']
+    storage.during_save = lambda: manager._search[CHAT_ID].search('ван')
+
+    original = manager.get_subscriptions(CHAT_ID, 'group')[0]
+    renamed = Subscription('Ольга', original.total_lessons, created_at=original.created_at, id=original.id)
+    storage.fail = True
+    assert not manager.save_subscriptions(CHAT_ID, 'group', [renamed])
+    assert storage.seen == [original.id]
+
+    # Удаление: абонемент остается в индексе поиска, пока документ не записан
+    assert names(manager.search_subscriptions(CHAT_ID, 'ван')) == ['Иван Петров']
+    storage.seen = None
+    assert not manager.delete_subscription(CHAT_ID, original.id)
+    assert storage.seen == [original.id]
+    storage.fail = False
+
+    assert manager.search_subscriptions(CHAT_ID, 'ольг') == []
+    assert names(manager.search_subscriptions(CHAT_ID, 'ван')) == ['Иван Петров']
+    assert manager.delete_subscription(CHAT_ID, original.id)
+    assert manager.search_subscriptions(CHAT_ID, 'ван') == []
+
+
+def test_failed_archive_keeps_the_subscription_searchable():
+    storage = FailingStorage()
+    manager = SubscriptionManager(storage=storage)
+    assert manager.add_subscription(CHAT_ID, 'group', 'Иван Петров', 8)
+    sub_id = manager.get_subscriptions(CHAT_ID, 'group')[0].id
+    assert names(manager.search_subscriptions(CHAT_ID, 'ван')) == ['Иван Петров']
+    storage.during_save = lambda: manager._search[CHAT_ID].search('ван')
+
+    # Архив записывается, отказывает запись документа чата
+    storage.fail, storage.spared = True, (ARCHIVE_SUFFIX,)
+    assert manager.archive_subscriptions(CHAT_ID, [sub_id]) == 0
+    assert storage.seen == [sub_id]
+    storage.fail = False
+
+    assert manager.archive_subscriptions(CHAT_ID, [sub_id]) == 1
+    assert manager.search_subscriptions(CHAT_ID, 'ван') == []
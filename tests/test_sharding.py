@@ -0,0 +1,37 @@
+"""Документ общего списка в кэше процесса, который за ним не закреплен"""
+
+from utils.cache import DocumentCache
+from utils.storage import FileStorage
+from utils.subscription_manager import SubscriptionManager
+
+OWNER = 7
+
+
+def process(data_dir, owns):
+    manager = SubscriptionManager(storage=FileStorage(str(data_dir)), cache=DocumentCache(capacity=0))
+    manager.owns = owns
+    return manager
+
+
+def test_foreign_document_is_revalidated_on_cache_hit(tmp_path):
+    owner = process(tmp_path, lambda chat_id: chat_id == OWNER)
+    other = process(tmp_path, lambda chat_id: chat_id != OWNER)
+    assert owner.add_subscription(OWNER, 'group', 'Иван Петров', 8)
+    sub_id = owner.get_subscriptions(OWNER, 'group')[0].id
+
+    # Процесс участника успел закэшировать документ владельца
+    assert other.get_subscription(OWNER, sub_id).used_count == 0
+    assert owner.mark_lesson(OWNER, sub_id, 1)
+    assert owner.add_subscription(OWNER, 'group', 'Анна', 8)
+
+    assert other.get_subscription(OWNER, sub_id).used_count == 1
+    assert [sub.name for sub in other.get_subscriptions(OWNER, 'group')] == ['Иван Петров', 'Анна']
+
+
+def test_own_documents_are_served_from_the_cache(tmp_path):
+    owner = process(tmp_path, lambda chat_id: chat_id == OWNER)
+    assert owner.add_subscription(OWNER, 'group', 'Иван Петров', 8)
+    owner.get_subscriptions(OWNER, 'group')
+    # Чужая запись в обход процесса-владельца не видна: документ не перечитывается
+    assert process(tmp_path, None).add_subscription(OWNER, 'group', 'Анна', 8)
+    assert [sub.name for sub in owner.get_subscriptions(OWNER, 'group')] == ['Иван Петров']
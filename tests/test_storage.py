@@ -0,0 +1,123 @@
+"""Общие тесты интерфейса Storage для всех хранилищ"""
+
+import threading
+import time
+
+import pytest
+
+from utils.durability import DURABILITY_NONE, GroupCommitter
+from utils.storage import DOCUMENT, FileStorage, MemoryStorage
+
+PAYLOAD = '.lessons.json'
+
+
+@pytest.fixture(params=['file', 'memory'])
+def storage(request, tmp_path):
+    if request.param == 'file':
+        return FileStorage(str(tmp_path), GroupCommitter(DURABILITY_NONE))
+    return MemoryStorage()
+
+
+def test_missing_document(storage):
+    assert storage.load(1) is None
+    assert storage.load(1, PAYLOAD) is None
+    assert storage.delete(1) is False
+    assert list(storage.chat_ids()) == []
+
+
+def test_save_and_load(storage):
+    storage.save(1, [(PAYLOAD, b'payload'), (DOCUMENT, b'index')])
+    assert storage.load(1) == b'index'
+    assert storage.load(1, PAYLOAD) == b'payload'
+    assert storage.load(2) is None
+
+    storage.save(1, [(DOCUMENT, b'index-2')])
+    assert storage.load(1) == b'index-2'
+    assert storage.load(1, PAYLOAD) == b'payload'
+
+
+def test_saved_content_is_a_copy(storage):
+    content = bytearray(b'abc')
+    storage.save(1, [(DOCUMENT, content)])
+    content[0] = ord('x')
+    assert storage.load(1) == b'abc'
+
+
+def test_delete(storage):
+    storage.save(1, [(DOCUMENT, b'index'), (PAYLOAD, b'payload')])
+    assert storage.delete(1, PAYLOAD) is True
+    assert storage.load(1, PAYLOAD) is None
+    assert storage.load(1) == b'index'
+    assert storage.delete(1, PAYLOAD) is False
+
+
+def test_chat_ids_by_kind(storage):
+    for chat_id in (3, 1, 250):
+        storage.save(chat_id, [(DOCUMENT, b'index')])
+    storage.save(7, [(PAYLOAD, b'payload')])
+    assert sorted(storage.chat_ids()) == [1, 3, 250]
+    assert sorted(storage.chat_ids(PAYLOAD)) == [7]
+    storage.delete(3)
+    assert sorted(storage.chat_ids()) == [1, 250]
+
+
+def test_update(storage):
+    assert storage.update(1, lambda raw: (raw or b'') + b'a') == b'a'
+    assert storage.update(1, lambda raw: raw + b'b') == b'ab'
+    assert storage.load(1) == b'ab'
+    # None удаляет документ
+    assert storage.update(1, lambda raw: None) is None
+    assert storage.load(1) is None
+    assert storage.update(2, lambda raw: None) is None
+    assert storage.load(2) is None
+
+
+def test_update_is_atomic(storage):
+    def increment():
+        for _ in range(50):
+            storage.update(1, lambda raw: str(int(raw or b'0') + 1).encode())
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert storage.load(1) == b'200'
+
+
+def test_locked_is_mutually_exclusive(storage):
+    inside = []
+    overlaps = []
+    guard = threading.Lock()
+
+    def worker():
+        for _ in range(20):
+            with storage.locked(1):
+                with guard:
+                    inside.append(1)
+                    if len(inside) > 1:
+                        overlaps.append(len(inside))
+                time.sleep(0.0005)
+                with guard:
+                    inside.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == []
+
+
+def test_locks_are_per_document(storage):
+    acquired = threading.Event()
+
+    def other():
+        with storage.locked(2):
+            acquired.set()
+
+    with storage.locked(1):
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert acquired.wait(5), "блокировка одного документа задержала другой"
+    thread.join()
@@ -0,0 +1,122 @@
+"""Бюджет системных вызовов горячего пути хранилища
+
+Функции os подменяются считающими обертками; загрузка и сохранение
+документа не должны выходить за бюджет. Запись идет без fsync
+(DURABILITY_NONE), чтобы в счет не попадал поток групповой фиксации.
+"""
+
+import os
+from collections import Counter
+
+import pytest
+
+from models.user_data import UserDataManager
+from utils.durability import DURABILITY_NONE, GroupCommitter
+from utils.rosters import RosterRegistry
+from utils.storage import FileStorage
+from utils.subscription_manager import SubscriptionManager
+from utils.tenants import Tenant, activate
+
+COUNTED = ('open', 'read', 'write', 'close', 'replace', 'remove', 'stat', 'lstat', 'chmod', 'makedirs', 'mkdir', 'fsync')
+COUNTED_PATH = ('exists', 'isfile', 'isdir', 'abspath', 'realpath')
+
+# Теплая загрузка - ни одного вызова
+WARM_LOAD = {}
+# Холодная загрузка индекса: open, read до конца файла, close
+COLD_LOAD = {'open': 1, 'read': 2, 'close': 1}
+# Запись абонемента: блокировка документа (open/close файла блокировки),
+# чтение версии (open, read, close) и два документа - отметки и индекс
+# (open, write, close, replace)
+SAVE = {'open': 4, 'read': 2, 'write': 2, 'close': 4, 'replace': 2}
+# Запись данных пользователя: то же с одним документом
+USER_SAVE = {'open': 3, 'read': 2, 'write': 1, 'close': 3, 'replace': 1}
+
+
+class SyscallCounter:
+    """Подмена функций os считающими обертками"""
+
+    def __init__(self, monkeypatch):
+        self.calls = Counter()
+        self.enabled = False
+        for module, names in ((os, COUNTED), (os.path, COUNTED_PATH)):
+            for name in names:
+                if hasattr(module, name):
+                    monkeypatch.setattr(module, name, self._wrap(name, getattr(module, name)))
+
+    def _wrap(self, name, function):
+        def counted(*args, **kwargs):
+            if self.enabled:
+                self.calls[name] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def measure(self, action):
+        self.calls.clear()
+        self.enabled = True
+        try:
+            action()
+        finally:
+            self.enabled = False
+        return dict(self.calls)
+
+
+def assert_within(calls, budget):
+    over = {name: (count, budget.get(name, 0)) for name, count in calls.items() if count > budget.get(name, 0)}
+    assert not over, f"превышен бюджет системных вызовов (вызовов, бюджет): {over}"
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    return SyscallCounter(monkeypatch)
+
+
+@pytest.fixture
+def tenant(tmp_path):
+    """Свои реестр общих списков и данные пользователей, чтобы не трогать каталог data"""
+    committer = GroupCommitter(DURABILITY_NONE)
+    tenant = Tenant(
+        'budget', '', str(tmp_path),
+        rosters=RosterRegistry(str(tmp_path / 'rosters.json'), refresh_interval=3600),
+        user_storage=FileStorage(str(tmp_path / 'users'), committer),
+    )
+    with activate(tenant):
+        yield tenant, committer
+
+
+def test_subscription_manager_budget(tenant, counter):
+    data_dir, committer = tenant[0].data_dir, tenant[1]
+    manager = SubscriptionManager(storage=FileStorage(os.path.join(data_dir, 'subs'), committer))
+    assert manager.add_subscription(7, 'group', 'Первый', 8)
+    # Каталоги созданы и пути проверены первой записью
+    sub_id = manager.get_subscriptions(7, 'group')[0].id
+    manager.mark_lesson(7, sub_id, 1)
+
+    assert_within(counter.measure(lambda: manager.get_subscriptions(7, 'group')), WARM_LOAD)
+    assert_within(counter.measure(lambda: manager.add_subscription(7, 'group', 'Второй', 8)), SAVE)
+    assert_within(counter.measure(lambda: manager.mark_lesson(7, sub_id, 2)), SAVE)
+
+    cold = SubscriptionManager(storage=FileStorage(os.path.join(data_dir, 'subs'), committer))
+    cold.storage.path(7)
+    assert_within(counter.measure(lambda: cold.get_subscriptions(7, 'group')), COLD_LOAD)
+
+
+def test_user_data_manager_budget(tenant, counter, monkeypatch):
+    assert UserDataManager.update_user_data(7, lambda data: setattr(data, 'extra', {'step': 0}))
+
+    assert_within(counter.measure(lambda: UserDataManager.load_user_data(7)), COLD_LOAD)
+    assert_within(
+        counter.measure(lambda: UserDataManager.update_user_data(7, lambda data: setattr(data, 'extra', {'step': 1}))),
+        {name: COLD_LOAD.get(name, 0) + USER_SAVE.get(name, 0) for name in set(COLD_LOAD) | set(USER_SAVE)},
+    )
+    assert UserDataManager.load_user_data(7).extra == {'step': 1}
+
+
+def test_rosters_are_not_checked_on_every_call(tmp_path, counter):
+    registry = RosterRegistry(str(tmp_path / 'rosters.json'), refresh_interval=3600)
+    registry.document_id(1)
+    assert_within(counter.measure(lambda: [registry.document_id(chat_id) for chat_id in range(100)]), WARM_LOAD)
+
+    # Своя запись видна сразу, без ожидания интервала
+    code = registry.invite(10)
+    registry.join(20, code)
+    assert registry.document_id(20) == 10
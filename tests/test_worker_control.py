@@ -0,0 +1,125 @@
+"""Снимок данных, согласованный между процессами-обработчиками"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+from utils import snapshots
+from utils.durability import DURABILITY_NONE, GroupCommitter
+from utils.fileio import read_file, write_private_file
+from utils.worker_control import PoolCommitter, UpdateTracker, WorkerControl, serve_control
+
+PAIR = ('first.json', 'second.json')
+
+
+def _worker(data_dir, connection, stop):
+    """Процесс-обработчик: пишет пары документов одной записью, как единица работы"""
+    committer = GroupCommitter(DURABILITY_NONE)
+    threading.Thread(target=serve_control, args=(connection, committer), daemon=True).start()
+    counter = 0
+    while not stop.is_set():
+        counter += 1
+        with committer.barrier.write():
+            for name in PAIR:
+                target = os.path.join(data_dir, name)
+                write_private_file(f'{target}.tmp', str(counter).encode())
+                committer.commit(f'{target}.tmp', target)
+
+
+def test_snapshot_pauses_worker_writes(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    snapshot_dir = str(tmp_path / 'snapshots')
+    os.makedirs(data_dir)
+    channels = WorkerControl(2)
+    stop = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(target=_worker, args=(os.path.join(data_dir, str(index)), channels.worker_end(index), stop))
+        for index in range(2)
+    ]
+    for index in range(2):
+        os.makedirs(os.path.join(data_dir, str(index)))
+    for process in processes:
+        process.start()
+    channels.started()
+    committer = PoolCommitter(channels, GroupCommitter(DURABILITY_NONE))
+    try:
+        # Снимки делаются, пока процессы пишут
+        while not all(os.path.exists(os.path.join(data_dir, str(index), PAIR[1])) for index in range(2)):
+            time.sleep(0.001)
+        for _ in range(20):
+            name = snapshots.create_snapshot(data_dir, snapshot_dir, committer=committer, archive=False, retention=0)
+            for index in range(2):
+                values = [read_file(os.path.join(snapshot_dir, name, str(index), file_name)) for file_name in PAIR]
+                assert values[0] == values[1], f"снимок застал запись процесса {index} наполовину: {values}"
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(10)
+    assert all(process.exitcode == 0 for process in processes)
+
+
+def test_dead_worker_fails_the_command_but_resumes_the_others(tmp_path):
+    channels = WorkerControl(2)
+    committer = GroupCommitter(DURABILITY_NONE)
+    alive = threading.Thread(target=serve_control, args=(channels.worker_end(0), committer), daemon=True)
+    alive.start()
+    channels.worker_end(1).close()
+    channels.started()
+
+    pool_committer = PoolCommitter(channels, GroupCommitter(DURABILITY_NONE))
+    try:
+        with pool_committer.barrier.exclusive():
+            pass
+    except OSError:
+        pass
+    else:
+        raise AssertionError("команда мертвому процессу должна завершиться ошибкой")
+    # Пауза живого процесса снята: его записи проходят
+    done = threading.Event()
+
+    def write():
+        with committer.barrier.write():
+            done.set()
+
+    threading.Thread(target=write, daemon=True).start()
+    assert done.wait(5)
+
+
+class RecordingStore:
+    def __init__(self):
+        self.offsets = []
+
+    def mark_processed(self, update_id):
+        self.offsets.append(update_id)
+
+
+def test_offset_stops_at_the_first_unprocessed_update():
+    store = RecordingStore()
+    tracker = UpdateTracker(store)
+    for update_id in (10, 11, 12, 13):
+        tracker.dispatched(update_id)
+
+    # Процессы обрабатывают обновления разных чатов не по порядку
+    tracker.processed(12)
+    tracker.processed(10)
+    assert store.offsets == [9, 10]
+
+    # Обновление 11 потеряно (процесс упал): смещение не уходит дальше него
+    tracker.processed(13)
+    assert store.offsets[-1] == 10
+    assert tracker.pending() == 1
+
+    tracker.processed(11)
+    assert store.offsets[-1] == 13 and tracker.pending() == 0
+
+
+def test_follow_reads_processed_updates_until_stopped():
+    store = RecordingStore()
+    tracker = UpdateTracker(store)
+    queue = multiprocessing.Queue()
+    tracker.dispatched(5)
+    queue.put(5)
+    queue.put(None)
+    tracker.follow(queue)
+    assert store.offsets == [5]